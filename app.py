@@ -9,30 +9,42 @@
 # - Sem mensagens/diagnóstico na UI
 # - Corrige pd.NA em f-strings (sem usar `or` com pd.NA)
 # - Mantém toda a lógica de SIGLA e Acessos OK
+# - Núcleo (dados, índices, geocoding, OSRM) em engine.py; lote em batch.py
 # ============================================================
 
+import os
+import tempfile
+import time
+from html import escape
+
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-import unicodedata
-import time
-import requests
-import numpy as np
-import math
-import re
-from typing import List, Tuple
+import folium
+
+from batch import contar_linhas, processar_lote
+from engine import (
+    K_SITES_PROXIMOS, N_CANDIDATOS_ROTA,
+    carregar_indice_sigla, carregar_tecnicos_por_sigla, recarregar_dados,
+    carregar_indice_texto, carregar_gazetteer,
+    buscar_siglas, separar_siglas, tecnicos_por_sigla, buscar_sites_texto,
+    iniciar_preenchimento_coordenadas,
+    fmt_na, SERVICO_URL, proximos_lote, proximos_via_servico,
+    METRICAS_PAINEL, iniciar_servidor_metricas, observar_etapa, resumo_metricas,
+    sites_no_raio,
+    MAPA_ZOOM_MIN, MAPA_ZOOM_MAX, carregar_clusters, clusters_mapa, caixa_visivel, zoom_para_caixa,
+    buscar_siglas_via_servico, buscar_sites_texto_via_servico, sites_no_raio_via_servico,
+    clusters_mapa_via_servico,
+)
 
 # ------------------------------------------------------------
 # Config
 # ------------------------------------------------------------
 st.set_page_config(page_title="Endereços dos Sites RJ", page_icon="📡", layout="wide")
+_inicio_pagina = time.perf_counter()
 
 # ------------------------------------------------------------
-# Secrets (opcional): GEOAPIFY
-# ------------------------------------------------------------
-GEOAPIFY_KEY = (st.secrets.get("GEOAPIFY_KEY", "") or "").strip()
-
-# ------------------------------------------------------------
-# Helper: rerun compatível (Streamlit novo/antigo)
+# Helpers: rerun e HTML embutido compatíveis (Streamlit novo/antigo)
 # ------------------------------------------------------------
 def _rerun():
     if hasattr(st, "rerun"):
@@ -40,387 +52,134 @@ def _rerun():
     else:
         st.experimental_rerun()
 
-# ------------------------------------------------------------
-# Auxiliares
-# ------------------------------------------------------------
-def strip_accents(s: str):
-    if not isinstance(s, str):
-        return s
-    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-
-def haversine_km(lat1, lon1, lat2, lon2):
-    """Distância Haversine em km (vetorizado para lat2/lon2)."""
-    R = 6371.0088
-    lat1 = np.radians(lat1)
-    lon1 = np.radians(lon1)
-    lat2 = np.radians(lat2)
-    lon2 = np.radians(lon2)
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
-    c = 2 * np.arcsin(np.sqrt(a))
-    return R * c
-
-def fmt_na(x, dash="—"):
-    """Substitui pd.NA/NaN/None por '—' evitando TypeError de truthiness com pd.NA."""
-    try:
-        return dash if (x is pd.NA or pd.isna(x)) else x
-    except Exception:
-        return dash if x is None else x
-
-# ------------------------------------------------------------
-# Parâmetros regionais (viés RJ para Nominatim)
-# ------------------------------------------------------------
-# viewbox para Nominatim (lon_min, lat_min, lon_max, lat_max)
-RJ_VIEWBOX = (-43.8, -23.1, -43.0, -22.7)  # melhora match no RJ
-
-# ------------------------------------------------------------
-# Lista de municípios (RJ) + regex para melhor detecção
-# ------------------------------------------------------------
-MUNICIPIOS_RJ = [
-    "Angra dos Reis", "Aperibé", "Araruama", "Areal", "Armação dos Búzios", "Arraial do Cabo",
-    "Barra do Piraí", "Barra Mansa", "Belford Roxo", "Bom Jardim", "Bom Jesus do Itabapoana",
-    "Cabo Frio", "Cachoeiras de Macacu", "Cambuci", "Campos dos Goytacazes", "Cantagalo",
-    "Carapebus", "Cardoso Moreira", "Carmo", "Casimiro de Abreu", "Conceição de Macabu",
-    "Cordeiro", "Duas Barras", "Duque de Caxias", "Engenheiro Paulo de Frontin", "Guapimirim",
-    "Iguaba Grande", "Itaboraí", "Itaguaí", "Italva", "Itaocara", "Itaperuna", "Itatiaia",
-    "Japeri", "Laje do Muriaé", "Macaé", "Macuco", "Magé", "Mangaratiba", "Maricá", "Mendes",
-    "Mesquita", "Miguel Pereira", "Miracema", "Natividade", "Nilópolis", "Niterói",
-    "Nova Friburgo", "Nova Iguaçu", "Paracambi", "Paraíba do Sul", "Parati", "Paty do Alferes",
-    "Petrópolis", "Pinheiral", "Piraí", "Porciúncula", "Porto Real", "Quatis", "Queimados",
-    "Quissamã", "Resende", "Rio Bonito", "Rio Claro", "Rio das Flores", "Rio das Ostras",
-    "Rio de Janeiro", "Santa Maria Madalena", "Santo Antônio de Pádua", "São Fidélis",
-    "São Francisco de Itabapoana", "São Gonçalo", "São João da Barra", "São João de Meriti",
-    "São José de Ubá", "São José do Vale do Rio Preto", "São Pedro da Aldeia",
-    "São Sebastião do Alto", "Sapucaia", "Saquarema", "Seropédica", "Silva Jardim",
-    "Sumidouro", "Tanguá", "Teresópolis", "Trajano de Moraes", "Três Rios", "Valença",
-    "Varre-Sai", "Vassouras", "Volta Redonda"
-]
-MUNI_IDX = {strip_accents(n).lower(): n for n in MUNICIPIOS_RJ}
-_CITY_PATTERNS = {key: re.compile(rf"\b{re.escape(key)}\b") for key in MUNI_IDX.keys()}
-
-def _match_city_base(texto: str) -> str | None:
-    """Tenta casar município num texto (normalizado sem acentos e lower)."""
-    if not isinstance(texto, str) or not texto.strip():
-        return None
-    base = strip_accents(texto).lower()
-    ultimo = None
-    for key, pat in _CITY_PATTERNS.items():
-        if pat.search(base):
-            ultimo = MUNI_IDX[key]
-    return ultimo
-
-def detectar_cidade(nome: str, endereco: str | None = None) -> str | None:
-    """
-    1) Tenta identificar o município no 'nome'
-    2) Se não achou, tenta no 'endereco'
-    """
-    city = _match_city_base(nome)
-    if city:
-        return city
-    if endereco:
-        return _match_city_base(endereco)
-    return None
+def _html_embutido(conteudo: str, altura: int):
+    if hasattr(st, "iframe"):
+        st.iframe(conteudo, height=altura)
+    else:
+        components.html(conteudo, height=altura)
 
 # ------------------------------------------------------------
-# Geocoding — normalização do endereço + Geoapify (opcional) + Nominatim (duas tentativas)
+# Helper: mapa (folium) com os sites agrupados por zoom no servidor
 # ------------------------------------------------------------
-def _normalize_address_for_br(addr: str) -> str:
-    """
-    Se o usuário digitar algo muito curto/sem país/UF, acrescenta 'RJ, Brasil' ou 'Brasil'.
-    - Se já houver 'RJ'/'Brasil', mantém.
-    """
-    if not isinstance(addr, str):
-        return addr
-    a = addr.strip()
-    a_low = strip_accents(a).lower()
-    if (" rj" in a_low) or (" rio de janeiro" in a_low) or (" brasil" in a_low) or (" brazil" in a_low):
-        return a
-    # heurística simples: se só tem 1 parte (sem vírgula), completar com RJ e Brasil
-    if len(a.split(",")) == 1:
-        return f"{a}, RJ, Brasil"
-    # senão, ao menos assegura Brasil
-    return f"{a}, Brasil"
-
-@st.cache_data(show_spinner=False, ttl=60*60)
-def geocode_geoapify(address: str):
-    """
-    Geocodifica um endereço usando Geoapify (se GEOAPIFY_KEY estiver configurada).
-    Retorna (result, dbg):
-      result: {'lat', 'lon', 'formatted'} ou None
-      dbg:    {'provider','status','error_message','raw_sample'}
-    """
-    dbg = {"provider": "geoapify", "status": None, "error_message": None, "raw_sample": None}
-    if not GEOAPIFY_KEY or not address or not address.strip():
-        dbg["status"] = "MISSING_KEY_OR_ADDRESS"
-        return None, dbg
-
-    url = "https://api.geoapify.com/v1/geocode/search"
-    params = {
-        "text": address,
-        "lang": "pt",
-        "filter": "countrycode:br",   # restringe ao Brasil
-        "limit": 1,
-        "apiKey": GEOAPIFY_KEY
-    }
-    try:
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        j = r.json()
-        feats = j.get("features", [])
-        if not feats:
-            dbg["status"] = "ZERO_RESULTS"
-            return None, dbg
-        p = feats[0]["properties"]
-        dbg["status"] = "OK"
-        dbg["raw_sample"] = {"formatted": p.get("formatted")}
-        return {
-            "lat": float(p["lat"]),
-            "lon": float(p["lon"]),
-            "formatted": p.get("formatted") or address
-        }, dbg
-    except requests.exceptions.Timeout:
-        dbg["status"] = "TIMEOUT"
-        return None, dbg
-    except Exception as e:
-        dbg["status"] = "EXCEPTION"
-        dbg["error_message"] = str(e)
-        return None, dbg
-
-@st.cache_data(show_spinner=False, ttl=60*60)
-def geocode_nominatim(address: str, strict_rj: bool = True):
-    """
-    Nominatim (OSM) com duas modalidades:
-      - strict_rj=True  -> usa viewbox do RJ (bounded=1)
-      - strict_rj=False -> remove bounded e busca no Brasil todo
-    Retorna (result, dbg).
-    """
-    dbg = {"provider": "nominatim", "status": None, "error_message": None, "raw_sample": None}
-    address = _normalize_address_for_br(address)
-    if not address or not address.strip():
-        dbg["status"] = "MISSING_ADDRESS"
-        return None, dbg
-    try:
-        time.sleep(1.0)  # respeita limites do serviço público
-        params = {
-            "q": address,
-            "format": "json",
-            "limit": 1,
-            "countrycodes": "br",
-            "accept-language": "pt-BR",
-        }
-        headers = {"User-Agent": "busca-sites-b2b/1.0 (contato: seu-email@exemplo.com)"}
-        if strict_rj:
-            params.update({
-                "viewbox": f"{RJ_VIEWBOX[0]},{RJ_VIEWBOX[1]},{RJ_VIEWBOX[2]},{RJ_VIEWBOX[3]}",
-                "bounded": 1
-            })
-        r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=10)
-        j = r.json()
-        if j:
-            item = j[0]
-            dbg["status"] = "OK"
-            dbg["raw_sample"] = {"display_name": item.get("display_name")}
-            return {
-                "lat": float(item["lat"]),
-                "lon": float(item["lon"]),
-                "formatted": item.get("display_name")
-            }, dbg
+# Só vão para o navegador os grupos da área em volta do centro (o dobro da
+# área visível, para dar folga ao arrastar) no zoom escolhido, mais os sites
+# em destaque. Para ver grupos menores, aumentar o zoom no controle acima do mapa.
+MAPA_ALTURA_PX = 480
+CARTOES_POR_PAGINA = 20
+
+def _mapa(chave: str, destaques: pd.DataFrame, cliente: tuple | None = None):
+    pontos = destaques[["lat", "lon"]].astype(float).dropna()
+    if cliente:
+        pontos = pd.concat([pontos, pd.DataFrame([cliente], columns=["lat", "lon"])])
+    if pontos.empty:
+        st.caption("Sem coordenadas para mostrar no mapa.")
+        return
+    lat_min, lon_min = pontos.min()
+    lat_max, lon_max = pontos.max()
+    centro = ((lat_min + lat_max) / 2, (lon_min + lon_max) / 2)
+    ajuste = zoom_para_caixa(lat_min, lon_min, lat_max, lon_max, altura_px=MAPA_ALTURA_PX)
+    # chave muda com os resultados: uma nova busca volta ao zoom que enquadra os destaques
+    zoom = st.select_slider("Zoom do mapa", options=list(range(MAPA_ZOOM_MIN, MAPA_ZOOM_MAX + 1)), value=ajuste,
+                            key=f"zoom_{chave}_{ajuste}_{centro[0]:.4f}_{centro[1]:.4f}")
+    grupos = CONSULTAS["mapa"](zoom, caixa_visivel(*centro, zoom, 2 * 900, 2 * MAPA_ALTURA_PX))
+
+    m = folium.Map(location=centro, zoom_start=zoom, height=MAPA_ALTURA_PX, control_scale=True)
+    for g in grupos.itertuples(index=False):
+        if g.n == 1:
+            folium.CircleMarker([g.lat, g.lon], radius=4, color="#555555", weight=1, fill=True,
+                                fill_opacity=0.7, tooltip=escape(f"{g.sigla} — {g.nome}")).add_to(m)
         else:
-            dbg["status"] = "ZERO_RESULTS"
-            return None, dbg
-    except requests.exceptions.Timeout:
-        dbg["status"] = "TIMEOUT"
-        return None, dbg
-    except Exception as e:
-        dbg["status"] = "EXCEPTION"
-        dbg["error_message"] = str(e)
-        return None, dbg
-
-def geocode_address(address: str):
-    """
-    Ordem:
-      1) Geoapify (se key)
-      2) Nominatim com viés RJ estrito
-      3) Nominatim sem bounded (apenas BR)
-    """
-    # 1) Geoapify
-    if GEOAPIFY_KEY:
-        res, dbg = geocode_geoapify(address)
-        if res:
-            return res, dbg
-    # 2) Nominatim com RJ estrito
-    res2, dbg2 = geocode_nominatim(address, strict_rj=True)
-    if res2:
-        return res2, dbg2
-    # 3) Nominatim sem bounded (Brasil inteiro)
-    res3, dbg3 = geocode_nominatim(address, strict_rj=False)
-    if res3:
-        return res3, dbg3
-    # nada encontrado
-    return None, {"provider": "none", "status": "ZERO_RESULTS", "error_message": None}
+            lado = 22 + 6 * len(str(g.n))
+            folium.Marker([g.lat, g.lon], tooltip=f"{g.n} sites", icon=folium.DivIcon(
+                icon_size=(lado, lado), icon_anchor=(lado // 2, lado // 2),
+                html=(f'<div style="width:{lado}px;height:{lado}px;line-height:{lado}px;border-radius:50%;'
+                      f'background:rgba(49,130,189,.75);color:#fff;text-align:center;font:bold 11px sans-serif">'
+                      f'{g.n}</div>'),
+            )).add_to(m)
+    for _, row in destaques.dropna(subset=["lat", "lon"]).iterrows():
+        erb_lat, erb_lon = float(row["lat"]), float(row["lon"])
+        popup = (f"<b>{escape(str(row['sigla']))} — {escape(str(row['nome']))}</b><br>"
+                 f"🏙️ {escape(str(fmt_na(row.get('cidade'))))}<br>📌 {escape(str(fmt_na(row.get('endereco'))))}<br>"
+                 f'<a href="https://www.google.com/maps/search/?api=1&query={erb_lat},{erb_lon}" '
+                 f'target="_blank">🗺️ Ver no Google Maps</a>')
+        folium.Marker([erb_lat, erb_lon], tooltip=escape(f"{row['sigla']} — {row['nome']}"),
+                      popup=folium.Popup(popup, max_width=300),
+                      icon=folium.Icon(color="red", icon="signal")).add_to(m)
+    if cliente:
+        folium.Marker(list(cliente), tooltip="Cliente", icon=folium.Icon(color="blue", icon="user")).add_to(m)
+    _html_embutido(m.get_root().render(), MAPA_ALTURA_PX + 10)
+    st.caption(f"{len(grupos)} marcador(es) no zoom {zoom}; números = sites agrupados naquela área.")
 
 # ------------------------------------------------------------
-# Rotas/Matriz — OSRM (sem key)
+# Helper: aviso de rotas degradadas (OSRM lento/fora do ar)
 # ------------------------------------------------------------
-@st.cache_data(show_spinner=False, ttl=15*60)
-def osrm_table(origin_lat: float, origin_lon: float, dests: List[Tuple[float, float]]):
-    """
-    Usa OSRM Table API (router.project-osrm.org) para obter duration/distance.
-    dests: lista [(lat, lon), ...]
-    Retorna (out, dbg):
-      out: [{'distance_m','distance_text','duration_s','duration_text'}, ...]
-      dbg: {'status','error_message'}
-    """
-    dbg = {"status": None, "error_message": None}
-    if not dests:
-        dbg["status"] = "NO_DESTS"
-        return [], dbg
-
-    # OSRM usa ordem lon,lat
-    coords = [(origin_lon, origin_lat)] + [(lon, lat) for (lat, lon) in dests]
-    coord_str = ";".join([f"{lon},{lat}" for (lon, lat) in coords])
-    url = f"https://router.project-osrm.org/table/v1/driving/{coord_str}"
-    params = {"annotations": "duration,distance"}
-
-    try:
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        dbg["status"] = data.get("code", "OK")
-
-        if data.get("code") != "Ok":
-            dbg["error_message"] = data.get("message")
-            return [], dbg
-
-        durations = data.get("durations") or []
-        distances = data.get("distances") or []
-        if not durations or not distances:
-            return [], dbg
-
-        row0_dur = durations[0]  # origem -> todos
-        row0_dis = distances[0]
-
-        out = []
-        for i in range(1, len(row0_dur)):
-            dur = row0_dur[i]
-            dist = row0_dis[i]
-            out.append({
-                "distance_m": None if dist is None else float(dist),
-                "distance_text": None if dist is None else f"{dist/1000:.1f} km",
-                "duration_s": None if dur is None else float(dur),
-                "duration_text": None if dur is None else f"{math.ceil(dur/60)} min",
-            })
-        return out, dbg
-    except requests.exceptions.Timeout:
-        dbg["status"] = "TIMEOUT"
-        return [], dbg
-    except Exception as e:
-        dbg["status"] = "EXCEPTION"
-        dbg["error_message"] = str(e)
-        return [], dbg
-
-# ------------------------------------------------------------
-# Dados principais (aba: enderecos)
-# ------------------------------------------------------------
-@st.cache_data(show_spinner=False)
-def carregar_dados():
-    df = pd.read_excel(
-        "enderecos.xlsx",
-        sheet_name="enderecos",  # <- sua aba real
-        engine="openpyxl",
-    )
-
-    # padronizar nomes de colunas
-    df.columns = df.columns.str.strip().str.lower()
-
-    # renomear para padrão interno
-    df = df.rename(columns={
-        "sigla_da_torre": "sigla",
-        "nome_da_torre": "nome",
-        "endereço": "endereco",
-        "latitude": "lat",
-        "longitude": "lon",
-    })
-
-    # normalização textual
-    for col in ["sigla", "nome", "endereco", "detentora"]:
-        if col in df.columns:
-            df[col] = df[col].astype("string").str.strip()
-
-    # coordenadas com ponto
-    for col in ["lat", "lon"]:
-        if col in df.columns:
-            df[col] = (
-                df[col].astype(str)
-                .str.replace(",", ".", regex=False)
-                .replace("", pd.NA)
-                .astype(float)
-            )
-
-    # garantir detentora
-    if "detentora" not in df.columns:
-        df["detentora"] = pd.NA
-
-    return df
-
-# ------------------------------------------------------------
-# Aba "acessos" (técnicos com status ok)
-# ------------------------------------------------------------
-@st.cache_data(show_spinner=False)
-def carregar_acessos_ok():
-    try:
-        acc = pd.read_excel("enderecos.xlsx", sheet_name="acessos", engine="openpyxl")
-    except Exception:
-        return None
-
-    acc.columns = acc.columns.str.strip().str.lower()
-
-    if "tecnico" not in acc.columns:
-        for alt in ["técnico", "nome_tecnico", "colaborador"]:
-            if alt in acc.columns:
-                acc = acc.rename(columns={alt: "tecnico"})
-                break
-
-    if "sigla" not in acc.columns:
-        for alt in ["sigla_da_torre", "site", "torre"]:
-            if alt in acc.columns:
-                acc = acc.rename(columns={alt: "sigla"})
-                break
-
-    # checagem mínima
-    if "sigla" not in acc.columns or "tecnico" not in acc.columns:
-        return None
-
-    if "status" not in acc.columns:
-        acc["status"] = "ok"
-
-    for c in ["sigla", "tecnico", "status"]:
-        acc[c] = acc[c].astype("string").str.strip()
-
-    def norm(x): return strip_accents(str(x)).lower()
-    acc = acc[acc["status"].apply(norm) == "ok"]
-
-    return acc.reset_index(drop=True)
+def _aviso_rotas(status):
+    if status in (None, "Ok", "OK", "NO_DESTS"):
+        return
+    if status == "PARTIAL":
+        st.warning("⚠️ Serviço de rotas instável: parte das distâncias/tempos de rota não veio.")
+    elif status == "CIRCUIT_OPEN":
+        st.warning("⚠️ Serviço de rotas (OSRM) pausado após falhas seguidas: "
+                   "mostrando só a distância em linha reta. Nova tentativa em instantes.")
+    else:
+        st.warning(f"⚠️ Serviço de rotas (OSRM) sem resposta ({status}): "
+                   "mostrando só a distância em linha reta.")
 
 # ------------------------------------------------------------
-# Carregar bases
+# Carregar bases (e os índices por SIGLA: linhas e técnicos)
 # ------------------------------------------------------------
-df = carregar_dados()
-ACESSOS_OK = carregar_acessos_ok()
+# Com SERVICO_URL o app é só cliente do servico.py: todas as buscas vão por
+# HTTP e a planilha (com seus índices) fica carregada lá, não aqui.
+if SERVICO_URL:
+    CONSULTAS = {"proximos": proximos_via_servico, "siglas": buscar_siglas_via_servico,
+                 "texto": buscar_sites_texto_via_servico, "raio": sites_no_raio_via_servico,
+                 "mapa": clusters_mapa_via_servico}
+    RECARGA, PREENCHIMENTO = {}, {"rodando": False}
+else:
+    CONSULTAS = {"proximos": proximos_lote, "siglas": buscar_siglas, "texto": buscar_sites_texto,
+                 "raio": sites_no_raio, "mapa": clusters_mapa}
+    # planilha alterada em disco: relê só as abas que mudaram (caches de APIs mantidos)
+    RECARGA = recarregar_dados()
+    carregar_indice_sigla()
+    carregar_tecnicos_por_sigla()
+    # busca livre e geocodificação offline: índices montados aqui, não na primeira busca
+    carregar_indice_texto()
+    carregar_gazetteer()
+    # grupos de marcadores do mapa por zoom (montados uma vez por carga)
+    carregar_clusters()
+    # sites sem lat/lon: geocodificados em segundo plano (não bloqueia a página)
+    PREENCHIMENTO = iniciar_preenchimento_coordenadas()
+# /metrics e /metrics.json (Prometheus/JSON) quando METRICAS_PORTA estiver configurada
+iniciar_servidor_metricas()
 
 # ------------------------------------------------------------
 # UI
 # ------------------------------------------------------------
 st.title("📡 Endereços dos Sites RJ")
 
-if st.button("🔄 Atualizar dados (limpar cache)"):
-    st.cache_data.clear()
-    _rerun()
+def _resumo_recarga(resumo: dict) -> str:
+    return "; ".join(
+        f"{aba}: {d['novas']} sigla(s) nova(s), {d['removidas']} removida(s), {d['alteradas']} alterada(s)"
+        for aba, d in resumo.items()
+    )
+
+# o servico.py relê a planilha sozinho a cada requisição
+if not SERVICO_URL and st.button("🔄 Atualizar dados"):
+    RECARGA = recarregar_dados(forcar=True)
+    if not RECARGA:
+        st.info("Planilha sem alterações desde a última carga.")
+if RECARGA:
+    st.success(f"🔄 Planilha atualizada — {_resumo_recarga(RECARGA)}")
+
+if PREENCHIMENTO["rodando"] and PREENCHIMENTO["pendentes"]:
+    st.caption(f"📍 Localizando em segundo plano sites sem coordenadas: "
+               f"{PREENCHIMENTO['feitos']} de {PREENCHIMENTO['pendentes']}.")
 
 # -------------------- BUSCA POR SIGLA (existente) --------------------
 with st.form("form_sigla", clear_on_submit=False):
-    sigla = st.text_input("🔍 Buscar por SIGLA:")
+    sigla = st.text_area(
+        "🔍 Buscar por SIGLA (uma ou várias, separadas por espaço, vírgula ou linha):", height=68
+    )
     submitted = st.form_submit_button("OK")
 
 if submitted:
@@ -428,6 +187,24 @@ if submitted:
 
 sigla_filtro = st.session_state.get("sigla", "")
 
+# -------------------- BUSCA LIVRE (parte da sigla/nome/endereço) --------------------
+busca_livre = st.text_input(
+    "🔎 Buscar por parte da sigla, do nome ou do endereço:",
+    placeholder="ex.: sambodromo, copacab, niteroi icarai",
+)
+
+if busca_livre.strip():
+    achados = CONSULTAS["texto"](busca_livre)
+    if achados.empty:
+        st.caption("Nenhum site parecido.")
+    else:
+        st.dataframe(
+            achados[["sigla", "nome", "cidade", "endereco", "relevancia"]],
+            use_container_width=True, hide_index=True
+        )
+        if st.button("📍 Ver detalhes destes sites"):
+            sigla_filtro = st.session_state["sigla"] = "\n".join(achados["sigla"].astype(str))
+
 # -------------------- BUSCA POR ENDEREÇO (sem diagnóstico) ----------
 st.markdown("---")
 st.subheader("🧭 Buscar por ENDEREÇO do cliente → 3 sites mais próximos")
@@ -436,57 +213,58 @@ with st.form("form_endereco", clear_on_submit=False):
     endereco_cliente = st.text_input(
         "Digite o endereço completo (rua, número, bairro, cidade — RJ de preferência)"
     )
+    col_rota, col_candidatos = st.columns([3, 1])
+    with col_rota:
+        ordenar_por_rota = st.checkbox("Ordenar por tempo de rota (avalia os N mais próximos em linha reta)")
+    with col_candidatos:
+        n_candidatos = st.number_input("N candidatos", min_value=K_SITES_PROXIMOS, max_value=200,
+                                       value=N_CANDIDATOS_ROTA, step=25)
     submitted_endereco = st.form_submit_button("Buscar sites")
 
 if submitted_endereco:
     st.session_state["endereco_cliente"] = endereco_cliente
+    st.session_state["ordenar_por_rota"] = ordenar_por_rota
+    st.session_state["n_candidatos"] = int(n_candidatos)
 
 endereco_filtro = st.session_state.get("endereco_cliente", "")
 
 if endereco_filtro:
-    with st.spinner("Geocodificando endereço e calculando distâncias..."):
-        geo, _ = geocode_address(endereco_filtro)
+    # mesmo caminho do serviço HTTP: com SERVICO_URL o app só repassa a consulta
+    # (k ERBs mais próximas pelo índice espacial + rotas OSRM); sem ela, roda aqui
+    spinner = ("Geocodificando endereço e calculando tempos de rota..."
+               if st.session_state.get("ordenar_por_rota") else "Geocodificando endereço e calculando distâncias...")
+    with st.spinner(spinner):
+        resultado = CONSULTAS["proximos"]([{"endereco": endereco_filtro}], K_SITES_PROXIMOS, rotas=True,
+                              por_rota=bool(st.session_state.get("ordenar_por_rota")),
+                              n_candidatos=st.session_state.get("n_candidatos", N_CANDIDATOS_ROTA))[0]
+    geo = resultado["geo"] if resultado["status"] == "OK" else None
 
     if not geo:
         st.error("❌ Endereço não encontrado. Tente incluir número/bairro/cidade. "
                  "Se persistir, refine o endereço ou tente outro próximo.")
     else:
         lat_cli, lon_cli = geo["lat"], geo["lon"]
-        st.success("✅ Endereço localizado:")
+        if geo.get("provedor") == "offline":
+            st.warning(f"⚠️ Localização aproximada pela base de sites (sem serviço de mapas), "
+                       f"confiança {geo['confianca']:.0%}.")
+        else:
+            st.success("✅ Endereço localizado:")
         st.markdown(
             f"**{geo['formatted']}**  \n"
             f"🧭 **Coordenadas**: {lat_cli:.6f}, {lon_cli:.6f}"
         )
 
-        # Filtra ERBs com coordenadas válidas
-        base = df.dropna(subset=["lat", "lon"]).copy()
-        if base.empty:
+        top3 = pd.DataFrame(resultado["sites"])
+        _aviso_rotas(resultado.get("rotas"))
+
+        _inicio_render = time.perf_counter()
+        if top3.empty:
             st.warning("⚠️ Nenhuma ERB na planilha possui coordenadas válidas.")
         else:
-            base["dist_km_linear"] = haversine_km(lat_cli, lon_cli, base["lat"].values, base["lon"].values)
-            top3 = base.nsmallest(3, "dist_km_linear").copy()
-
-            # OSRM: origem -> destinos top3
-            dm_out, dm_dbg = osrm_table(
-                lat_cli, lon_cli,
-                [(float(r["lat"]), float(r["lon"])) for _, r in top3.iterrows()]
-            )
-
-            if dm_out and len(dm_out) == len(top3) and (dm_dbg.get("status") in ("Ok", "OK", None)):
-                top3 = top3.reset_index(drop=True)
-                top3["dist_rodov_text"] = [x["distance_text"] for x in dm_out]
-                top3["duracao_text"]    = [x["duration_text"] for x in dm_out]
-                top3["duracao_s"]       = [x["duration_s"] for x in dm_out]
-            else:
-                # Mantém a UI estável mesmo se OSRM falhar
-                top3["dist_rodov_text"] = pd.NA
-                top3["duracao_text"]    = pd.NA
-                top3["duracao_s"]       = pd.NA
-
             st.markdown("### 📍 3 sites mais próximos (Quando disponível)")
             mostrar_cols = [c for c in [
                 "sigla", "nome", "detentora", "endereco", "lat", "lon",
-                "dist_km_linear", "dist_rodov_text", "duracao_text"
+                "dist_km_linear", "dist_rodov_text", "duracao_text", "coord_derivada"
             ] if c in top3.columns]
             st.dataframe(
                 top3[mostrar_cols].assign(dist_km_linear=lambda d: d["dist_km_linear"].round(3)),
@@ -508,6 +286,7 @@ if endereco_filtro:
                     f"🚗 Rota: {dist_rodov_text}  \n"
                     f"⏱️ Tempo: {duracao_text}  \n"
                     f"📌 Coords: {erb_lat:.6f}, {erb_lon:.6f}"
+                    + (" *(estimadas pelo endereço)*" if row.get("coord_derivada") else "")
                 )
                 st.markdown(title + "  \n" + meta)
                 cols = st.columns(2)
@@ -516,21 +295,90 @@ if endereco_filtro:
                 with cols[1]:
                     st.link_button("🚗 Traçar rota a partir do cliente", rota)
                 st.markdown("---")
+            with st.expander("🗺️ Mapa do cliente e dos sites próximos"):
+                _mapa("endereco", top3, cliente=(lat_cli, lon_cli))
+        observar_etapa("ui_resultado_endereco", time.perf_counter() - _inicio_render)
+
+        # Todos os sites num raio (e, opcionalmente, a até X minutos de carro)
+        with st.expander("📏 Todos os sites num raio do cliente"):
+            with st.form("form_raio", clear_on_submit=False):
+                raio_km = st.number_input("Raio (km, linha reta)", min_value=0.1, max_value=500.0,
+                                          value=5.0, step=1.0)
+                tempo_max = st.number_input("Tempo máximo de carro (min, 0 = sem filtro de rota)",
+                                            min_value=0, max_value=240, value=0, step=5)
+                submitted_raio = st.form_submit_button("Listar sites")
+            if submitted_raio:
+                st.session_state["raio"] = (raio_km, tempo_max)
+
+            if st.session_state.get("raio"):
+                raio_km, tempo_max = st.session_state["raio"]
+                with st.spinner("Calculando tempos de rota..." if tempo_max else "Buscando sites..."):
+                    no_raio, raio_dbg = CONSULTAS["raio"](lat_cli, lon_cli, raio_km, tempo_max or None)
+                if tempo_max:
+                    _aviso_rotas(raio_dbg["status"])
+                    st.success(f"🚗 {len(no_raio)} site(s) a até {tempo_max} min de carro "
+                               f"(e {raio_km:g} km em linha reta).")
+                    if raio_dbg["sem_rota"] or raio_dbg["nao_avaliados"]:
+                        st.caption(f"Sem tempo de rota: {raio_dbg['sem_rota']} site(s); "
+                                   f"não avaliados (mais distantes): {raio_dbg['nao_avaliados']}.")
+                else:
+                    st.success(f"📏 {len(no_raio)} site(s) a até {raio_km:g} km em linha reta.")
+                if not no_raio.empty:
+                    cols_raio = [c for c in [
+                        "sigla", "nome", "cidade", "detentora", "endereco", "lat", "lon",
+                        "dist_km_linear", "dist_rodov_text", "duracao_text"
+                    ] if c in no_raio.columns]
+                    tabela_raio = no_raio[cols_raio].assign(dist_km_linear=lambda d: d["dist_km_linear"].round(3))
+                    st.dataframe(tabela_raio, use_container_width=True, hide_index=True)
+                    st.download_button("⬇️ Baixar lista (CSV)", tabela_raio.to_csv(index=False).encode("utf-8"),
+                                       file_name="sites_no_raio.csv", mime="text/csv")
+
+# -------------------- LOTE: PLANILHA DE ENDEREÇOS --------------------
+with st.expander("📄 Buscar em lote (planilha de endereços → sites mais próximos)"):
+    arquivo_lote = st.file_uploader("CSV ou XLSX com uma coluna de endereço", type=["csv", "xlsx"])
+    col_lote = st.text_input("Coluna do endereço (vazio = detectar automaticamente)")
+    rotas_lote = st.checkbox("Incluir distância/tempo de rota (OSRM)", key="rotas_lote")
+    if arquivo_lote is not None and st.button("Processar lote"):
+        barra = st.progress(0.0, text="Processando...")
+        with tempfile.TemporaryDirectory() as tmp:
+            entrada = os.path.join(tmp, os.path.basename(arquivo_lote.name))
+            with open(entrada, "wb") as f:
+                f.write(arquivo_lote.getbuffer())
+            saida = os.path.join(tmp, "resultado.csv")
+            try:
+                total = contar_linhas(entrada)
+                resumo = processar_lote(
+                    entrada, saida, coluna=col_lote.strip() or None, k=K_SITES_PROXIMOS,
+                    rotas=rotas_lote, retomar=False,
+                    ao_progredir=lambda n: barra.progress(min(1.0, n / max(total, 1)),
+                                                          text=f"{n} de {total} endereço(s) processado(s)..."),
+                )
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            else:
+                barra.progress(1.0, text="Concluído")
+                st.success(f"✅ {resumo['geocodificadas']} de {resumo['linhas']} endereço(s) localizados "
+                           f"em {resumo['segundos']} s.")
+                with open(saida, "rb") as f:
+                    st.download_button("⬇️ Baixar resultado (CSV)", f.read(),
+                                       file_name="sites_proximos.csv", mime="text/csv")
 
 st.markdown("---")
 
 # -------------------- RESULTADO DA BUSCA POR SIGLA (existente) --------------------
-if sigla_filtro:
-    df_f = df[df["sigla"].astype(str).str.upper() == str(sigla_filtro).upper()].copy()
+siglas_pedidas = separar_siglas(sigla_filtro)
+if siglas_pedidas:
+    df_f, siglas_faltando = CONSULTAS["siglas"](siglas_pedidas)
 else:
-    df_f = pd.DataFrame()
+    df_f, siglas_faltando = pd.DataFrame(), []
+
+if len(siglas_pedidas) > 1 and siglas_faltando:
+    st.caption(f"Não encontrada(s) ({len(siglas_faltando)}): " + ", ".join(siglas_faltando))
 
+_inicio_render = time.perf_counter()
 if df_f.empty:
     st.warning("⚠️ Nenhum site encontrado.")
 else:
-    # Detecção de cidade aprimorada: tenta no 'nome' e, se não, no 'endereco'
-    df_f["cidade"] = df_f.apply(lambda r: detectar_cidade(r.get("nome"), r.get("endereco")), axis=1)
-
     st.success(f"🔎 {len(df_f)} site(s) encontrado(s).")
 
     st.dataframe(
@@ -538,35 +386,72 @@ else:
         use_container_width=True
     )
 
-    st.markdown("### 📍 Detalhes do(s) site(s) encontrado(s)")
+    # cartões paginados: o custo de desenhar não cresce com o número de siglas encontradas
+    paginas = -(-len(df_f) // CARTOES_POR_PAGINA)
+    if st.session_state.get("pagina_siglas_filtro") != sigla_filtro or st.session_state.get("pagina_siglas", 1) > paginas:
+        st.session_state["pagina_siglas_filtro"] = sigla_filtro
+        st.session_state["pagina_siglas"] = 1
+    pagina = 1
+    if paginas > 1:
+        pagina = st.selectbox(f"Página ({CARTOES_POR_PAGINA} sites por página)", list(range(1, paginas + 1)),
+                              format_func=lambda p: f"{p} de {paginas}", key="pagina_siglas")
+    df_pagina = df_f.iloc[(pagina - 1) * CARTOES_POR_PAGINA: pagina * CARTOES_POR_PAGINA]
 
-    def tecnicos_por_sigla(sig: str):
-        if ACESSOS_OK is None or ACESSOS_OK.empty:
-            return []
-        temp = ACESSOS_OK[ACESSOS_OK["sigla"].astype(str).str.upper() == str(sig).upper()]
-        return sorted(temp["tecnico"].dropna().unique().tolist())
+    with st.expander("🗺️ Mapa destes sites e das torres em volta"):
+        _mapa("siglas", df_pagina)
 
-    for _, row in df_f.iterrows():
+    st.markdown("### 📍 Detalhes do(s) site(s) encontrado(s)")
+
+    for _, row in df_pagina.iterrows():
         st.markdown(f"**{row['sigla']} — {row['nome']}**")
 
         if pd.notna(row.get("lat")) and pd.notna(row.get("lon")):
             url = f"https://www.google.com/maps/search/?api=1&query={row['lat']},{row['lon']}"
             st.link_button("🗺️ Ver no Google Maps", url, type="primary")
+            if row.get("coord_derivada"):
+                st.caption("Coordenadas estimadas pelo endereço (ausentes na planilha).")
 
         det = row["detentora"] if pd.notna(row["detentora"]) else "—"
         st.markdown(
-            f"🏙️ **Cidade:** {row.get('cidade') or '—'}  \n"
+            f"🏙️ **Cidade:** {fmt_na(row.get('cidade'))}  \n"
             f"🏢 **Detentora:** {det}  \n"
             f"📌 **Endereço:** {row['endereco']}"
         )
 
-        tecnicos = tecnicos_por_sigla(row["sigla"])
+        # pelo serviço os técnicos já vêm em cada site
+        tecnicos = row["tecnicos"] if "tecnicos" in df_f.columns else tecnicos_por_sigla(row["sigla"])
         lista_md = "\n".join([f"- {t}" for t in tecnicos]) if tecnicos else "—"
         st.info(f"**👤 Técnicos com acesso liberado:**\n{lista_md}")
 
         st.markdown("---")
+    observar_etapa("ui_resultado_sigla", time.perf_counter() - _inicio_render)
+
+# -------------------- PAINEL DE MÉTRICAS (opcional: METRICAS_PAINEL=1) --------------------
+if METRICAS_PAINEL:
+    with st.expander("🛠️ Métricas deste processo (tempo por etapa, provedores, caches)"):
+        metricas = resumo_metricas()
+        if not metricas["etapas"]:
+            st.caption("Nenhuma etapa medida ainda.")
+        else:
+            st.markdown("**⏱️ Etapas** (p50/p95 estimados pelos baldes do histograma)")
+            etapas = pd.DataFrame(metricas["etapas"])
+            etapas["metrica"] = etapas["metrica"].str.replace("busca_sites_", "", regex=False)
+            st.dataframe(etapas,
+                         use_container_width=True, hide_index=True)
+        st.markdown("**🩺 Provedores** (circuit breaker e timeout adaptativo)")
+        st.dataframe(pd.DataFrame(metricas["provedores"]), use_container_width=True, hide_index=True)
+        cols = st.columns(3)
+        for col, (chave, titulo) in zip(cols, [("requisicoes", "🌐 Requisições por status"),
+                                               ("retries", "🔁 Retries"), ("cache", "🗄️ Caches")]):
+            with col:
+                st.markdown(f"**{titulo}**")
+                if metricas[chave]:
+                    st.dataframe(pd.DataFrame(metricas[chave]), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("—")
 
 st.caption("❤️ Desenvolvido por Raphael Robles - Stay hungry, stay foolish ! 🚀")
+observar_etapa("ui_pagina", time.perf_counter() - _inicio_pagina)
 
 
 
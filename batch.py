@@ -0,0 +1,318 @@
+# ============================================================
+# 📄 Lote: planilha de endereços de clientes → sites mais próximos
+# - Lê CSV/XLSX em blocos (streaming), sem carregar o arquivo inteiro
+# - Geocodifica em paralelo (respeitando o rate limit de cada provedor
+#   e aproveitando o cache SQLite de engine.geocode_address)
+# - Casa os k sites mais próximos em lote (Haversine vetorizado)
+# - Opcional: tempo/distância de rota via OSRM
+# - Grava o resultado bloco a bloco (CSV ou Parquet) e retoma de onde parou
+#
+# Uso:
+#   python batch.py clientes.xlsx resultado.csv --coluna endereco -k 3 --rotas
+# ============================================================
+
+import argparse
+import csv
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import openpyxl
+
+from engine import (
+    K_SITES_PROXIMOS, carregar_dados, geocode_address, nearest_sites_lote, rotas_para_sites,
+)
+
+TAMANHO_BLOCO = 200
+WORKERS_GEOCODE = 4
+COLUNAS_ENDERECO = ["endereco", "endereço", "endereco_cliente", "address", "logradouro"]
+
+# ------------------------------------------------------------
+# Entrada (streaming em blocos)
+# ------------------------------------------------------------
+def _nome_arquivo(entrada) -> str:
+    return str(getattr(entrada, "name", entrada))
+
+def _cabecalho_csv(entrada) -> str:
+    if hasattr(entrada, "read"):
+        pos = entrada.tell()
+        linha = entrada.readline()
+        entrada.seek(pos)
+        return linha.decode("utf-8-sig", errors="replace") if isinstance(linha, bytes) else linha
+    with open(entrada, encoding="utf-8-sig", errors="replace", newline="") as f:
+        return f.readline()
+
+def separador_csv(entrada) -> str:
+    """
+    Separador detectado só pela linha de cabeçalho (',' ';' ou tab). CSV de uma
+    coluna só (o caso mais comum: só 'endereco') não tem separador: vale ','.
+    """
+    try:
+        return csv.Sniffer().sniff(_cabecalho_csv(entrada), delimiters=",;\t").delimiter
+    except csv.Error:
+        return ","
+
+def ler_blocos(entrada, tamanho: int = TAMANHO_BLOCO, pular: int = 0, sep: str | None = None):
+    """
+    Gera DataFrames de até `tamanho` linhas, ignorando as `pular` primeiras linhas de dados.
+    sep=None detecta o separador do CSV pelo cabeçalho.
+    """
+    if _nome_arquivo(entrada).lower().endswith((".xlsx", ".xlsm")):
+        wb = openpyxl.load_workbook(entrada, read_only=True, data_only=True)
+        try:
+            linhas = wb.worksheets[0].iter_rows(values_only=True)
+            cab = [str(c).strip() if c is not None else f"col{i}" for i, c in enumerate(next(linhas, ()))]
+            buf = []
+            for i, row in enumerate(linhas):
+                if i < pular:
+                    continue
+                buf.append(list(row[:len(cab)]) + [None] * (len(cab) - len(row)))
+                if len(buf) == tamanho:
+                    yield pd.DataFrame(buf, columns=cab)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=cab)
+        finally:
+            wb.close()
+    else:
+        # ';' é o padrão do Excel em pt-BR; o sniffer do pandas (sep=None) olha as
+        # linhas de dados e quebra CSV de uma coluna em letras, por isso só o cabeçalho
+        yield from pd.read_csv(entrada, sep=sep or separador_csv(entrada), dtype=str, chunksize=tamanho,
+                               skiprows=range(1, pular + 1), encoding="utf-8-sig")
+
+def contar_linhas(entrada, sep: str | None = None) -> int:
+    """Linhas de dados de `entrada`, contadas como processar_lote as conta (para a barra de progresso)."""
+    pos = entrada.tell() if hasattr(entrada, "read") else None
+    try:
+        return sum(len(b) for b in ler_blocos(entrada, 10_000, sep=sep))
+    finally:
+        if pos is not None:
+            entrada.seek(pos)
+
+def _coluna_endereco(colunas, coluna: str | None) -> str:
+    if coluna:
+        if coluna not in colunas:
+            raise ValueError(f"Coluna '{coluna}' não encontrada. Colunas: {list(colunas)}")
+        return coluna
+    normal = {str(c).strip().lower(): c for c in colunas}
+    for alt in COLUNAS_ENDERECO:
+        if alt in normal:
+            return normal[alt]
+    return colunas[0]
+
+# ------------------------------------------------------------
+# Saída incremental + progresso (para retomar após falha)
+# ------------------------------------------------------------
+def _checar_saida(saida: str):
+    """Falha antes de processar qualquer linha se a saída pedida não puder ser gravada."""
+    if saida.lower().endswith(".parquet") and not any(
+            importlib.util.find_spec(m) for m in ("pyarrow", "fastparquet")):
+        raise ValueError("Saída .parquet requer o pacote opcional pyarrow (pip install pyarrow); "
+                         "ou grave em .csv.")
+
+class _Escritor:
+    """
+    CSV: um arquivo, anexado a cada bloco (na retomada é truncado no último bloco confirmado).
+    Parquet: uma pasta com part-00000.parquet, part-00001.parquet... (requer pyarrow).
+    """
+    def __init__(self, saida: str, estado: dict):
+        self.saida = saida
+        self.parquet = saida.lower().endswith(".parquet")
+        if self.parquet:
+            if not estado.get("linhas") and os.path.exists(saida):
+                shutil.rmtree(saida) if os.path.isdir(saida) else os.remove(saida)
+            os.makedirs(saida, exist_ok=True)
+            self.partes = int(estado.get("partes", 0))
+        else:
+            modo = "r+b" if estado.get("linhas") and os.path.exists(saida) else "wb"
+            self.f = open(saida, modo)
+            self.f.truncate(int(estado.get("bytes", 0)) if modo == "r+b" else 0)
+            self.f.seek(0, os.SEEK_END)
+
+    def escrever(self, bloco: pd.DataFrame) -> dict:
+        if self.parquet:
+            bloco.to_parquet(os.path.join(self.saida, f"part-{self.partes:05d}.parquet"), index=False)
+            self.partes += 1
+            return {"partes": self.partes}
+        bloco.to_csv(self.f, index=False, header=self.f.tell() == 0, encoding="utf-8")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {"bytes": self.f.tell()}
+
+    def fechar(self):
+        if not self.parquet:
+            self.f.close()
+
+def _arquivo_progresso(saida: str) -> str:
+    return saida.rstrip("/\\") + ".progresso.json"
+
+def _impressao_entrada(entrada, amostra: int = 1 << 20) -> str:
+    """Tamanho + sha1 do primeiro MiB: distingue um arquivo novo com o mesmo nome."""
+    h = hashlib.sha1()
+    if hasattr(entrada, "read"):
+        pos = entrada.tell()
+        entrada.seek(0, os.SEEK_END)
+        tamanho = entrada.tell()
+        entrada.seek(0)
+        inicio = entrada.read(amostra)
+        entrada.seek(pos)
+        h.update(inicio.encode("utf-8") if isinstance(inicio, str) else inicio)
+    else:
+        tamanho = os.path.getsize(entrada)
+        with open(entrada, "rb") as f:
+            h.update(f.read(amostra))
+    return f"{tamanho}:{h.hexdigest()}"
+
+def _ler_progresso(saida: str, entrada_nome: str, impressao: str) -> dict:
+    try:
+        with open(_arquivo_progresso(saida), encoding="utf-8") as f:
+            estado = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # mesmo nome não basta: o conteúdo da entrada tem de ser o mesmo da execução interrompida
+    if estado.get("entrada") != entrada_nome or estado.get("impressao") != impressao:
+        return {}
+    return estado
+
+def _gravar_progresso(saida: str, estado: dict):
+    tmp = _arquivo_progresso(saida) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(tmp, _arquivo_progresso(saida))
+
+# ------------------------------------------------------------
+# Processamento de um bloco
+# ------------------------------------------------------------
+def _geocodificar(enderecos, pool: ThreadPoolExecutor):
+    def um(addr):
+        if not isinstance(addr, str) or not addr.strip():
+            return None, {"provider": None, "status": "MISSING_ADDRESS"}
+        # sequencial por endereço: em lote vale mais a vazão que o hedge
+        return geocode_address(addr, concorrente=False)
+    return list(pool.map(um, enderecos))
+
+def _rotas(lats, lons, pos, base, pool: ThreadPoolExecutor):
+    """Para cada linha com sites casados: lista de resultados de rotas_para_sites (ou None)."""
+    def uma(i):
+        p = pos[i][pos[i] >= 0]
+        if not len(p):
+            return None
+        dests = list(zip(base["lat"].to_numpy()[p].astype(float), base["lon"].to_numpy()[p].astype(float)))
+        # cache persistente de rotas: clientes da mesma célula reaproveitam os pares já calculados
+        out, dbg = rotas_para_sites(float(lats[i]), float(lons[i]), base["sigla"].to_numpy()[p].tolist(), dests)
+        return out if out and len(out) == len(p) else None
+    return list(pool.map(uma, range(len(lats))))
+
+def _campo_rota(rts, j: int, campo: str, escala: float):
+    vals = []
+    for r in rts:
+        v = r[j][campo] if r and len(r) > j else None
+        vals.append(np.nan if v is None else round(v / escala, 2))
+    return vals
+
+def processar_bloco(bloco: pd.DataFrame, col: str, k: int, rotas: bool, pool: ThreadPoolExecutor):
+    base = carregar_dados()
+    geos = _geocodificar(bloco[col].tolist(), pool)
+
+    out = bloco.reset_index(drop=True).copy()
+    out["geo_lat"] = [g["lat"] if g else np.nan for g, _ in geos]
+    out["geo_lon"] = [g["lon"] if g else np.nan for g, _ in geos]
+    out["geo_endereco"] = [g["formatted"] if g else None for g, _ in geos]
+    out["geo_provedor"] = [d.get("provider") for _, d in geos]
+    out["geo_status"] = ["OK" if g else d.get("status") for g, d in geos]
+
+    lats, lons = out["geo_lat"].to_numpy(dtype=float), out["geo_lon"].to_numpy(dtype=float)
+    pos, dist = nearest_sites_lote(lats, lons, k, base=base)
+    rts = _rotas(lats, lons, pos, base, pool) if rotas else None
+
+    siglas, nomes = base["sigla"].to_numpy(dtype=object), base["nome"].to_numpy(dtype=object)
+    for j in range(k):
+        pj = pos[:, j]
+        tem = pj >= 0
+        out[f"site{j + 1}_sigla"] = np.where(tem, siglas[np.maximum(pj, 0)], None)
+        out[f"site{j + 1}_nome"] = np.where(tem, nomes[np.maximum(pj, 0)], None)
+        out[f"site{j + 1}_dist_km"] = np.round(dist[:, j], 3)
+        if rotas:
+            out[f"site{j + 1}_rota_km"] = _campo_rota(rts, j, "distance_m", 1000)
+            out[f"site{j + 1}_tempo_min"] = _campo_rota(rts, j, "duration_s", 60)
+    return out
+
+# ------------------------------------------------------------
+# Pipeline
+# ------------------------------------------------------------
+def processar_lote(entrada, saida: str, coluna: str | None = None, k: int = K_SITES_PROXIMOS,
+                   rotas: bool = False, workers: int = WORKERS_GEOCODE,
+                   tamanho_bloco: int = TAMANHO_BLOCO, retomar: bool = True, ao_progredir=None,
+                   sep: str | None = None) -> dict:
+    """
+    Processa `entrada` (caminho ou arquivo CSV/XLSX) e grava em `saida` (.csv ou .parquet).
+    sep: separador do CSV (None = detectar pelo cabeçalho).
+    Se retomar=True e houver <saida>.progresso.json da mesma entrada (nome, tamanho e
+    hash do início do arquivo), continua do último bloco gravado.
+    ao_progredir(linhas_processadas) é chamado a cada bloco.
+    Retorna {'linhas', 'geocodificadas', 'segundos', 'retomado_de'}.
+    """
+    _checar_saida(saida)
+    nome = os.path.basename(_nome_arquivo(entrada))
+    impressao = _impressao_entrada(entrada)
+    estado = _ler_progresso(saida, nome, impressao) if retomar else {}
+    feitas = retomado_de = int(estado.get("linhas", 0))
+    inicio, ok = time.monotonic(), 0
+
+    escritor = _Escritor(saida, estado)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="lote") as pool:
+            col = None
+            for bloco in ler_blocos(entrada, tamanho_bloco, pular=feitas, sep=sep):
+                col = col or _coluna_endereco(list(bloco.columns), coluna)
+                res = processar_bloco(bloco, col, k, rotas, pool)
+                ok += int((res["geo_status"] == "OK").sum())
+                feitas += len(bloco)
+                estado = {"entrada": nome, "impressao": impressao, "linhas": feitas, **escritor.escrever(res)}
+                _gravar_progresso(saida, estado)
+                if ao_progredir:
+                    ao_progredir(feitas)
+    finally:
+        escritor.fechar()
+
+    # terminou: não há o que retomar
+    try:
+        os.remove(_arquivo_progresso(saida))
+    except OSError:
+        pass
+    return {"linhas": feitas, "geocodificadas": ok, "segundos": round(time.monotonic() - inicio, 2),
+            "retomado_de": retomado_de}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Geocodifica uma lista de endereços e encontra os sites mais próximos.")
+    ap.add_argument("entrada", help="CSV ou XLSX com os endereços")
+    ap.add_argument("saida", help="arquivo .csv ou pasta .parquet de saída")
+    ap.add_argument("--coluna", help="coluna com o endereço (padrão: detecta 'endereco'/'address'...)")
+    ap.add_argument("-k", type=int, default=K_SITES_PROXIMOS, help="sites por endereço")
+    ap.add_argument("--rotas", action="store_true", help="inclui distância/tempo de rota (OSRM)")
+    ap.add_argument("--workers", type=int, default=WORKERS_GEOCODE, help="geocodificações em paralelo")
+    ap.add_argument("--bloco", type=int, default=TAMANHO_BLOCO, help="linhas por bloco gravado")
+    ap.add_argument("--sem-retomar", action="store_true", help="ignora progresso anterior e recomeça")
+    ap.add_argument("--sep", help="separador do CSV (padrão: detecta ',' ';' ou tab pelo cabeçalho)")
+    args = ap.parse_args(argv)
+
+    def progresso(n):
+        print(f"\r{n} linhas processadas", end="", file=sys.stderr, flush=True)
+
+    try:
+        resumo = processar_lote(args.entrada, args.saida, args.coluna, args.k, args.rotas, args.workers,
+                                args.bloco, not args.sem_retomar, progresso, args.sep)
+    except ValueError as e:
+        ap.error(str(e))
+    print(file=sys.stderr)
+    print(json.dumps(resumo, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
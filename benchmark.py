@@ -0,0 +1,391 @@
+# ============================================================
+# ⏱️ Benchmark: inventários sintéticos + provedores falsos com latência
+# - Gera planilhas de sites (10 mil a 1 milhão de linhas) dentro do RJ_VIEWBOX
+# - Mede os caminhos quentes de engine.py (carga, k-NN, raio, cidade, sigla,
+#   busca livre) com repetições, mediana/p95 e pico de memória (tracemalloc)
+# - Geocodificação/rotas contra o servidor falso local (fake_osm_server.py)
+#   com latência e taxa de erro configuráveis
+# - Resultado em JSON; --comparar aponta regressões contra uma execução anterior
+#
+# Uso:
+#   python benchmark.py --tamanhos 10000,100000 --saida bench.json
+#   python benchmark.py --tamanhos 1000000 --latencia-ms 80 --taxa-erro 0.05 \
+#       --comparar bench.json --saida bench-novo.json
+# ============================================================
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import openpyxl
+
+import fake_osm_server
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+TAMANHOS = (10_000, 100_000)
+REPETICOES = 5
+CONSULTAS = 200            # consultas por repetição nas etapas por ponto/sigla/texto
+ORIGENS_LOTE = 1_000
+ENDERECOS_GEOCODE = 20
+DESTINOS_ROTA = 200
+DETENTORAS = ["ATC", "BTC", "OI", "QMC", "SBA", "SYTEX", "TBSA", "WINITY"]
+LOGRADOUROS = ["RUA", "AVENIDA", "ESTRADA", "TRAVESSA", "PRAÇA", "RODOVIA"]
+SILABAS = ["BA", "CA", "DA", "FE", "GO", "JU", "LI", "MA", "NO", "PE", "RI", "SA", "TA", "VI", "ZE", "ÇÃO"]
+
+# ------------------------------------------------------------
+# Planilha sintética
+# ------------------------------------------------------------
+def _sigla(i: int) -> str:
+    """Sigla única de 4+ caracteres (base 36)."""
+    alfabeto = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    s = ""
+    while True:
+        i, r = divmod(i, 36)
+        s = alfabeto[r] + s
+        if not i:
+            return s.rjust(4, "0")
+
+def gerar_planilha(caminho: str, n: int, viewbox, municipios, seed: int = 0):
+    """Grava um enderecos.xlsx com n sites (abas 'enderecos' e 'acessos'), no formato da planilha real."""
+    rng = random.Random(seed)
+    ruas = ["".join(rng.choice(SILABAS) for _ in range(rng.randint(2, 4))) for _ in range(2_000)]
+    lon_min, lat_min, lon_max, lat_max = viewbox
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("enderecos")
+    ws.append(["sigla_da_torre", "nome_da_torre", "detentora", "endereço", "LATITUDE", "LONGITUDE"])
+    for i in range(n):
+        cidade = rng.choice(municipios)
+        rua = rng.choice(ruas)
+        sem_coord = rng.random() < 0.01
+        ws.append([
+            _sigla(i),
+            f"{cidade.upper()} - {rua} {i % 97}",
+            rng.choice(DETENTORAS),
+            f"{rng.choice(LOGRADOUROS)} {rua}, {rng.randint(1, 3000)}",
+            None if sem_coord else f"{rng.uniform(lat_min, lat_max):.6f}".replace(".", ","),
+            None if sem_coord else f"{rng.uniform(lon_min, lon_max):.6f}".replace(".", ","),
+        ])
+    ws = wb.create_sheet("acessos")
+    ws.append(["sigla", "tecnico"])
+    for i in range(0, n, 2):
+        ws.append([_sigla(i), f"TECNICO {rng.randint(1, 500)}"])
+    tmp = caminho + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, caminho)
+
+# ------------------------------------------------------------
+# Medição
+# ------------------------------------------------------------
+def medir(nome: str, fn, repeticoes: int = REPETICOES, por: int = 1, preparar=None, memoria: bool = True,
+          **extra) -> dict:
+    """
+    Roda fn() `repeticoes` vezes (preparar() antes de cada uma, fora do tempo) e,
+    se memoria=True, mais uma vez sob tracemalloc para o pico alocado.
+    Tempos em ms por operação (por = operações feitas em cada chamada).
+    Se fn retornar um Counter, ele é somado em 'detalhes' (ex.: contagem de status).
+    """
+    tempos, detalhes = [], Counter()
+    for _ in range(max(1, repeticoes)):
+        if preparar:
+            preparar()
+        t = time.perf_counter()
+        ret = fn()
+        tempos.append((time.perf_counter() - t) * 1000 / por)
+        if isinstance(ret, Counter):
+            detalhes.update(ret)
+    pico = None
+    if memoria:
+        if preparar:
+            preparar()
+        tracemalloc.start()
+        try:
+            fn()
+            pico = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        finally:
+            tracemalloc.stop()
+    t = np.array(tempos)
+    res = {
+        "etapa": nome, **extra, "repeticoes": len(tempos), "por": por,
+        "ms_min": round(float(t.min()), 4), "ms_mediana": round(float(np.median(t)), 4),
+        "ms_p95": round(float(np.percentile(t, 95)), 4), "pico_mb": pico,
+    }
+    if detalhes:
+        res["detalhes"] = dict(detalhes)
+    print(f"  {nome:<28} {res['ms_mediana']:>10.3f} ms/op  (p95 {res['ms_p95']:.3f}, pico {pico} MB)",
+          file=sys.stderr, flush=True)
+    return res
+
+def _status(dbgs) -> Counter:
+    return Counter(str(d.get("status")) for d in dbgs)
+
+# ------------------------------------------------------------
+# Etapas
+# ------------------------------------------------------------
+def medir_inventario(engine, n: int, args) -> list:
+    """Caminhos quentes sobre a planilha engine.PLANILHA (já gerada) com n sites."""
+    import pandas as pd
+
+    rng = np.random.default_rng(args.seed)
+    mem = not args.sem_memoria
+    R = args.repeticoes
+
+    def frio():
+        engine.limpar_caches()
+        shutil.rmtree(engine.SIDECAR_DIR, ignore_errors=True)
+
+    res = [medir("carregar_dados_xlsx", engine.carregar_dados, 1, preparar=frio, memoria=mem, n=n)]
+    res.append(medir("carregar_dados_sidecar", engine.carregar_dados, R, preparar=engine.limpar_caches,
+                     memoria=mem, n=n))
+    base = engine.carregar_dados()
+    lat_s, lon_s = base["lat"].to_numpy(dtype=float), base["lon"].to_numpy(dtype=float)
+
+    res.append(medir("construir_indice_espacial", lambda: engine.construir_indice_espacial(lat_s, lon_s), R,
+                     memoria=mem, n=n))
+    res.append(medir("construir_indice_texto", lambda: engine.construir_indice_texto(base), R,
+                     memoria=mem, n=n))
+    # aquece os índices usados pelas consultas abaixo
+    engine.carregar_indice_espacial(), engine.carregar_indice_sigla(), engine.carregar_indice_texto()
+
+    lon_min, lat_min, lon_max, lat_max = engine.RJ_VIEWBOX
+    q = args.consultas
+    pts = np.column_stack([rng.uniform(lat_min, lat_max, q), rng.uniform(lon_min, lon_max, q)])
+
+    def haversine_nsmallest():
+        lat_col, lon_col = pd.Series(lat_s), pd.Series(lon_s)
+        for la, lo in pts:
+            engine.haversine_km(la, lo, lat_col, lon_col).nsmallest(engine.K_SITES_PROXIMOS)
+
+    def knn():
+        for la, lo in pts:
+            engine.nearest_sites(la, lo)
+
+    def raio():
+        for la, lo in pts:
+            engine.sites_no_raio(la, lo, 2.0)
+
+    res.append(medir("haversine_nsmallest", haversine_nsmallest, R, por=q, memoria=mem, n=n))
+    res.append(medir("nearest_sites", knn, R, por=q, memoria=mem, n=n))
+    res.append(medir("sites_no_raio_2km", raio, R, por=q, memoria=mem, n=n))
+    origens = (rng.uniform(lat_min, lat_max, args.origens_lote), rng.uniform(lon_min, lon_max, args.origens_lote))
+    res.append(medir("nearest_sites_lote", lambda: engine.nearest_sites_lote(*origens), R,
+                     por=args.origens_lote, memoria=mem, n=n))
+
+    nomes = base["nome"].to_numpy(dtype=object)[rng.integers(0, n, q)]
+    enderecos = base["endereco"].to_numpy(dtype=object)[rng.integers(0, n, q)]
+
+    def cidade_escalar():
+        for nome, end in zip(nomes, enderecos):
+            engine.detectar_cidade(nome, end)
+
+    res.append(medir("detectar_cidade", cidade_escalar, R, por=q, memoria=mem, n=n))
+    res.append(medir("detectar_cidades", lambda: engine.detectar_cidades(base["nome"], base["endereco"]), R,
+                     memoria=mem, n=n))
+
+    siglas = base["sigla"].to_numpy(dtype=object)[rng.integers(0, n, q)]
+
+    def sigla_mascara():
+        col = base["sigla"].astype(str).str.upper()
+        for s in siglas:
+            base[col == s]
+
+    def sigla_indice():
+        for s in siglas:
+            engine.buscar_siglas([s])
+
+    res.append(medir("sigla_mascara", sigla_mascara, R, por=q, memoria=mem, n=n))
+    res.append(medir("buscar_siglas", sigla_indice, R, por=q, memoria=mem, n=n))
+    res.append(medir("buscar_siglas_lote_500", lambda: engine.buscar_siglas(list(siglas[:500])), R,
+                     memoria=mem, n=n))
+
+    consultas = [" ".join(str(e).split()[1:2]).lower()[:6] for e in enderecos]
+
+    def texto():
+        for c in consultas:
+            engine.buscar_sites_texto(c)
+
+    res.append(medir("buscar_sites_texto", texto, R, por=q, memoria=mem, n=n))
+    return res
+
+def medir_provedores(engine, args) -> list:
+    """geocode_address, osrm_table e o cache de rotas contra o servidor falso (latência/erros do próprio servidor)."""
+    rng = np.random.default_rng(args.seed)
+    mem = not args.sem_memoria
+    R = args.repeticoes
+    lon_min, lat_min, lon_max, lat_max = engine.RJ_VIEWBOX
+    rodada = Counter()
+
+    def enderecos(nome):
+        rodada[nome] += 1
+        return [f"Rua Benchmark {rodada[nome]}-{i}, {100 + i}, Rio de Janeiro" for i in range(args.enderecos)]
+
+    def geocode_frio():
+        return _status(engine.geocode_address(a)[1] for a in enderecos("frio"))
+
+    fixos = enderecos("quente")
+    for a in fixos:
+        engine.geocode_address(a)
+
+    def geocode_quente():
+        return _status(engine.geocode_address(a)[1] for a in fixos)
+
+    def destinos(k):
+        return list(zip(rng.uniform(lat_min, lat_max, k), rng.uniform(lon_min, lon_max, k)))
+
+    def osrm_um():
+        # origem nova a cada chamada: não cai no cache em memória do osrm_table
+        dbgs = [engine.osrm_table(float(la), float(lo), destinos(engine.OSRM_BLOCO))[1]
+                for la, lo in destinos(args.enderecos)]
+        return _status(dbgs)
+
+    def osrm_blocos():
+        dbgs = [engine.osrm_table_em_blocos(float(la), float(lo), destinos(args.destinos))[1]
+                for la, lo in destinos(args.enderecos)]
+        return _status(dbgs)
+
+    # mesmas origens (em células geohash já vistas) e mesmas siglas: respondido pelo cache persistente de rotas
+    origens = destinos(args.enderecos)
+    fixos_rota = [(f"BENCH{i}", la, lo) for i, (la, lo) in enumerate(destinos(args.destinos))]
+    siglas_rota, dest_rota = [s for s, _, _ in fixos_rota], [(la, lo) for _, la, lo in fixos_rota]
+    for la, lo in origens:
+        engine.rotas_para_sites(float(la), float(lo), siglas_rota, dest_rota)
+
+    def rotas_cache():
+        dbgs = [engine.rotas_para_sites(float(la), float(lo), siglas_rota, dest_rota)[1] for la, lo in origens]
+        return _status(dbgs)
+
+    return [
+        medir("geocode_address_sem_cache", geocode_frio, R, por=args.enderecos, memoria=mem),
+        medir("geocode_address_cache", geocode_quente, R, por=args.enderecos, memoria=mem),
+        medir("osrm_table", osrm_um, R, por=args.enderecos, memoria=mem, destinos=engine.OSRM_BLOCO),
+        medir("osrm_table_em_blocos", osrm_blocos, R, por=args.enderecos, memoria=mem, destinos=args.destinos),
+        medir("rotas_para_sites_cache", rotas_cache, R, por=args.enderecos, memoria=mem, destinos=args.destinos),
+    ]
+
+# ------------------------------------------------------------
+# Comparação com uma execução anterior
+# ------------------------------------------------------------
+def _chave(r: dict):
+    return r["etapa"], r.get("n")
+
+def comparar(anterior: dict, atual: dict, tolerancia: float) -> list:
+    """Etapas cuja mediana piorou mais que `tolerancia` (fração) em relação à execução anterior."""
+    antes = {_chave(r): r for r in anterior.get("resultados", [])}
+    piores = []
+    for r in atual["resultados"]:
+        a = antes.get(_chave(r))
+        if not a or not a.get("ms_mediana"):
+            continue
+        razao = r["ms_mediana"] / a["ms_mediana"]
+        if razao > 1 + tolerancia:
+            piores.append({"etapa": r["etapa"], "n": r.get("n"), "antes_ms": a["ms_mediana"],
+                           "agora_ms": r["ms_mediana"], "razao": round(razao, 2)})
+    return piores
+
+def _versao() -> str | None:
+    try:
+        return subprocess.run(["git", "-C", AQUI, "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------------------
+# Execução
+# ------------------------------------------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark dos caminhos quentes com planilhas sintéticas e provedores falsos.")
+    ap.add_argument("--tamanhos", default=",".join(map(str, TAMANHOS)), help="linhas por planilha, separadas por vírgula")
+    ap.add_argument("--repeticoes", type=int, default=REPETICOES)
+    ap.add_argument("--consultas", type=int, default=CONSULTAS, help="consultas por repetição (k-NN, sigla, texto...)")
+    ap.add_argument("--origens-lote", type=int, default=ORIGENS_LOTE)
+    ap.add_argument("--enderecos", type=int, default=ENDERECOS_GEOCODE, help="chamadas por repetição aos provedores")
+    ap.add_argument("--destinos", type=int, default=DESTINOS_ROTA, help="destinos por chamada em osrm_table_em_blocos e rotas_para_sites")
+    ap.add_argument("--latencia-ms", type=float, default=50.0, help="latência do servidor falso")
+    ap.add_argument("--jitter-ms", type=float, default=20.0)
+    ap.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 503 do servidor falso")
+    ap.add_argument("--taxa-zero", type=float, default=0.0, help="fração de endereços sem resultado")
+    ap.add_argument("--nominatim-rps", type=float, default=100.0, help="rate limit local do Nominatim (o falso não limita)")
+    ap.add_argument("--sem-provedores", action="store_true", help="pula geocodificação/rotas")
+    ap.add_argument("--sem-memoria", action="store_true", help="não mede pico de memória (execução mais rápida)")
+    ap.add_argument("--dir", default=os.path.join(AQUI, ".cache", "benchmark"),
+                    help="pasta de trabalho (planilhas geradas são reaproveitadas)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--saida", help="arquivo JSON de resultado (padrão: stdout)")
+    ap.add_argument("--comparar", help="JSON de uma execução anterior para apontar regressões")
+    ap.add_argument("--tolerancia", type=float, default=0.25, help="piora aceita na mediana (0.25 = 25%%)")
+    args = ap.parse_args(argv)
+    tamanhos = [int(t) for t in args.tamanhos.split(",") if t.strip()]
+    args.dir, args.saida, args.comparar = (os.path.abspath(p) if p else p for p in (args.dir, args.saida, args.comparar))
+
+    srv = fake_osm_server.criar_servidor(latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms,
+                                         taxa_erro=args.taxa_erro, taxa_zero=args.taxa_zero,
+                                         max_table_size=100, seed=args.seed)
+    url = fake_osm_server.iniciar_em_thread(srv)
+    for nome in ("OSRM_URL", "NOMINATIM_URL", "GEOAPIFY_URL"):
+        os.environ[nome] = url
+    os.environ["NOMINATIM_RPS"] = str(args.nominatim_rps)
+
+    # caches da engine (.cache/: sidecar, geocodificação) ficam dentro da pasta de trabalho
+    os.makedirs(args.dir, exist_ok=True)
+    os.chdir(args.dir)
+    import engine
+    import pandas as pd
+    if url not in (engine.OSRM_URL, engine.NOMINATIM_URL):
+        sys.exit("secrets.toml define OSRM_URL/NOMINATIM_URL: o benchmark não conseguiria usar o servidor falso")
+
+    resultado = {
+        "versao": _versao(), "inicio": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "ambiente": {
+            "python": platform.python_version(), "plataforma": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "pandas": pd.__version__,
+            "pyarrow": getattr(engine.pa, "__version__", None),
+        },
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "comparar", "dir")},
+        "resultados": [],
+    }
+    try:
+        for n in tamanhos:
+            engine.PLANILHA = os.path.join(args.dir, f"sites-{n}-s{args.seed}.xlsx")
+            if not os.path.exists(engine.PLANILHA):
+                print(f"gerando planilha com {n} sites...", file=sys.stderr, flush=True)
+                gerar_planilha(engine.PLANILHA, n, engine.RJ_VIEWBOX, engine.MUNICIPIOS_RJ, args.seed)
+            print(f"n = {n}", file=sys.stderr, flush=True)
+            resultado["resultados"].extend(medir_inventario(engine, n, args))
+            engine.limpar_caches()
+
+        if not args.sem_provedores:
+            print(f"provedores (latência {args.latencia_ms} ms, erro {args.taxa_erro:.0%})", file=sys.stderr)
+            resultado["resultados"].extend(medir_provedores(engine, args))
+            resultado["requisicoes_servidor_falso"] = srv.requisicoes
+    finally:
+        srv.shutdown()
+
+    codigo = 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            resultado["regressoes"] = comparar(json.load(f), resultado, args.tolerancia)
+        for r in resultado["regressoes"]:
+            print(f"REGRESSÃO {r['etapa']} (n={r['n']}): {r['antes_ms']} → {r['agora_ms']} ms/op (×{r['razao']})",
+                  file=sys.stderr)
+        codigo = 1 if resultado["regressoes"] else 0
+
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    return codigo
+
+if __name__ == "__main__":
+    sys.exit(main())
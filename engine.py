@@ -0,0 +1,2893 @@
+# ============================================================
+# ⚙️ Núcleo da busca de sites (sem Streamlit)
+# - Carga da planilha (sidecar colunar, recarga incremental) + índice espacial
+# - Geocoding: Geoapify/Nominatim com cache SQLite, rate limit e hedge
+# - Rotas/Matriz: OSRM (cliente HTTP compartilhado, blocos paralelos)
+# - Usado por app.py (UI) e batch.py (lote/CLI)
+# ============================================================
+
+import pandas as pd
+import unicodedata
+import time
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import sqlite3
+import zipfile
+import xml.etree.ElementTree as ET
+import inspect
+import bisect
+import contextlib
+import functools
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+import math
+import re
+from typing import List, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import fcntl  # lock de arquivo para o rate limit entre processos (POSIX)
+except ImportError:
+    fcntl = None
+
+try:
+    import tomllib  # Python 3.11+; sem ele, só variáveis de ambiente
+except ImportError:
+    tomllib = None
+
+try:
+    import pyarrow as pa  # colunas de texto do sidecar lidas direto do mmap (sem cópia)
+except ImportError:
+    pa = None
+
+# ------------------------------------------------------------
+# Secrets / variáveis de ambiente (opcional): GEOAPIFY, endpoints...
+# ------------------------------------------------------------
+def _ler_secrets() -> dict:
+    """Lê os mesmos secrets.toml que o Streamlit (~/.streamlit e ./.streamlit; o do projeto prevalece)."""
+    secrets = {}
+    if tomllib is None:
+        return secrets
+    for caminho in (os.path.expanduser(os.path.join("~", ".streamlit", "secrets.toml")),
+                    os.path.join(".streamlit", "secrets.toml")):
+        try:
+            with open(caminho, "rb") as f:
+                secrets.update(tomllib.load(f))
+        except (OSError, ValueError):
+            pass
+    return secrets
+
+_SECRETS = _ler_secrets()
+
+def _config(nome: str, padrao=None):
+    """
+    Lê uma configuração dos secrets do Streamlit e, se ausente, da variável de ambiente de mesmo nome.
+    Texto vazio ou só com espaços (ex.: GEOAPIFY_KEY = "" no secrets.toml) conta como ausente.
+    """
+    for valor in (_SECRETS.get(nome), os.environ.get(nome)):
+        if valor is not None and not (isinstance(valor, str) and not valor.strip()):
+            return valor
+    return padrao
+
+def _config_bool(nome: str, padrao: bool = False) -> bool:
+    return str(_config(nome, padrao)).strip().lower() in ("1", "true", "sim", "yes", "on")
+
+GEOAPIFY_KEY = (_config("GEOAPIFY_KEY", "") or "").strip()
+
+# ------------------------------------------------------------
+# Auxiliares
+# ------------------------------------------------------------
+def strip_accents(s: str):
+    if not isinstance(s, str):
+        return s
+    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância Haversine em km (vetorizado para lat2/lon2)."""
+    R = 6371.0088
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return R * c
+
+def fmt_na(x, dash="—"):
+    """Substitui pd.NA/NaN/None por '—' evitando TypeError de truthiness com pd.NA."""
+    try:
+        return dash if (x is pd.NA or pd.isna(x)) else x
+    except Exception:
+        return dash if x is None else x
+
+# ------------------------------------------------------------
+# Métricas: tempo por etapa, status dos provedores, retries e cache
+# ------------------------------------------------------------
+# Contadores e histogramas em memória (por processo) no modelo do Prometheus.
+# metricas_prometheus() gera o texto de exposição e resumo_metricas() um
+# resumo em JSON (p50/p95 estimados pelos baldes). Com METRICAS_PORTA, um
+# servidor HTTP mínimo publica /metrics e /metrics.json; com METRICAS_LOG,
+# cada etapa medida também vira uma linha JSON nesse arquivo.
+METRICAS_PORTA = int(_config("METRICAS_PORTA", 0))
+METRICAS_LOG = str(_config("METRICAS_LOG", ""))
+METRICAS_PAINEL = _config_bool("METRICAS_PAINEL")  # painel de métricas no app
+_BALDES_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_METRICAS = {
+    "busca_sites_etapa_segundos": ("histogram", "Duração de cada etapa (provedores, índices, telas)"),
+    "busca_sites_rate_limit_espera_segundos": ("histogram", "Espera no rate limit antes de chamar o provedor"),
+    "busca_sites_requisicoes_total": ("counter", "Chamadas a provedores externos por status"),
+    "busca_sites_retries_total": ("counter", "Retries HTTP feitos pela sessão compartilhada"),
+    "busca_sites_cache_total": ("counter", "Consultas aos caches por resultado (hit/miss)"),
+    "busca_sites_circuito_total": ("counter", "Mudanças de estado do circuit breaker por provedor"),
+    "busca_sites_circuito_aberto": ("gauge", "1 se o provedor está com o circuito aberto ou meio-aberto"),
+    "busca_sites_timeout_leitura_segundos": ("gauge", "Timeout de leitura atual (adaptativo) por provedor"),
+}
+_MEDIDORES = {}    # nome do gauge -> função que retorna [(rótulos, valor), ...] na hora da coleta
+_METRICAS_LOCK = threading.Lock()
+_CONTADORES = {}   # (nome, rótulos) -> valor
+_HISTOGRAMAS = {}  # (nome, rótulos) -> [contagem por balde..., +Inf, soma, total]
+_metricas_log = None
+
+def _rotulos(rotulos: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in rotulos.items() if v is not None))
+
+def contar(nome: str, valor: float = 1, **rotulos):
+    chave = (nome, _rotulos(rotulos))
+    with _METRICAS_LOCK:
+        _CONTADORES[chave] = _CONTADORES.get(chave, 0) + valor
+
+def observar(nome: str, segundos: float, **rotulos):
+    chave = (nome, _rotulos(rotulos))
+    i = bisect.bisect_left(_BALDES_S, segundos)
+    with _METRICAS_LOCK:
+        h = _HISTOGRAMAS.get(chave)
+        if h is None:
+            h = _HISTOGRAMAS[chave] = [0] * (len(_BALDES_S) + 1) + [0.0, 0]
+        h[i] += 1
+        h[-2] += segundos
+        h[-1] += 1
+    if METRICAS_LOG:
+        _registrar_log({"ts": round(time.time(), 3), "metrica": nome, "segundos": round(segundos, 6),
+                        **dict(chave[1])})
+
+def _registrar_log(linha: dict):
+    global _metricas_log
+    try:
+        with _METRICAS_LOCK:
+            if _metricas_log is None:
+                _metricas_log = open(METRICAS_LOG, "a", encoding="utf-8", buffering=1)
+            _metricas_log.write(json.dumps(linha, ensure_ascii=False) + "\n")
+    except OSError:
+        pass  # log é acessório: não derruba a busca
+
+def observar_etapa(etapa: str, segundos: float, **rotulos):
+    observar("busca_sites_etapa_segundos", segundos, etapa=etapa, **rotulos)
+
+@contextlib.contextmanager
+def medir_etapa(etapa: str, **rotulos):
+    """
+    Mede o bloco como uma etapa (histograma busca_sites_etapa_segundos).
+    O dict devolvido aceita rótulos definidos dentro do bloco (ex.: info['status']).
+    """
+    info = dict(rotulos)
+    t = time.perf_counter()
+    try:
+        yield info
+    except Exception:
+        info.setdefault("status", "EXCEPTION")
+        raise
+    finally:
+        observar_etapa(etapa, time.perf_counter() - t, **info)
+
+def instrumentar(etapa: str, externo: bool = False):
+    """
+    Decorator que mede cada chamada como `etapa`. Se a função retorna
+    (resultado, dbg), status/provedor/tentativa do dbg viram rótulos.
+    externo=True (chamadas HTTP): conta também requisições, retries e a espera no rate limit.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with medir_etapa(etapa) as info:
+                ret = fn(*args, **kwargs)
+                dbg = ret[1] if isinstance(ret, tuple) and len(ret) == 2 and isinstance(ret[1], dict) else None
+                if dbg is not None:
+                    info.update(status=dbg.get("status"), tentativa=dbg.get("tentativa"),
+                                provedor=None if externo else dbg.get("provider"))
+            if externo and dbg is not None:
+                contar("busca_sites_requisicoes_total", provedor=etapa, status=dbg.get("status"))
+                if dbg.get("retries"):
+                    contar("busca_sites_retries_total", dbg["retries"], provedor=etapa)
+                if dbg.get("rate_wait_s") is not None:
+                    observar("busca_sites_rate_limit_espera_segundos", dbg["rate_wait_s"], provedor=etapa)
+            return ret
+        return wrapper
+    return deco
+
+def _escapar_rotulo(valor) -> str:
+    """Valor de rótulo no formato de exposição: \\, aspas e quebra de linha escapados."""
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_rotulos(rotulos: tuple, extra: tuple = ()) -> str:
+    pares = [*rotulos, *extra]
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar_rotulo(v)}"' for k, v in pares) + "}"
+
+def metricas_prometheus() -> str:
+    """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)."""
+    with _METRICAS_LOCK:
+        contadores = dict(_CONTADORES)
+        histogramas = {k: list(v) for k, v in _HISTOGRAMAS.items()}
+    linhas = []
+    for nome, (tipo, ajuda) in _METRICAS.items():
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+        if tipo == "counter":
+            for (n, rot), v in sorted(contadores.items()):
+                if n == nome:
+                    linhas.append(f"{nome}{_fmt_rotulos(rot)} {v:g}")
+            continue
+        if tipo == "gauge":
+            for rot, v in _MEDIDORES.get(nome, lambda: [])():
+                linhas.append(f"{nome}{_fmt_rotulos(_rotulos(rot))} {v:g}")
+            continue
+        for (n, rot), h in sorted(histogramas.items()):
+            if n != nome:
+                continue
+            acumulado = 0
+            for limite, c in zip((*_BALDES_S, "+Inf"), h[:-2]):
+                acumulado += c
+                linhas.append(f"{nome}_bucket{_fmt_rotulos(rot, (('le', str(limite)),))} {acumulado}")
+            linhas.append(f"{nome}_sum{_fmt_rotulos(rot)} {h[-2]:.6f}")
+            linhas.append(f"{nome}_count{_fmt_rotulos(rot)} {h[-1]}")
+    return "\n".join(linhas) + "\n"
+
+def _quantil_baldes(h: list, q: float) -> float | None:
+    """Quantil estimado por interpolação linear dentro do balde (como histogram_quantile)."""
+    total = h[-1]
+    if not total:
+        return None
+    alvo, acumulado = q * total, 0
+    for i, c in enumerate(h[:-2]):
+        if acumulado + c >= alvo and c:
+            inicio = _BALDES_S[i - 1] if i else 0.0
+            fim = _BALDES_S[i] if i < len(_BALDES_S) else _BALDES_S[-1]
+            return inicio + (fim - inicio) * (alvo - acumulado) / c
+        acumulado += c
+    return _BALDES_S[-1]
+
+def resumo_metricas() -> dict:
+    """
+    Resumo para painel/log: {'etapas': [...], 'requisicoes': [...], 'retries': [...], 'cache': [...],
+    'provedores': [...]}. etapas traz n, média, p50 e p95 (ms) por etapa e rótulos; cache traz a
+    taxa de acerto; provedores, o estado do circuit breaker e o timeout atual (saude_provedores()).
+    """
+    with _METRICAS_LOCK:
+        contadores = dict(_CONTADORES)
+        histogramas = {k: list(v) for k, v in _HISTOGRAMAS.items()}
+    etapas = []
+    for (nome, rot), h in sorted(histogramas.items()):
+        etapas.append({
+            "metrica": nome, **dict(rot), "n": h[-1], "media_ms": round(1000 * h[-2] / h[-1], 2),
+            "p50_ms": round(1000 * _quantil_baldes(h, 0.5), 2), "p95_ms": round(1000 * _quantil_baldes(h, 0.95), 2),
+        })
+    requisicoes = [{**dict(rot), "n": v} for (nome, rot), v in sorted(contadores.items())
+                   if nome == "busca_sites_requisicoes_total"]
+    retries = [{**dict(rot), "n": v} for (nome, rot), v in sorted(contadores.items())
+               if nome == "busca_sites_retries_total"]
+    caches = {}
+    for (nome, rot), v in contadores.items():
+        if nome == "busca_sites_cache_total":
+            r = dict(rot)
+            caches.setdefault(r["cache"], {"cache": r["cache"], "hit": 0, "miss": 0})[r["resultado"]] += v
+    for c in caches.values():
+        c["taxa_acerto"] = round(c["hit"] / max(1, c["hit"] + c["miss"]), 3)
+    return {"etapas": etapas, "requisicoes": requisicoes, "retries": retries,
+            "cache": sorted(caches.values(), key=lambda c: c["cache"]), "provedores": saude_provedores()}
+
+def limpar_metricas():
+    with _METRICAS_LOCK:
+        _CONTADORES.clear()
+        _HISTOGRAMAS.clear()
+
+class _MetricasHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        caminho = self.path.split("?", 1)[0]
+        if caminho == "/metrics":
+            corpo, tipo = metricas_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        elif caminho == "/metrics.json":
+            corpo, tipo = json.dumps(resumo_metricas(), ensure_ascii=False).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+_servidor_metricas = {"porta": None}
+_servidor_metricas_lock = threading.Lock()
+
+def iniciar_servidor_metricas(porta: int | None = None):
+    """
+    Publica /metrics e /metrics.json em 0.0.0.0:porta (padrão METRICAS_PORTA; 0 = desligado).
+    Uma vez por processo; se a porta já estiver em uso (outro worker), segue sem servidor.
+    Retorna a porta servida ou None.
+    """
+    porta = METRICAS_PORTA if porta is None else porta
+    with _servidor_metricas_lock:
+        if _servidor_metricas["porta"] is None and porta:
+            try:
+                srv = ThreadingHTTPServer(("0.0.0.0", porta), _MetricasHandler)
+            except OSError:
+                _servidor_metricas["porta"] = False
+            else:
+                srv.daemon_threads = True
+                threading.Thread(target=srv.serve_forever, daemon=True, name="metricas").start()
+                _servidor_metricas["porta"] = srv.server_address[1]
+        return _servidor_metricas["porta"] or None
+
+# ------------------------------------------------------------
+# Parâmetros regionais (viés RJ para Nominatim)
+# ------------------------------------------------------------
+# viewbox para Nominatim (lon_min, lat_min, lon_max, lat_max)
+RJ_VIEWBOX = (-43.8, -23.1, -43.0, -22.7)  # melhora match no RJ
+
+# ------------------------------------------------------------
+# Lista de municípios (RJ) + regex para melhor detecção
+# ------------------------------------------------------------
+MUNICIPIOS_RJ = [
+    "Angra dos Reis", "Aperibé", "Araruama", "Areal", "Armação dos Búzios", "Arraial do Cabo",
+    "Barra do Piraí", "Barra Mansa", "Belford Roxo", "Bom Jardim", "Bom Jesus do Itabapoana",
+    "Cabo Frio", "Cachoeiras de Macacu", "Cambuci", "Campos dos Goytacazes", "Cantagalo",
+    "Carapebus", "Cardoso Moreira", "Carmo", "Casimiro de Abreu", "Conceição de Macabu",
+    "Cordeiro", "Duas Barras", "Duque de Caxias", "Engenheiro Paulo de Frontin", "Guapimirim",
+    "Iguaba Grande", "Itaboraí", "Itaguaí", "Italva", "Itaocara", "Itaperuna", "Itatiaia",
+    "Japeri", "Laje do Muriaé", "Macaé", "Macuco", "Magé", "Mangaratiba", "Maricá", "Mendes",
+    "Mesquita", "Miguel Pereira", "Miracema", "Natividade", "Nilópolis", "Niterói",
+    "Nova Friburgo", "Nova Iguaçu", "Paracambi", "Paraíba do Sul", "Parati", "Paty do Alferes",
+    "Petrópolis", "Pinheiral", "Piraí", "Porciúncula", "Porto Real", "Quatis", "Queimados",
+    "Quissamã", "Resende", "Rio Bonito", "Rio Claro", "Rio das Flores", "Rio das Ostras",
+    "Rio de Janeiro", "Santa Maria Madalena", "Santo Antônio de Pádua", "São Fidélis",
+    "São Francisco de Itabapoana", "São Gonçalo", "São João da Barra", "São João de Meriti",
+    "São José de Ubá", "São José do Vale do Rio Preto", "São Pedro da Aldeia",
+    "São Sebastião do Alto", "Sapucaia", "Saquarema", "Seropédica", "Silva Jardim",
+    "Sumidouro", "Tanguá", "Teresópolis", "Trajano de Moraes", "Três Rios", "Valença",
+    "Varre-Sai", "Vassouras", "Volta Redonda"
+]
+MUNI_IDX = {strip_accents(n).lower(): n for n in MUNICIPIOS_RJ}
+# Uma única alternação varrida uma vez por texto (mais longos primeiro:
+# "barra do pirai" não vira "pirai"). Entre os achados vale o último na ordem
+# de MUNICIPIOS_RJ, como no casamento anterior município a município.
+_CITY_RE = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(MUNI_IDX, key=len, reverse=True)) + r")\b"
+)
+_CITY_ORDEM = {key: i for i, key in enumerate(MUNI_IDX)}
+_CITY_NOMES = np.array(list(MUNI_IDX.values()), dtype=object)
+
+def _match_city_base(texto: str) -> str | None:
+    """Tenta casar município num texto (normalizado sem acentos e lower)."""
+    if not isinstance(texto, str) or not texto.strip():
+        return None
+    achados = _CITY_RE.findall(strip_accents(texto).lower())
+    return MUNI_IDX[max(achados, key=_CITY_ORDEM.__getitem__)] if achados else None
+
+def detectar_cidade(nome: str, endereco: str | None = None) -> str | None:
+    """
+    1) Tenta identificar o município no 'nome'
+    2) Se não achou, tenta no 'endereco'
+    """
+    city = _match_city_base(nome)
+    if city:
+        return city
+    if endereco:
+        return _match_city_base(endereco)
+    return None
+
+def _dobrar_coluna(s: pd.Series) -> pd.Series:
+    """strip_accents + lower na coluna inteira (operações .str, sem laço Python)."""
+    return (
+        s.astype("string").str.normalize("NFD")
+        .str.replace("[\u0300-\u036f]", "", regex=True)
+        .str.lower()
+    )
+
+def _cidades_da_coluna(s: pd.Series) -> pd.Series:
+    """_match_city_base aplicado à coluna inteira com operações .str (uma varredura por linha)."""
+    base = _dobrar_coluna(s)
+    ordem = base.str.extractall(_CITY_RE)[0].map(_CITY_ORDEM).groupby(level=0).max()
+    out = pd.Series(pd.NA, index=s.index, dtype="string")
+    out.loc[ordem.index] = _CITY_NOMES[ordem.to_numpy()]
+    return out
+
+def detectar_cidades(nomes: pd.Series, enderecos: pd.Series | None = None) -> pd.Series:
+    """Versão vetorizada de detectar_cidade: 'nome' primeiro, 'endereco' para o que faltar."""
+    cidade = _cidades_da_coluna(nomes)
+    if enderecos is not None:
+        cidade = cidade.fillna(_cidades_da_coluna(enderecos))
+    return cidade
+
+# ------------------------------------------------------------
+# Cliente HTTP compartilhado (keep-alive + retries) para APIs externas
+# ------------------------------------------------------------
+# Uma requests.Session por processo, com um HTTPAdapter montado por URL base:
+# conexões TLS reaproveitadas entre buscas, pool dimensionado por host e
+# retries com backoff em erros de conexão e respostas 429/5xx (respeitando
+# Retry-After, limitado a HTTP_RETRY_AFTER_MAX_S). Leituras que estouram o
+# timeout não são repetidas para não multiplicar a latência de cauda.
+# Endpoints configuráveis (secrets/env) para apontar para instâncias próprias
+# de OSRM/Nominatim ou para o servidor falso local (fake_osm_server.py).
+GEOAPIFY_URL = str(_config("GEOAPIFY_URL", "https://api.geoapify.com")).rstrip("/")
+NOMINATIM_URL = str(_config("NOMINATIM_URL", "https://nominatim.openstreetmap.org")).rstrip("/")
+OSRM_URL = str(_config("OSRM_URL", "https://router.project-osrm.org")).rstrip("/")
+NOMINATIM_USER_AGENT = _config("NOMINATIM_USER_AGENT", "busca-sites-b2b/1.0 (contato: seu-email@exemplo.com)")
+
+HTTP_PROVEDORES = {  # provedor: (URL base, conexões no pool, timeout (conexão, leitura))
+    "geoapify": (GEOAPIFY_URL, 4, (3.05, 10)),
+    "nominatim": (NOMINATIM_URL, 2, (3.05, 10)),
+    "osrm": (OSRM_URL, 8, (3.05, 10)),
+}
+HTTP_RETRIES = 2
+HTTP_BACKOFF_S = 0.3
+HTTP_RETRY_AFTER_MAX_S = 5.0
+
+class _RetryLimitado(Retry):
+    """Retry que não espera mais que HTTP_RETRY_AFTER_MAX_S por um Retry-After."""
+    def get_retry_after(self, response):
+        espera = super().get_retry_after(response)
+        return None if espera is None else min(espera, HTTP_RETRY_AFTER_MAX_S)
+
+_sessao_lock = threading.Lock()
+_sessao_http = None
+_sessao_pid = None
+
+def http_session() -> requests.Session:
+    """Sessão HTTP do processo (recriada após fork)."""
+    global _sessao_http, _sessao_pid
+    with _sessao_lock:
+        if _sessao_http is None or _sessao_pid != os.getpid():
+            sessao = requests.Session()
+            for base, pool, _ in HTTP_PROVEDORES.values():
+                retry = _RetryLimitado(
+                    total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=HTTP_RETRIES,
+                    backoff_factor=HTTP_BACKOFF_S,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset({"GET"}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                sessao.mount(base, HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=retry))
+            _sessao_http, _sessao_pid = sessao, os.getpid()
+        return _sessao_http
+
+def http_get(provedor: str, url: str, **kwargs) -> requests.Response:
+    """
+    GET pela sessão compartilhada com o timeout (adaptativo) do provedor.
+    Latência e falha (erro de rede, timeout, 429/5xx) alimentam SAUDE[provedor].
+    """
+    saude = SAUDE[provedor]
+    kwargs.setdefault("timeout", saude.timeout())
+    inicio = time.monotonic()
+    try:
+        r = http_session().get(url, **kwargs)
+    except requests.exceptions.RequestException:
+        saude.registrar(False, time.monotonic() - inicio)
+        raise
+    saude.registrar(r.status_code < 500 and r.status_code != 429, time.monotonic() - inicio)
+    return r
+
+def _retries_da_resposta(r: requests.Response) -> int:
+    hist = getattr(getattr(r.raw, "retries", None), "history", None)
+    return len(hist) if hist else 0
+
+# ------------------------------------------------------------
+# Saúde dos provedores: timeout adaptativo + circuit breaker
+# ------------------------------------------------------------
+# Cada provedor guarda as últimas SAUDE_JANELA chamadas (latência das que
+# responderam e se falharam). O timeout de leitura passa a ser
+# TIMEOUT_FATOR × p95 das latências recentes, entre TIMEOUT_MIN_S e o timeout
+# fixo de HTTP_PROVEDORES. Após CIRCUITO_FALHAS falhas seguidas (ou taxa de
+# erro >= CIRCUITO_TAXA_ERRO na janela) o circuito abre: durante
+# CIRCUITO_ESPERA_S o provedor é pulado na hora (status CIRCUIT_OPEN) e o
+# geocode_address segue para o próximo estágio. Depois, meio-aberto: uma única
+# chamada de sonda passa; sucesso fecha o circuito, falha abre de novo.
+# Estado por processo (cada worker decide com o que ele mesmo observou).
+TIMEOUT_ADAPTATIVO = _config_bool("TIMEOUT_ADAPTATIVO", True)
+TIMEOUT_FATOR = float(_config("TIMEOUT_FATOR", 4.0))
+TIMEOUT_MIN_S = float(_config("TIMEOUT_MIN_S", 1.0))
+CIRCUITO_FALHAS = int(_config("CIRCUITO_FALHAS", 5))
+CIRCUITO_TAXA_ERRO = float(_config("CIRCUITO_TAXA_ERRO", 0.5))
+CIRCUITO_ESPERA_S = float(_config("CIRCUITO_ESPERA_S", 30))
+SAUDE_JANELA = 50
+SAUDE_MIN_AMOSTRAS = 10   # abaixo disso: timeout fixo e sem abrir por taxa de erro
+
+class SaudeProvedor:
+    def __init__(self, nome: str, timeout_base: tuple):
+        self.nome = nome
+        self.timeout_base = timeout_base
+        self.estado = "fechado"   # fechado | aberto | meio_aberto
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=SAUDE_JANELA)
+        self._falhas = deque(maxlen=SAUDE_JANELA)  # True = chamada falhou
+        self._falhas_seguidas = 0
+        self._reabre_em = 0.0
+        self._sonda_ate = 0.0
+
+    def _mudar(self, estado: str):
+        self.estado = estado
+        contar("busca_sites_circuito_total", provedor=self.nome, estado=estado)
+
+    def permitir(self) -> bool:
+        """False se o circuito está aberto (ou se a sonda do meio-aberto já está em andamento)."""
+        agora = time.monotonic()
+        with self._lock:
+            if self.estado == "fechado":
+                return True
+            if self.estado == "aberto":
+                if agora < self._reabre_em:
+                    return False
+                self._mudar("meio_aberto")
+            if agora < self._sonda_ate:
+                return False
+            # sonda que não voltar em tempo (timeout total) libera outra
+            self._sonda_ate = agora + sum(self.timeout_base)
+            return True
+
+    def registrar(self, ok: bool, segundos: float):
+        with self._lock:
+            self._falhas.append(not ok)
+            if ok:
+                self._latencias.append(segundos)
+                self._falhas_seguidas = 0
+                if self.estado != "fechado":
+                    self._falhas.clear()  # a janela antiga é do incidente que passou
+                    self._mudar("fechado")
+                return
+            self._falhas_seguidas += 1
+            taxa = sum(self._falhas) / len(self._falhas)
+            if self.estado == "meio_aberto" or (self.estado == "fechado" and (
+                    self._falhas_seguidas >= CIRCUITO_FALHAS
+                    or (len(self._falhas) >= SAUDE_MIN_AMOSTRAS and taxa >= CIRCUITO_TAXA_ERRO))):
+                self._reabre_em = time.monotonic() + CIRCUITO_ESPERA_S
+                self._sonda_ate = 0.0
+                self._mudar("aberto")
+
+    def _p(self, q: float) -> float | None:
+        amostras = sorted(self._latencias)
+        if len(amostras) < SAUDE_MIN_AMOSTRAS:
+            return None
+        return amostras[min(len(amostras) - 1, int(q * len(amostras)))]
+
+    def timeout(self) -> tuple:
+        """(conexão, leitura) para a próxima chamada."""
+        conexao, leitura = self.timeout_base
+        with self._lock:
+            p95 = self._p(0.95)
+        if not TIMEOUT_ADAPTATIVO or p95 is None:
+            return self.timeout_base
+        leitura = min(leitura, max(TIMEOUT_MIN_S, TIMEOUT_FATOR * p95))
+        return min(conexao, leitura), leitura
+
+    def resumo(self) -> dict:
+        with self._lock:
+            p50, p95 = self._p(0.5), self._p(0.95)
+            n = len(self._falhas)
+            taxa = sum(self._falhas) / n if n else 0.0
+            reabre = max(0.0, self._reabre_em - time.monotonic()) if self.estado == "aberto" else 0.0
+        timeout = self.timeout()[1]  # fora do lock (timeout() também o adquire)
+        return {
+            "provedor": self.nome, "estado": self.estado, "chamadas": n, "taxa_erro": round(taxa, 3),
+            "p50_ms": None if p50 is None else round(1000 * p50, 1),
+            "p95_ms": None if p95 is None else round(1000 * p95, 1),
+            "timeout_s": round(timeout, 2), "reabre_em_s": round(reabre, 1),
+        }
+
+SAUDE = {nome: SaudeProvedor(nome, timeout) for nome, (_, _, timeout) in HTTP_PROVEDORES.items()}
+
+def provedor_disponivel(provedor: str) -> bool:
+    """Consulta o circuit breaker antes de chamar o provedor (no meio-aberto, reserva a sonda)."""
+    return SAUDE[provedor].permitir()
+
+def saude_provedores() -> list:
+    """Estado, taxa de erro, p50/p95 e timeout atual de cada provedor (neste processo)."""
+    return [s.resumo() for s in SAUDE.values()]
+
+def provedores_degradados() -> list:
+    """Provedores com o circuito aberto ou meio-aberto neste processo."""
+    return [nome for nome, s in SAUDE.items() if s.estado != "fechado"]
+
+_MEDIDORES["busca_sites_circuito_aberto"] = lambda: [
+    ({"provedor": nome}, int(s.estado != "fechado")) for nome, s in SAUDE.items()]
+_MEDIDORES["busca_sites_timeout_leitura_segundos"] = lambda: [
+    ({"provedor": nome}, s.timeout()[1]) for nome, s in SAUDE.items()]
+
+# ------------------------------------------------------------
+# Limite de taxa por provedor (token bucket)
+# ------------------------------------------------------------
+# Só espera quando o orçamento do provedor está esgotado: após um período
+# ocioso a requisição sai na hora. Cada chamada reserva um token (o saldo pode
+# ficar negativo) e dorme o tempo necessário para ele existir, então chamadas
+# concorrentes entram em fila em vez de dispararem juntas.
+# Com RATE_LIMIT_ENTRE_PROCESSOS=1 o saldo fica num arquivo em .cache/ protegido
+# por flock, e todos os workers da máquina dividem o mesmo orçamento.
+RATE_LIMITS = {  # provedor: (requisições por segundo, rajada máxima)
+    # política do serviço público: 1 req/s (instância própria: aumentar NOMINATIM_RPS)
+    "nominatim": (float(_config("NOMINATIM_RPS", 1.0)), max(1, int(float(_config("NOMINATIM_RPS", 1.0))))),
+    "geoapify": (5.0, 5),    # plano gratuito
+}
+RATE_LIMIT_ENTRE_PROCESSOS = _config_bool("RATE_LIMIT_ENTRE_PROCESSOS")
+
+class TokenBucket:
+    def __init__(self, nome: str, taxa: float, rajada: float, arquivo: str | None = None):
+        self.nome = nome
+        self.taxa = float(taxa)
+        self.rajada = float(rajada)
+        self.arquivo = arquivo if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._tokens = self.rajada
+        self._ultimo = time.time()
+
+    def _consumir(self, tokens: float, ultimo: float, agora: float):
+        tokens = min(self.rajada, tokens + max(0.0, agora - ultimo) * self.taxa) - 1.0
+        espera = 0.0 if tokens >= 0 else -tokens / self.taxa
+        return tokens, espera
+
+    def _reservar_arquivo(self, agora: float) -> float:
+        os.makedirs(os.path.dirname(self.arquivo) or ".", exist_ok=True)
+        with open(self.arquivo, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    estado = json.loads(f.read() or "{}")
+                except ValueError:
+                    estado = {}
+                tokens, espera = self._consumir(
+                    float(estado.get("tokens", self.rajada)), float(estado.get("ultimo", agora)), agora
+                )
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "ultimo": agora}))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return espera
+
+    def reservar(self) -> float:
+        """Consome um token e retorna quantos segundos o chamador deve esperar."""
+        with self._lock:
+            agora = time.time()
+            if self.arquivo:
+                try:
+                    return self._reservar_arquivo(agora)
+                except OSError:
+                    pass  # arquivo inacessível: cai para o saldo local
+            self._tokens, espera = self._consumir(self._tokens, self._ultimo, agora)
+            self._ultimo = agora
+            return espera
+
+    def aguardar(self) -> float:
+        espera = self.reservar()
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+_BUCKETS = {
+    nome: TokenBucket(
+        nome, taxa, rajada,
+        os.path.join(".cache", f"ratelimit-{nome}.json") if RATE_LIMIT_ENTRE_PROCESSOS else None,
+    )
+    for nome, (taxa, rajada) in RATE_LIMITS.items()
+}
+
+def limitar(provedor: str) -> float:
+    """Bloqueia até haver orçamento para `provedor`; retorna o tempo esperado (s)."""
+    bucket = _BUCKETS.get(provedor)
+    return bucket.aguardar() if bucket else 0.0
+
+# ------------------------------------------------------------
+# Geocoding — normalização do endereço + Geoapify (opcional) + Nominatim (duas tentativas)
+# ------------------------------------------------------------
+def _normalize_address_for_br(addr: str) -> str:
+    """
+    Se o usuário digitar algo muito curto/sem país/UF, acrescenta 'RJ, Brasil' ou 'Brasil'.
+    - Se já houver 'RJ'/'Brasil', mantém.
+    """
+    if not isinstance(addr, str):
+        return addr
+    a = addr.strip()
+    a_low = strip_accents(a).lower()
+    if (" rj" in a_low) or (" rio de janeiro" in a_low) or (" brasil" in a_low) or (" brazil" in a_low):
+        return a
+    # heurística simples: se só tem 1 parte (sem vírgula), completar com RJ e Brasil
+    if len(a.split(",")) == 1:
+        return f"{a}, RJ, Brasil"
+    # senão, ao menos assegura Brasil
+    return f"{a}, Brasil"
+
+# ------------------------------------------------------------
+# Cache persistente de geocodificação (SQLite, compartilhado entre workers)
+# ------------------------------------------------------------
+# Chave = provedor + parâmetros + o texto que de fato vai ao provedor (o
+# Nominatim recebe o endereço completado com RJ/Brasil, o Geoapify o endereço
+# como digitado), só com caixa e espaços/vírgulas uniformizados. Sobrevive a
+# restart e ao botão "Atualizar dados". ZERO_RESULTS também é guardado (cache
+# negativo, TTL menor); TIMEOUT/EXCEPTION nunca são guardados.
+# O descarte (expirados + LRU acima do limite) não roda a cada inserção: só
+# depois de ~LRU_FOLGA × limite linhas inseridas por este processo, quando a
+# tabela é contada e, se passou do limite, volta a ele.
+GEOCODE_DB = os.path.join(".cache", "geocode.sqlite")
+GEOCODE_TTL_S = 30 * 24 * 3600
+GEOCODE_TTL_NEG_S = 24 * 3600
+GEOCODE_MAX_ITENS = 50_000
+LRU_FOLGA = 0.1
+_geocache_pronto = False
+_lru_inseridos = {}
+_lru_lock = threading.Lock()
+
+def _chave_endereco(texto: str) -> str:
+    """Forma canônica do texto enviado ao provedor, usada como chave do cache."""
+    a = texto.lower() if isinstance(texto, str) else ""
+    a = re.sub(r"\s*,\s*", ", ", a)
+    return re.sub(r"\s+", " ", a).strip(" ,")
+
+def _geocache_conn():
+    global _geocache_pronto
+    if not _geocache_pronto:
+        os.makedirs(os.path.dirname(GEOCODE_DB) or ".", exist_ok=True)
+    con = sqlite3.connect(GEOCODE_DB, timeout=5, isolation_level=None)
+    if not _geocache_pronto:
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " chave TEXT PRIMARY KEY, status TEXT, resultado TEXT,"
+            " expira REAL, acessado REAL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS geocode_acessado ON geocode(acessado)")
+        _geocache_pronto = True
+    return con
+
+def _podar_lru(con, tabela: str, limite: int, inseridas: int):
+    """Conta `inseridas` e, a cada ~limite × LRU_FOLGA, apaga expirados e os menos acessados acima de `limite`."""
+    with _lru_lock:
+        total = _lru_inseridos.get(tabela, 0) + inseridas
+        if total < max(1, int(limite * LRU_FOLGA)):
+            _lru_inseridos[tabela] = total
+            return
+        _lru_inseridos[tabela] = 0
+    con.execute(f"DELETE FROM {tabela} WHERE expira <= ?", (time.time(),))
+    excesso = con.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0] - limite
+    if excesso > 0:
+        con.execute(
+            f"DELETE FROM {tabela} WHERE rowid IN (SELECT rowid FROM {tabela} ORDER BY acessado LIMIT ?)",
+            (excesso,),
+        )
+
+def _geocache_get(chave: str):
+    """Retorna (status, resultado) se houver entrada válida; senão None."""
+    agora = time.time()
+    con = _geocache_conn()
+    try:
+        row = con.execute(
+            "SELECT status, resultado FROM geocode WHERE chave = ? AND expira > ?", (chave, agora)
+        ).fetchone()
+        if row is None:
+            return None
+        con.execute("UPDATE geocode SET acessado = ? WHERE chave = ?", (agora, chave))
+        return row[0], (json.loads(row[1]) if row[1] else None)
+    finally:
+        con.close()
+
+def _geocache_put(chave: str, status: str, resultado):
+    agora = time.time()
+    ttl = GEOCODE_TTL_S if resultado else GEOCODE_TTL_NEG_S
+    con = _geocache_conn()
+    try:
+        con.execute(
+            "INSERT OR REPLACE INTO geocode (chave, status, resultado, expira, acessado) VALUES (?, ?, ?, ?, ?)",
+            (chave, status, json.dumps(resultado) if resultado else None, agora + ttl, agora),
+        )
+        _podar_lru(con, "geocode", GEOCODE_MAX_ITENS, 1)
+    finally:
+        con.close()
+
+def cache_geocode(provedor: str, texto=None):
+    """
+    Decorator para funções geocode_*(address, ...) que retornam (result, dbg).
+    texto(address) dá o que a função envia ao provedor (padrão: o próprio address).
+    No acerto, dbg vem com 'cache': 'HIT'; na falta, 'cache': 'MISS'.
+    Falhas do SQLite (disco cheio, somente leitura...) apenas desligam o cache.
+    """
+    def deco(fn):
+        assinatura = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(address, *args, **kwargs):
+            ba = assinatura.bind(address, *args, **kwargs)
+            ba.apply_defaults()
+            extras = [f"{k}={v}" for k, v in list(ba.arguments.items())[1:]]
+            chave = "|".join([provedor, *extras, _chave_endereco(texto(address) if texto else address)])
+
+            try:
+                hit = _geocache_get(chave)
+            except (sqlite3.Error, OSError):
+                hit = None
+            contar("busca_sites_cache_total", cache=f"geocode_{provedor}", resultado="miss" if hit is None else "hit")
+            if hit is not None:
+                status, res = hit
+                dbg = {"provider": provedor, "status": status, "error_message": None,
+                       "raw_sample": None, "cache": "HIT"}
+                return res, dbg
+
+            res, dbg = fn(address, *args, **kwargs)
+            dbg["cache"] = "MISS"
+            if dbg.get("status") in ("OK", "ZERO_RESULTS"):
+                try:
+                    _geocache_put(chave, dbg["status"], res)
+                except (sqlite3.Error, OSError):
+                    pass
+            return res, dbg
+        return wrapper
+    return deco
+
+@cache_geocode("geoapify")
+@instrumentar("geoapify", externo=True)
+def geocode_geoapify(address: str):
+    """
+    Geocodifica um endereço usando Geoapify (se GEOAPIFY_KEY estiver configurada).
+    Retorna (result, dbg):
+      result: {'lat', 'lon', 'formatted'} ou None
+      dbg:    {'provider','status','error_message','raw_sample'}
+    """
+    dbg = {"provider": "geoapify", "status": None, "error_message": None, "raw_sample": None}
+    if not GEOAPIFY_KEY or not address or not address.strip():
+        dbg["status"] = "MISSING_KEY_OR_ADDRESS"
+        return None, dbg
+    if not provedor_disponivel("geoapify"):
+        dbg["status"] = "CIRCUIT_OPEN"
+        return None, dbg
+
+    url = f"{GEOAPIFY_URL}/v1/geocode/search"
+    params = {
+        "text": address,
+        "lang": "pt",
+        "filter": "countrycode:br",   # restringe ao Brasil
+        "limit": 1,
+        "apiKey": GEOAPIFY_KEY
+    }
+    try:
+        dbg["rate_wait_s"] = limitar("geoapify")
+        r = http_get("geoapify", url, params=params)
+        dbg["retries"] = _retries_da_resposta(r)
+        r.raise_for_status()
+        j = r.json()
+        feats = j.get("features", [])
+        if not feats:
+            dbg["status"] = "ZERO_RESULTS"
+            return None, dbg
+        p = feats[0]["properties"]
+        dbg["status"] = "OK"
+        dbg["raw_sample"] = {"formatted": p.get("formatted")}
+        return {
+            "lat": float(p["lat"]),
+            "lon": float(p["lon"]),
+            "formatted": p.get("formatted") or address
+        }, dbg
+    except requests.exceptions.Timeout:
+        dbg["status"] = "TIMEOUT"
+        return None, dbg
+    except Exception as e:
+        dbg["status"] = "EXCEPTION"
+        dbg["error_message"] = str(e)
+        return None, dbg
+
+@cache_geocode("nominatim", texto=_normalize_address_for_br)
+@instrumentar("nominatim", externo=True)
+def geocode_nominatim(address: str, strict_rj: bool = True):
+    """
+    Nominatim (OSM) com duas modalidades:
+      - strict_rj=True  -> usa viewbox do RJ (bounded=1)
+      - strict_rj=False -> remove bounded e busca no Brasil todo
+    Retorna (result, dbg).
+    """
+    dbg = {"provider": "nominatim", "status": None, "error_message": None, "raw_sample": None,
+           "tentativa": "rj" if strict_rj else "br"}
+    address = _normalize_address_for_br(address)
+    if not address or not address.strip():
+        dbg["status"] = "MISSING_ADDRESS"
+        return None, dbg
+    if not provedor_disponivel("nominatim"):
+        dbg["status"] = "CIRCUIT_OPEN"
+        return None, dbg
+    try:
+        dbg["rate_wait_s"] = limitar("nominatim")  # respeita limites do serviço público
+        params = {
+            "q": address,
+            "format": "json",
+            "limit": 1,
+            "countrycodes": "br",
+            "accept-language": "pt-BR",
+        }
+        headers = {"User-Agent": NOMINATIM_USER_AGENT}
+        if strict_rj:
+            params.update({
+                "viewbox": f"{RJ_VIEWBOX[0]},{RJ_VIEWBOX[1]},{RJ_VIEWBOX[2]},{RJ_VIEWBOX[3]}",
+                "bounded": 1
+            })
+        r = http_get("nominatim", f"{NOMINATIM_URL}/search", params=params, headers=headers)
+        dbg["retries"] = _retries_da_resposta(r)
+        r.raise_for_status()
+        j = r.json()
+        if j:
+            item = j[0]
+            dbg["status"] = "OK"
+            dbg["raw_sample"] = {"display_name": item.get("display_name")}
+            return {
+                "lat": float(item["lat"]),
+                "lon": float(item["lon"]),
+                "formatted": item.get("display_name")
+            }, dbg
+        else:
+            dbg["status"] = "ZERO_RESULTS"
+            return None, dbg
+    except requests.exceptions.Timeout:
+        dbg["status"] = "TIMEOUT"
+        return None, dbg
+    except Exception as e:
+        dbg["status"] = "EXCEPTION"
+        dbg["error_message"] = str(e)
+        return None, dbg
+
+# Modo concorrente: dispara o provedor de maior prioridade e, a cada
+# GEOCODE_HEDGE_S sem resposta (ou assim que o anterior falhar), o próximo.
+# Vale o primeiro resultado na ordem de prioridade; um resultado de prioridade
+# menor só é aceito se os de prioridade maior falharem ou não responderem em
+# GEOCODE_GRACA_S. Chamadas ainda em andamento não são interrompidas (terminam
+# em segundo plano e alimentam o cache), as que não começaram são canceladas.
+# O hedge é só entre provedores diferentes: as tentativas do mesmo provedor
+# (Nominatim RJ e depois BR) rodam em sequência, para não dobrar a carga num
+# serviço público de 1 req/s.
+GEOCODE_CONCORRENTE = _config_bool("GEOCODE_CONCORRENTE", True)
+GEOCODE_HEDGE_S = float(_config("GEOCODE_HEDGE_S", 0.5))
+GEOCODE_GRACA_S = float(_config("GEOCODE_GRACA_S", 1.0))
+# Geocodificação offline (gazetteer da planilha): "fallback" = só quando os
+# provedores online não acham/respondem; "primeiro" = responde na hora se a
+# confiança for >= GEOCODE_OFFLINE_CONFIANCA; "nao" = desligada.
+GEOCODE_OFFLINE = str(_config("GEOCODE_OFFLINE", "fallback")).strip().lower()
+GEOCODE_OFFLINE_CONFIANCA = float(_config("GEOCODE_OFFLINE_CONFIANCA", 0.6))
+_EXECUTOR = ThreadPoolExecutor(max_workers=int(_config("HTTP_WORKERS", 8)), thread_name_prefix="busca-sites")
+
+def _em_sequencia(*tentativas):
+    """Etapa que tenta cada função em ordem e para no primeiro resultado."""
+    def etapa():
+        for tentativa in tentativas:
+            res, dbg = tentativa()
+            if res:
+                break
+        return res, dbg
+    return etapa
+
+def _etapas_geocode(address: str):
+    """Uma etapa por provedor, em ordem de prioridade, como funções sem argumentos."""
+    etapas = []
+    if GEOAPIFY_KEY:
+        etapas.append(lambda: geocode_geoapify(address))
+    # BR só começa se o RJ estrito não achar nada
+    etapas.append(_em_sequencia(lambda: geocode_nominatim(address, strict_rj=True),
+                                lambda: geocode_nominatim(address, strict_rj=False)))
+    return etapas
+
+def _resultado_futuro(fut):
+    try:
+        return fut.result()
+    except Exception as e:
+        return None, {"provider": None, "status": "EXCEPTION", "error_message": str(e)}
+
+def _geocode_concorrente(etapas, hedge_s: float, graca_s: float):
+    futuros, resultados = [], {}
+    proximo_em = 0.0
+    sucesso_em = None
+    escolhido = None
+    while True:
+        agora = time.monotonic()
+        anteriores_falharam = all(resultados.get(i, (1,))[0] is None for i in range(len(futuros)))
+        if len(futuros) < len(etapas) and (agora >= proximo_em or anteriores_falharam):
+            futuros.append(_EXECUTOR.submit(etapas[len(futuros)]))
+            proximo_em = agora + hedge_s
+
+        # primeiro sucesso cuja prioridade não tem ninguém acima ainda pendente
+        for i in range(len(futuros)):
+            if i not in resultados:
+                break
+            if resultados[i][0]:
+                escolhido = resultados[i]
+                break
+        sucessos = [i for i in sorted(resultados) if resultados[i][0]]
+        if escolhido is None and sucessos and agora - sucesso_em >= graca_s:
+            escolhido = resultados[sucessos[0]]
+        if escolhido is not None or len(resultados) == len(etapas):
+            break
+
+        prazos = []
+        if len(futuros) < len(etapas):
+            prazos.append(proximo_em - agora)
+        if sucessos:
+            prazos.append(sucesso_em + graca_s - agora)
+        pendentes = [f for i, f in enumerate(futuros) if i not in resultados]
+        feitos, _ = wait(pendentes, timeout=max(0.0, min(prazos)) if prazos else None,
+                         return_when=FIRST_COMPLETED)
+        for f in feitos:
+            resultados[futuros.index(f)] = _resultado_futuro(f)
+            if resultados[futuros.index(f)][0] and sucesso_em is None:
+                sucesso_em = time.monotonic()
+
+    for f in futuros:
+        f.cancel()
+    return escolhido
+
+@instrumentar("geocode_address")
+def geocode_address(address: str, concorrente: bool | None = None, offline: str | None = None):
+    """
+    Ordem:
+      1) Geoapify (se key)
+      2) Nominatim com viés RJ estrito
+      3) Nominatim sem bounded (apenas BR)
+      4) Gazetteer offline da planilha (aproximado; dbg['confianca'])
+    concorrente=None usa GEOCODE_CONCORRENTE; False mantém a execução sequencial.
+    offline=None usa GEOCODE_OFFLINE ("fallback", "primeiro" ou "nao").
+    """
+    if offline is None:
+        offline = GEOCODE_OFFLINE
+    aproximado = None
+    if offline == "primeiro":
+        aproximado = geocode_offline(address)
+        if aproximado[0] and aproximado[1]["confianca"] >= GEOCODE_OFFLINE_CONFIANCA:
+            return aproximado
+
+    etapas = _etapas_geocode(address)
+    if concorrente is None:
+        concorrente = GEOCODE_CONCORRENTE
+
+    if concorrente and len(etapas) > 1:
+        escolhido = _geocode_concorrente(etapas, GEOCODE_HEDGE_S, GEOCODE_GRACA_S)
+        if escolhido:
+            return escolhido
+    else:
+        for etapa in etapas:
+            res, dbg = etapa()
+            if res:
+                return res, dbg
+    if offline == "fallback":
+        aproximado = geocode_offline(address)
+    if aproximado and aproximado[0]:
+        return aproximado
+    # nada encontrado
+    return None, {"provider": "none", "status": "ZERO_RESULTS", "error_message": None}
+
+# ------------------------------------------------------------
+# Cache em memória com TTL (resultados de APIs externas)
+# ------------------------------------------------------------
+_CACHES_TTL = []
+
+def cache_ttl(ttl_s: float, maxsize: int = 4096, guardar=None):
+    """
+    Memoiza a função por processo durante ttl_s segundos (argumentos precisam ter repr estável).
+    Ao passar de maxsize entradas, descarta as mais antigas.
+    guardar(valor) -> bool decide o que entra no cache (ex.: só respostas bem-sucedidas).
+    """
+    def deco(fn):
+        dados = {}
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            chave = repr((args, sorted(kwargs.items())))
+            agora = time.monotonic()
+            with lock:
+                item = dados.get(chave)
+                if item is not None and item[0] > agora:
+                    contar("busca_sites_cache_total", cache=fn.__name__, resultado="hit")
+                    return item[1]
+            contar("busca_sites_cache_total", cache=fn.__name__, resultado="miss")
+            valor = fn(*args, **kwargs)
+            if guardar is not None and not guardar(valor):
+                return valor
+            with lock:
+                dados[chave] = (agora + ttl_s, valor)
+                if len(dados) > maxsize:
+                    for k in sorted(dados, key=lambda k: dados[k][0])[: len(dados) - maxsize]:
+                        del dados[k]
+            return valor
+
+        wrapper.cache_clear = dados.clear
+        _CACHES_TTL.append(wrapper)
+        return wrapper
+    return deco
+
+# ------------------------------------------------------------
+# Rotas/Matriz — OSRM (sem key)
+# ------------------------------------------------------------
+def _rota_item(dist, dur) -> dict:
+    return {
+        "distance_m": None if dist is None else float(dist),
+        "distance_text": None if dist is None else f"{dist/1000:.1f} km",
+        "duration_s": None if dur is None else float(dur),
+        "duration_text": None if dur is None else f"{math.ceil(dur/60)} min",
+    }
+
+@cache_ttl(15*60, guardar=lambda ret: bool(ret[0]))  # falhas (timeout, circuito aberto) não ficam em cache
+@instrumentar("osrm", externo=True)
+def osrm_table(origin_lat: float, origin_lon: float, dests: List[Tuple[float, float]]):
+    """
+    Usa OSRM Table API (OSRM_URL; padrão router.project-osrm.org) para obter duration/distance.
+    dests: lista [(lat, lon), ...]
+    Retorna (out, dbg):
+      out: [{'distance_m','distance_text','duration_s','duration_text'}, ...]
+      dbg: {'status','error_message'}
+    """
+    dbg = {"status": None, "error_message": None}
+    if not dests:
+        dbg["status"] = "NO_DESTS"
+        return [], dbg
+    if not provedor_disponivel("osrm"):
+        dbg["status"] = "CIRCUIT_OPEN"
+        return [], dbg
+
+    # OSRM usa ordem lon,lat
+    coords = [(origin_lon, origin_lat)] + [(lon, lat) for (lat, lon) in dests]
+    coord_str = ";".join([f"{lon},{lat}" for (lon, lat) in coords])
+    url = f"{OSRM_URL}/table/v1/driving/{coord_str}"
+    # sources=0: só a linha origem -> destinos é calculada (o resto da matriz não é usado)
+    params = {"annotations": "duration,distance", "sources": "0"}
+
+    try:
+        r = http_get("osrm", url, params=params)
+        dbg["retries"] = _retries_da_resposta(r)
+        r.raise_for_status()
+        data = r.json()
+        dbg["status"] = data.get("code", "OK")
+
+        if data.get("code") != "Ok":
+            dbg["error_message"] = data.get("message")
+            return [], dbg
+
+        durations = data.get("durations") or []
+        distances = data.get("distances") or []
+        if not durations or not distances:
+            return [], dbg
+
+        row0_dur = durations[0]  # origem -> todos
+        row0_dis = distances[0]
+
+        out = [_rota_item(row0_dis[i], row0_dur[i]) for i in range(1, len(row0_dur))]
+        return out, dbg
+    except requests.exceptions.Timeout:
+        dbg["status"] = "TIMEOUT"
+        return [], dbg
+    except Exception as e:
+        dbg["status"] = "EXCEPTION"
+        dbg["error_message"] = str(e)
+        return [], dbg
+
+# ------------------------------------------------------------
+# Cache colunar da planilha (sidecar .npy ao lado do xlsx)
+# ------------------------------------------------------------
+# Cada aba já normalizada é gravada em .cache/sidecar/<aba>-<hash>-v<versão>/:
+# colunas numéricas como .npy, colunas de texto como um blob UTF-8 + offsets
+# int64 + máscara de nulos e categorias como códigos .npy + textos das
+# categorias. Tudo é aberto com mmap: com pyarrow, os textos viram colunas
+# Arrow apontando direto para o arquivo, então vários workers compartilham as
+# mesmas páginas (cache do SO) em vez de cada um montar objetos Python.
+# A chave é o hash do conteúdo da aba (XML da aba + textos compartilhados que
+# ela usa), então alterar uma aba não invalida o sidecar das outras. Abrir o
+# XML custa centenas de ms, então as assinaturas ficam num JSON pequeno
+# (.cache/sidecar/abas-<hash do arquivo>.json): um worker novo só calcula o
+# hash do xlsx (ms) e o XML é lido uma vez por versão da planilha.
+PLANILHA = str(_config("PLANILHA", "enderecos.xlsx"))
+SIDECAR_DIR = os.path.join(".cache", "sidecar")
+SIDECAR_VERSAO = 3  # incrementar quando a normalização das abas ou o formato mudar
+_SEP = "\x00"      # não pode aparecer em células de xlsx (XML não permite)
+_ABAS_CARREGADAS = {}  # aba -> assinatura do conteúdo que está em memória
+
+def _hash_arquivo(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()[:16]
+
+_NS_PLANILHA = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_RE_TEXTO_COMPARTILHADO = re.compile(rb'(<c [^>]*t="s"[^>]*><v>)(\d+)(</v>)')
+_RE_DADOS_ABA = re.compile(rb"<sheetData\b.*?(?:</sheetData>|/>)", re.S)
+_RE_ESTILO_CELULA = re.compile(rb' s="\d+"')
+
+def _assinaturas_xml(path: str) -> dict:
+    """aba -> hash do conteúdo (lido do zip do xlsx, sem abrir no openpyxl)."""
+    with zipfile.ZipFile(path) as z:
+        wb = ET.fromstring(z.read("xl/workbook.xml"))
+        rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        alvos = {r.get("Id"): r.get("Target") for r in rels}
+        textos = []
+        if "xl/sharedStrings.xml" in z.namelist():
+            textos = ["".join(si.itertext()) for si in ET.fromstring(z.read("xl/sharedStrings.xml"))]
+        out = {}
+        for aba in wb.iter(f"{_NS_PLANILHA}sheet"):
+            alvo = alvos[aba.get(_NS_REL_ID)]
+            xml = z.read(alvo.lstrip("/") if alvo.startswith("/") else f"xl/{alvo}")
+            # só os dados das células (seleção, larguras e estilos não contam); o
+            # índice na tabela de textos compartilhados muda quando outra aba é
+            # editada: entra o texto, não o índice
+            dados = _RE_DADOS_ABA.search(xml)
+            xml = _RE_ESTILO_CELULA.sub(b"", dados.group(0) if dados else xml)
+            h = hashlib.sha1(_RE_TEXTO_COMPARTILHADO.sub(rb"\1\3", xml))
+            for _, i, _ in _RE_TEXTO_COMPARTILHADO.findall(xml):
+                h.update(textos[int(i)].encode("utf-8") + b"\x00")
+            out[aba.get("name")] = h.hexdigest()[:16]
+    return out
+
+@functools.lru_cache(maxsize=4)
+def _assinaturas_abas(path: str, mtime_ns: int, tamanho: int) -> tuple[str, dict]:
+    """(hash do arquivo, {aba: hash do conteúdo}); o XML só é lido se o JSON dessa versão não existir."""
+    arquivo = _hash_arquivo(path)
+    salvo = os.path.join(SIDECAR_DIR, f"abas-{arquivo}-v{SIDECAR_VERSAO}.json")
+    try:
+        with open(salvo, encoding="utf-8") as f:
+            return arquivo, json.load(f)
+    except (OSError, ValueError):
+        pass
+    try:
+        abas = _assinaturas_xml(path)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, IndexError):
+        abas = {}  # xlsx fora do padrão: cada aba usa o hash do arquivo
+    try:
+        os.makedirs(SIDECAR_DIR, exist_ok=True)
+        tmp = f"{salvo}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(abas, f)
+        os.replace(tmp, salvo)
+        for nome in os.listdir(SIDECAR_DIR):
+            if nome.startswith("abas-") and nome.endswith(".json") and os.path.join(SIDECAR_DIR, nome) != salvo:
+                os.remove(os.path.join(SIDECAR_DIR, nome))
+    except OSError:
+        pass  # sem permissão de escrita: recalcula no próximo processo
+    return arquivo, abas
+
+def _assinatura_aba(aba: str) -> str:
+    """Hash do conteúdo de uma aba da PLANILHA (ou do arquivo todo, se o xlsx fugir do padrão)."""
+    st = os.stat(PLANILHA)
+    arquivo, abas = _assinaturas_abas(PLANILHA, st.st_mtime_ns, st.st_size)
+    return abas.get(aba) or arquivo
+
+def _salvar_textos(s: pd.Series, base: str):
+    na = s.isna().to_numpy(dtype=bool)
+    partes = [b"" if n else str(v).encode("utf-8") for v, n in zip(s.tolist(), na)]
+    off = np.zeros(len(partes) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in partes], out=off[1:])
+    np.save(base + ".npy", np.frombuffer(b"".join(partes), dtype=np.uint8))
+    np.save(base + ".off.npy", off)
+    np.save(base + ".na.npy", na)
+
+def _carregar_textos(base: str, n: int, dtype: str):
+    """Coluna de texto do sidecar: Arrow sobre o mmap se houver pyarrow; senão objetos Python."""
+    na = np.load(base + ".na.npy")
+    off = np.load(base + ".off.npy", mmap_mode="r")
+    blob = np.load(base + ".npy", mmap_mode="r") if off[-1] else np.zeros(0, dtype=np.uint8)
+    if pa is not None and dtype != "object":
+        validos = pa.py_buffer(np.packbits(~na, bitorder="little"))
+        arr = pa.LargeStringArray.from_buffers(n, pa.py_buffer(off), pa.py_buffer(blob), validos,
+                                               null_count=int(na.sum()))
+        return pd.Series(pd.arrays.ArrowStringArray(arr), copy=False).astype(dtype, copy=False)
+    dados = blob.tobytes()
+    vals = np.array([dados[off[i]:off[i + 1]].decode("utf-8") for i in range(n)], dtype=object)
+    vals[na] = None
+    return pd.Series(vals, dtype=None if dtype == "object" else dtype)
+
+def _sidecar_salvar(df: pd.DataFrame, pasta: str):
+    """Grava o DataFrame no formato colunar; escrita atômica via rename da pasta."""
+    os.makedirs(os.path.dirname(pasta), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(pasta))
+    meta = {"colunas": []}
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        arq = f"c{i}"
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, arq + ".npy"), s.cat.codes.to_numpy())
+            _salvar_textos(pd.Series(s.cat.categories), os.path.join(tmp, arq + ".cat"))
+            tipo = "categoria"
+        elif s.dtype.kind in "biuf":
+            np.save(os.path.join(tmp, arq + ".npy"), s.to_numpy())
+            tipo = "num"
+        elif s.dtype.kind == "M":
+            np.save(os.path.join(tmp, arq + ".npy"), s.to_numpy().view("int64"))
+            tipo = "data"
+        else:
+            _salvar_textos(s, os.path.join(tmp, arq))
+            tipo = "texto"
+        meta["colunas"].append({"nome": str(col), "arq": arq, "tipo": tipo, "dtype": str(s.dtype)})
+    meta["linhas"] = len(df)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.replace(tmp, pasta)
+    except OSError:
+        # outro worker já gravou o mesmo sidecar
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _sidecar_carregar(pasta: str) -> pd.DataFrame:
+    with open(os.path.join(pasta, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    n = meta["linhas"]
+    cols = {}
+    for c in meta["colunas"]:
+        base = os.path.join(pasta, c["arq"])
+        if c["tipo"] == "texto":
+            cols[c["nome"]] = _carregar_textos(base, n, c["dtype"])
+            continue
+        arr = np.load(base + ".npy", mmap_mode="r") if n else np.load(base + ".npy")
+        if c["tipo"] == "num":
+            cols[c["nome"]] = pd.Series(arr, dtype=c["dtype"], copy=False)
+        elif c["tipo"] == "data":
+            cols[c["nome"]] = pd.Series(np.asarray(arr).view(c["dtype"]))
+        else:
+            off = np.load(base + ".cat.off.npy")
+            categorias = pd.Index(_carregar_textos(base + ".cat", len(off) - 1, "string"))
+            cols[c["nome"]] = pd.Series(pd.Categorical.from_codes(arr, dtype=pd.CategoricalDtype(categorias)))
+    # um bloco por coluna: sem consolidar (copiar) as colunas numéricas mapeadas
+    return pd.concat(cols, axis=1, copy=False) if cols else pd.DataFrame(index=pd.RangeIndex(n))
+
+def _ler_aba_com_sidecar(aba: str, normalizar, assinatura: str | None = None):
+    """
+    Lê a aba normalizada pelo sidecar se existir para o conteúdo atual da aba;
+    senão lê via openpyxl, aplica `normalizar` e grava o sidecar.
+    `normalizar` pode retornar None (aba inválida) — nesse caso nada é gravado.
+    """
+    assinatura = assinatura or _assinatura_aba(aba)
+    pasta = os.path.join(SIDECAR_DIR, f"{aba}-{assinatura}-v{SIDECAR_VERSAO}")
+    if os.path.isfile(os.path.join(pasta, "meta.json")):
+        try:
+            with medir_etapa("ler_sidecar", aba=aba):
+                df = _sidecar_carregar(pasta)
+            contar("busca_sites_cache_total", cache="sidecar", resultado="hit")
+            return df
+        except Exception:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+    contar("busca_sites_cache_total", cache="sidecar", resultado="miss")
+    with medir_etapa("ler_xlsx", aba=aba):
+        out = normalizar(pd.read_excel(PLANILHA, sheet_name=aba, engine="openpyxl"))
+    if out is None:
+        return None
+    try:
+        _sidecar_salvar(out, pasta)
+        # remove sidecars antigos da mesma aba (quem ainda os tem mapeados não é afetado)
+        for nome in os.listdir(SIDECAR_DIR):
+            antigo = os.path.join(SIDECAR_DIR, nome)
+            if nome.startswith(f"{aba}-") and antigo != pasta:
+                shutil.rmtree(antigo, ignore_errors=True)
+        # devolve a versão mapeada, a mesma que os outros workers vão abrir
+        return _sidecar_carregar(pasta)
+    except OSError:
+        return out  # sem permissão de escrita: segue só com a leitura do xlsx
+
+# ------------------------------------------------------------
+# Dados principais (aba: enderecos)
+# ------------------------------------------------------------
+def _normalizar_enderecos(df: pd.DataFrame) -> pd.DataFrame:
+    # padronizar nomes de colunas
+    df.columns = df.columns.str.strip().str.lower()
+
+    # renomear para padrão interno
+    df = df.rename(columns={
+        "sigla_da_torre": "sigla",
+        "nome_da_torre": "nome",
+        "endereço": "endereco",
+        "latitude": "lat",
+        "longitude": "lon",
+    })
+
+    # normalização textual
+    for col in ["sigla", "nome", "endereco", "detentora"]:
+        if col in df.columns:
+            df[col] = df[col].astype("string").str.strip()
+
+    # coordenadas com ponto
+    for col in ["lat", "lon"]:
+        if col in df.columns:
+            df[col] = (
+                df[col].astype(str)
+                .str.replace(",", ".", regex=False)
+                .replace("", pd.NA)
+                .astype(float)
+            )
+
+    # garantir detentora
+    if "detentora" not in df.columns:
+        df["detentora"] = pd.NA
+
+    # município calculado uma vez na carga (vai junto no sidecar)
+    df["cidade"] = detectar_cidades(
+        df["nome"] if "nome" in df.columns else pd.Series(pd.NA, index=df.index, dtype="string"),
+        df.get("endereco"),
+    )
+
+    # representação compacta: poucas detentoras/cidades distintas viram códigos;
+    # float32 ainda guarda coordenadas com precisão < 1 m
+    for col in ["detentora", "cidade"]:
+        df[col] = df[col].astype("string").astype("category")
+    for col in ["lat", "lon"]:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float32)
+
+    return df
+
+class BaseSites:
+    """
+    Uma carga da aba enderecos e os índices derivados dela. As posições dos
+    índices só valem para este df: cada consulta pega um BaseSites e usa essa
+    mesma referência do começo ao fim. Uma recarga no meio (outra thread, o
+    preenchimento de coordenadas) cria outro BaseSites sem afetar este.
+    """
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def indice(self, nome: str, colunas, construir):
+        """Índice `nome` deste df, construído (ou reaproveitado via _derivado) na primeira vez."""
+        with self._lock:
+            if nome not in self._indices:
+                self._indices[nome] = _derivado(nome, self.df, colunas, construir)
+            return self._indices[nome]
+
+@functools.lru_cache(maxsize=1)
+def carregar_base() -> BaseSites:
+    assinatura = _assinatura_aba("enderecos")
+    df = _aplicar_coord_derivadas(_ler_aba_com_sidecar("enderecos", _normalizar_enderecos, assinatura))
+    _ABAS_CARREGADAS["enderecos"] = assinatura
+    return BaseSites(df)
+
+def carregar_dados() -> pd.DataFrame:
+    """Sites da carga atual (para usar junto com um índice, pegar carregar_base() uma vez)."""
+    return carregar_base().df
+
+# ------------------------------------------------------------
+# Coordenadas faltantes (geocodificação em segundo plano)
+# ------------------------------------------------------------
+# Sites sem lat/lon têm o endereço geocodificado por uma thread daemon, fora
+# das reexecuções da página, pelo mesmo geocode_address (rate limit + cache
+# SQLite). Cada resultado vai para a tabela coord_derivada do banco de
+# geocodificação, chaveada por (sigla, endereço): ao reiniciar, o que já tem
+# resposta definitiva é pulado e só TIMEOUT/EXCEPTION são tentados de novo.
+# carregar_dados() aplica as coordenadas encontradas (coluna coord_derivada).
+PREENCHER_COORDENADAS = _config_bool("PREENCHER_COORDENADAS", True)
+PREENCHER_INTERVALO_S = float(_config("PREENCHER_INTERVALO_S", 2.0))  # deixa folga do rate limit para a UI
+PREENCHER_LOTE = 20   # resultados entre uma recarga da base e a próxima
+# torres co-localizadas dividem o endereço; acima disso o texto repetido é marcador, não endereço
+PREENCHER_MAX_REPETICOES = int(_config("PREENCHER_MAX_REPETICOES", 5))
+_ENDERECO_MARCADOR = r"\b(?:em busca|a definir|sem endereco|nao informado|nao se aplica)\b"
+_PREENCHER_LOCK = threading.Lock()
+_preencher_estado = {"rodando": False, "pendentes": 0, "feitos": 0, "encontrados": 0}
+_coord_pronto = False
+
+def _coord_conn():
+    global _coord_pronto
+    con = _geocache_conn()
+    if not _coord_pronto:
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS coord_derivada ("
+            " sigla TEXT, endereco TEXT, status TEXT, lat REAL, lon REAL, provedor TEXT, atualizado REAL,"
+            " PRIMARY KEY (sigla, endereco))"
+        )
+        _coord_pronto = True
+    return con
+
+def _ler_coord_derivadas() -> pd.DataFrame:
+    try:
+        con = _coord_conn()
+    except sqlite3.Error:
+        return pd.DataFrame(columns=["sigla", "endereco", "status", "lat", "lon"])
+    try:
+        return pd.read_sql_query("SELECT sigla, endereco, status, lat, lon FROM coord_derivada", con)
+    finally:
+        con.close()
+
+def _sites_sem_coordenadas(df: pd.DataFrame) -> pd.DataFrame:
+    """Sites sem lat/lon com endereço geocodificável."""
+    if "endereco" not in df.columns:
+        return df.iloc[0:0]
+    falta = df.loc[df["lat"].isna() | df["lon"].isna(), ["sigla", "endereco", "cidade"]]
+    # fora: marcadores ("SITE EM BUSCA"), textos repetidos em muitos sites e textos sem palavra útil
+    texto = _dobrar_busca(falta["endereco"])
+    marcador = texto.str.contains(_ENDERECO_MARCADOR, regex=True)
+    repetido = texto.map(texto.value_counts()) > PREENCHER_MAX_REPETICOES
+    com_palavras = falta.index.isin(_palavras_gazetteer(falta["endereco"]).index)
+    return falta[~marcador.to_numpy() & ~repetido.to_numpy() & com_palavras]
+
+def _aplicar_coord_derivadas(df: pd.DataFrame) -> pd.DataFrame:
+    """Preenche lat/lon que faltam com as coordenadas já geocodificadas; marca coord_derivada."""
+    df = df.assign(coord_derivada=False)
+    faltando = _sites_sem_coordenadas(df)
+    if faltando.empty:
+        return df
+    achados = _ler_coord_derivadas()
+    achados = achados[achados["status"] == "OK"]
+    if achados.empty:
+        return df
+    chave = faltando["sigla"].astype(str) + _SEP + faltando["endereco"].astype(str)
+    coords = achados.set_index(achados["sigla"] + _SEP + achados["endereco"])[["lat", "lon"]]
+    coords = coords[~coords.index.duplicated()].reindex(chave.to_numpy())
+    tem = coords["lat"].notna().to_numpy()
+    if not tem.any():
+        return df
+    linhas = faltando.index[tem]
+    lat, lon = df["lat"].to_numpy(dtype=np.float32, copy=True), df["lon"].to_numpy(dtype=np.float32, copy=True)
+    derivada = np.zeros(len(df), dtype=bool)
+    pos = df.index.get_indexer(linhas)
+    lat[pos], lon[pos], derivada[pos] = coords["lat"].to_numpy()[tem], coords["lon"].to_numpy()[tem], True
+    return df.assign(lat=lat, lon=lon, coord_derivada=derivada)
+
+def _gravar_coord(sigla: str, endereco: str, res, dbg: dict):
+    con = _coord_conn()
+    try:
+        con.execute(
+            "INSERT OR REPLACE INTO coord_derivada (sigla, endereco, status, lat, lon, provedor, atualizado)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sigla, endereco, "OK" if res else dbg.get("status"), res["lat"] if res else None,
+             res["lon"] if res else None, dbg.get("provider"), time.time()),
+        )
+    finally:
+        con.close()
+
+def _preencher_coordenadas():
+    try:
+        base = _ler_aba_com_sidecar("enderecos", _normalizar_enderecos)
+        faltando = _sites_sem_coordenadas(base)
+        feitos = _ler_coord_derivadas()
+        feitos = feitos[~feitos["status"].isin(["TIMEOUT", "EXCEPTION"])]
+        definitivos = set(zip(feitos["sigla"], feitos["endereco"]))
+        # torres co-localizadas: cada consulta distinta vai ao provedor uma vez só
+        fila = {}
+        for r in faltando.itertuples():
+            sigla, endereco = str(r.sigla), str(r.endereco)
+            if (sigla, endereco) not in definitivos:
+                consulta = endereco if pd.isna(r.cidade) else f"{endereco}, {r.cidade}"
+                fila.setdefault(consulta, []).append((sigla, endereco))
+        _preencher_estado["pendentes"] = sum(len(s) for s in fila.values())
+
+        novos = 0
+        for consulta, sites in fila.items():
+            # só provedores online: o gazetteer offline é derivado das próprias torres
+            res, dbg = geocode_address(consulta, concorrente=False, offline="nao")
+            for sigla, endereco in sites:
+                _gravar_coord(sigla, endereco, res, dbg)
+            _preencher_estado["feitos"] += len(sites)
+            if res:
+                _preencher_estado["encontrados"] += len(sites)
+                novos += len(sites)
+            if novos >= PREENCHER_LOTE:
+                _invalidar_base()
+                novos = 0
+            time.sleep(PREENCHER_INTERVALO_S)
+        if novos:
+            _invalidar_base()
+    finally:
+        _preencher_estado["rodando"] = False
+
+def iniciar_preenchimento_coordenadas() -> dict:
+    """Dispara (uma vez por processo) a geocodificação dos sites sem coordenadas; retorna o estado."""
+    with _PREENCHER_LOCK:
+        if PREENCHER_COORDENADAS and not _preencher_estado["rodando"] and not _preencher_estado.get("iniciado"):
+            _preencher_estado.update(rodando=True, iniciado=True)
+            threading.Thread(target=_preencher_coordenadas, name="preencher-coordenadas", daemon=True).start()
+    return dict(_preencher_estado)
+
+# ------------------------------------------------------------
+# Aba "acessos" (técnicos com status ok)
+# ------------------------------------------------------------
+def _normalizar_acessos(acc: pd.DataFrame):
+    acc.columns = acc.columns.str.strip().str.lower()
+
+    if "tecnico" not in acc.columns:
+        for alt in ["técnico", "nome_tecnico", "colaborador"]:
+            if alt in acc.columns:
+                acc = acc.rename(columns={alt: "tecnico"})
+                break
+
+    if "sigla" not in acc.columns:
+        for alt in ["sigla_da_torre", "site", "torre"]:
+            if alt in acc.columns:
+                acc = acc.rename(columns={alt: "sigla"})
+                break
+
+    # checagem mínima
+    if "sigla" not in acc.columns or "tecnico" not in acc.columns:
+        return None
+
+    if "status" not in acc.columns:
+        acc["status"] = "ok"
+
+    for c in ["sigla", "tecnico", "status"]:
+        acc[c] = acc[c].astype("string").str.strip()
+
+    def norm(x): return strip_accents(str(x)).lower()
+    acc = acc[acc["status"].apply(norm) == "ok"]
+
+    return acc.reset_index(drop=True)
+
+@functools.lru_cache(maxsize=1)
+def carregar_acessos_ok():
+    try:
+        assinatura = _assinatura_aba("acessos")
+        acc = _ler_aba_com_sidecar("acessos", _normalizar_acessos, assinatura)
+    except Exception:
+        return None
+    _ABAS_CARREGADAS["acessos"] = assinatura
+    return acc
+
+# ------------------------------------------------------------
+# Estruturas derivadas da base (reaproveitadas entre recargas)
+# ------------------------------------------------------------
+# Cada estrutura (índices espacial, de sigla, de texto, gazetteer) fica
+# guardada junto com a impressão digital das colunas de que depende: depois
+# de uma recarga que não mexeu nessas colunas, é reaproveitada sem reconstruir.
+_DERIVADOS = {}
+_DERIVADOS_LOCK = threading.Lock()
+
+def _impressao(df: pd.DataFrame, colunas) -> str:
+    cols = [c for c in colunas if c in df.columns]
+    linhas = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    return f"{cols}:{hashlib.sha1(linhas.tobytes()).hexdigest()}"
+
+def _derivado(nome: str, df: pd.DataFrame, colunas, construir):
+    chave = _impressao(df, colunas)
+    with _DERIVADOS_LOCK:
+        atual = _DERIVADOS.get(nome)
+        if atual is not None and atual[0] == chave:
+            contar("busca_sites_cache_total", cache=f"indice_{nome}", resultado="hit")
+            return atual[1]
+    contar("busca_sites_cache_total", cache=f"indice_{nome}", resultado="miss")
+    with medir_etapa("construir_indice", indice=nome):
+        valor = construir(df)
+    with _DERIVADOS_LOCK:
+        _DERIVADOS[nome] = (chave, valor)
+    return valor
+
+# ------------------------------------------------------------
+# Índices por SIGLA (montados uma vez por carga)
+# ------------------------------------------------------------
+def _construir_indice_sigla(df: pd.DataFrame) -> dict:
+    chaves = df["sigla"].astype("string").str.upper()
+    return chaves.groupby(chaves, sort=False).indices
+
+def carregar_indice_sigla(base: BaseSites | None = None) -> dict:
+    """SIGLA em maiúsculas -> posições (iloc) em base.df."""
+    return (base or carregar_base()).indice("sigla", ["sigla"], _construir_indice_sigla)
+
+# pares (sigla, técnico) e mapa da última montagem, para atualizar só as siglas alteradas
+_TECNICOS = {"pares": None, "mapa": {}}
+
+def _agrupar_tecnicos(pares: pd.DataFrame) -> dict:
+    return {sig: tuple(sorted(t)) for sig, t in pares.groupby("sigla", sort=False)["tecnico"]}
+
+@functools.lru_cache(maxsize=1)
+def carregar_tecnicos_por_sigla() -> dict:
+    """SIGLA em maiúsculas -> tupla ordenada dos técnicos com acesso ok."""
+    acc = carregar_acessos_ok()
+    if acc is None or acc.empty:
+        _TECNICOS.update(pares=None, mapa={})
+        return {}
+    pares = pd.DataFrame({"sigla": acc["sigla"].str.upper(), "tecnico": acc["tecnico"]})
+    pares = pares.dropna().drop_duplicates().reset_index(drop=True)
+
+    anteriores = _TECNICOS["pares"]
+    if anteriores is None:
+        mapa = _agrupar_tecnicos(pares)
+    else:
+        # só as siglas que ganharam ou perderam algum técnico são reagrupadas
+        dif = pares.merge(anteriores, how="outer", indicator=True)
+        mexidas = set(dif.loc[dif["_merge"] != "both", "sigla"])
+        mapa = {sig: t for sig, t in _TECNICOS["mapa"].items() if sig not in mexidas}
+        mapa.update(_agrupar_tecnicos(pares[pares["sigla"].isin(mexidas)]))
+    _TECNICOS.update(pares=pares, mapa=mapa)
+    return mapa
+
+def tecnicos_por_sigla(sig) -> tuple:
+    return carregar_tecnicos_por_sigla().get(str(sig).upper(), ())
+
+def separar_siglas(texto: str) -> list[str]:
+    """Lista colada (espaço, vírgula, ';' ou quebra de linha) -> siglas em maiúsculas, sem repetição."""
+    vistas = dict.fromkeys(p.upper() for p in re.split(r"[\s,;]+", str(texto or "")) if p)
+    return list(vistas)
+
+@instrumentar("buscar_siglas")
+def buscar_siglas(siglas) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Linhas da base para as siglas pedidas (na ordem pedida).
+    Retorna (df, siglas_nao_encontradas).
+    """
+    base = carregar_base()
+    idx = carregar_indice_sigla(base)
+    pos, faltando = [], []
+    for sig in siglas:
+        p = idx.get(str(sig).upper())
+        if p is None:
+            faltando.append(sig)
+        else:
+            pos.extend(p.tolist())
+    return base.df.iloc[pos].reset_index(drop=True), faltando
+
+# ------------------------------------------------------------
+# Busca textual (sigla / nome / endereço) — índice invertido de trigramas
+# ------------------------------------------------------------
+# Texto dobrado (sem acentos, minúsculo, só [a-z0-9] e espaço); cada palavra
+# vira "  palavra " e gera trigramas, então "  s", " sb" marcam início de
+# palavra (busca por prefixo). Com 37 símbolos o código do trigrama cabe em
+# 37³ posições: o índice é um CSR numpy (ptr[código]..ptr[código+1] em docs).
+# A consulta conta trigramas em comum por site (bincount), pega os melhores
+# candidatos e reordena com bônus para sigla exata/prefixo e texto contido.
+BUSCA_LIMITE = 20
+_BUSCA_CANDIDATOS = 200
+_ALFABETO = np.zeros(256, dtype=np.int32)
+_ALFABETO[np.frombuffer(b"abcdefghijklmnopqrstuvwxyz0123456789", dtype=np.uint8)] = np.arange(1, 37)
+_N_TRIGRAMAS = 37 ** 3
+_CAMPOS_BUSCA = ("sigla", "nome", "endereco")
+
+def _dobrar_busca(s: pd.Series) -> pd.Series:
+    return _dobrar_coluna(s).fillna("").str.replace(r"[^a-z0-9]+", " ", regex=True).str.strip()
+
+def _codigos_trigramas(texto: str) -> np.ndarray:
+    """Códigos dos trigramas de um texto já acolchoado (ASCII [a-z0-9 ])."""
+    c = _ALFABETO[np.frombuffer(texto.encode("ascii"), dtype=np.uint8)]
+    return c[:-2] * 1369 + c[1:-1] * 37 + c[2:]
+
+def construir_indice_texto(df: pd.DataFrame) -> dict:
+    """Índice de trigramas das colunas sigla/nome/endereco (as ausentes contam como vazias)."""
+    n = len(df)
+    vazio = pd.Series("", index=df.index, dtype="string")
+    dobrados = {c: _dobrar_busca(df[c] if c in df.columns else vazio) for c in _CAMPOS_BUSCA}
+
+    # documento de cada site: "  tok   tok ..." (campos separados como palavras)
+    doc = ("  " + (dobrados["sigla"] + " " + dobrados["nome"] + " " + dobrados["endereco"])
+           .str.replace(" +", "   ", regex=True).str.strip() + " ")
+    tamanhos = doc.str.len().to_numpy(dtype=np.int64)
+    if n == 0:
+        docs, ptr = np.zeros(0, np.int32), np.zeros(_N_TRIGRAMAS + 1, np.int64)
+    else:
+        cod = _codigos_trigramas("".join(doc.tolist()))
+        dono = np.repeat(np.arange(n, dtype=np.int64), tamanhos)
+        # descarta trigramas que atravessam dois documentos e o "   " entre palavras
+        ok = (dono[:-2] == dono[2:]) & (cod != 0)
+        cod, dono = cod[ok], dono[:-2][ok]
+        # dono já é crescente: ordenação estável pelo código deixa (código, site)
+        # ordenado; depois só tira repetições adjacentes
+        ordem = np.argsort(cod.astype(np.uint16), kind="stable")  # 37³ < 2¹⁶: radix sort
+        cod, dono = cod[ordem], dono[ordem]
+        novo = np.ones(len(cod), dtype=bool)
+        novo[1:] = (cod[1:] != cod[:-1]) | (dono[1:] != dono[:-1])
+        docs = dono[novo].astype(np.int32)
+        ptr = np.searchsorted(cod[novo], np.arange(_N_TRIGRAMAS + 1)).astype(np.int64)
+
+    return {
+        "n": n, "docs": docs, "ptr": ptr,
+        # trigramas distintos por site (normaliza o placar de sites com texto longo)
+        "ntri": np.maximum(np.bincount(docs, minlength=n), 1).astype(np.float32),
+        **{c: dobrados[c].to_numpy(dtype=object) for c in _CAMPOS_BUSCA},
+    }
+
+def _trigramas_consulta(consulta: str) -> tuple[str, np.ndarray]:
+    """Consulta dobrada e seus trigramas; a última palavra vale como prefixo (sem espaço final)."""
+    q = re.sub(r"[^a-z0-9]+", " ", strip_accents(str(consulta or "")).lower()).strip()
+    if not q:
+        return q, np.zeros(0, np.int64)
+    palavras = q.split(" ")
+    cods = [_codigos_trigramas("  " + p + " ") for p in palavras[:-1]]
+    cods.append(_codigos_trigramas("  " + palavras[-1]))
+    return q, np.unique(np.concatenate(cods))
+
+def buscar_texto_indice(idx: dict, consulta: str, limite: int = BUSCA_LIMITE):
+    """(posições, placar) dos melhores sites para a consulta, do maior para o menor placar."""
+    q, cods = _trigramas_consulta(consulta)
+    if not len(cods) or idx["n"] == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.float32)
+
+    ptr, docs = idx["ptr"], idx["docs"]
+    listas = [docs[ptr[c]:ptr[c + 1]] for c in cods]
+    comuns = np.bincount(np.concatenate(listas), minlength=idx["n"])
+    # exige ao menos metade dos trigramas da consulta
+    cand = np.flatnonzero(comuns >= max(1, len(cods) // 2))
+    if not len(cand):
+        return np.zeros(0, np.int64), np.zeros(0, np.float32)
+    # Dice entre os trigramas da consulta e os do site: tolera erros de digitação
+    placar = 2 * comuns[cand].astype(np.float32) / (len(cods) + idx["ntri"][cand])
+    if len(cand) > _BUSCA_CANDIDATOS:
+        melhores = np.argpartition(-placar, _BUSCA_CANDIDATOS - 1)[:_BUSCA_CANDIDATOS]
+        cand, placar = cand[melhores], placar[melhores]
+
+    # reordenação exata só nos candidatos
+    bonus = np.zeros(len(cand), dtype=np.float32)
+    for j, p in enumerate(cand):
+        sig = idx["sigla"][p]
+        if sig == q:
+            bonus[j] += 3
+        elif sig.startswith(q):
+            bonus[j] += 2
+        if q in idx["nome"][p] or q in idx["endereco"][p]:
+            bonus[j] += 1
+    final = placar + bonus
+    ordem = np.lexsort((cand, -final))[:limite]
+    return cand[ordem].astype(np.int64), final[ordem]
+
+def carregar_indice_texto(base: BaseSites | None = None):
+    """Índice de trigramas dos sites, construído uma vez por carga de dados."""
+    return (base or carregar_base()).indice("texto", _CAMPOS_BUSCA, construir_indice_texto)
+
+@instrumentar("buscar_sites_texto")
+def buscar_sites_texto(consulta: str, limite: int = BUSCA_LIMITE) -> pd.DataFrame:
+    """
+    Busca por prefixo/aproximada em sigla, nome e endereço (sem acentos, sem caixa).
+    Retorna as linhas da base com a coluna 'relevancia', da mais para a menos relevante.
+    """
+    base = carregar_base()
+    pos, placar = buscar_texto_indice(carregar_indice_texto(base), consulta, limite)
+    out = base.df.iloc[pos].copy()
+    out["relevancia"] = np.round(placar.astype(float), 3)
+    return out.reset_index(drop=True)
+
+# ------------------------------------------------------------
+# Geocodificação offline (gazetteer a partir da própria planilha)
+# ------------------------------------------------------------
+# Cada torre com coordenadas contribui com as palavras do seu endereço e do
+# nome (que costuma trazer o bairro: "NITEROI - ICARAÍ"). A consulta pesa cada
+# palavra por IDF; as torres de maior placar (na cidade detectada, se houver)
+# dão a posição pela mediana. Sem casamento suficiente, cai no centróide do
+# município (mediana das torres da cidade). Confiança em [0, 1].
+# Só o bairro ("Centro, Barra Mansa") não localiza a rua: a confiança é limitada
+# pela fração das palavras do logradouro que casaram, e sem nenhuma o nível é
+# "bairro" (no máximo _CONFIANCA_BAIRRO).
+GAZETTEER_MIN_CONFIANCA = 0.35
+GAZETTEER_DISPERSAO_KM = 2.0   # torres empatadas mais espalhadas que isso -> confiança proporcionalmente menor
+_CONFIANCA_CENTROIDE = 0.2
+_CONFIANCA_BAIRRO = 0.5
+_TIPOS_LOGRADOURO = frozenset("""
+r rua av avenida estr estrada rod rodovia tv trav travessa al alameda pc pca praca lg largo
+via beco servidao ladeira
+""".split())
+_PALAVRAS_VAZIAS = _TIPOS_LOGRADOURO | frozenset("""
+de da do das dos e em na no nas nos sn km lote lt quadra qd bloco bl
+casa apto apt loja sala cep rj brasil estado proximo prox esquina com
+""".split())
+
+def _palavras_gazetteer(s: pd.Series) -> pd.Series:
+    """Palavras úteis de cada texto (uma linha por palavra, índice = linha de origem)."""
+    p = _dobrar_busca(s).str.split(" ").explode()
+    return p[(p.str.len() > 1) & ~p.str.isdigit() & ~p.isin(_PALAVRAS_VAZIAS)]
+
+def _palavras_texto(texto: str) -> set:
+    """Mesmo critério de _palavras_gazetteer para um único texto (consulta)."""
+    dobrado = re.sub(r"[^a-z0-9]+", " ", strip_accents(texto).lower())
+    return {p for p in dobrado.split() if len(p) > 1 and not p.isdigit() and p not in _PALAVRAS_VAZIAS}
+
+def _palavras_logradouro(texto: str) -> set:
+    """Palavras dos trechos (entre vírgulas) que são logradouro: começam pelo tipo ou trazem número."""
+    palavras = set()
+    for trecho in strip_accents(texto).lower().split(","):
+        termos = re.sub(r"[^a-z0-9]+", " ", trecho).split()
+        if termos and (termos[0] in _TIPOS_LOGRADOURO or any(t.isdigit() for t in termos)):
+            palavras |= _palavras_texto(trecho)
+    return palavras
+
+def construir_gazetteer(df: pd.DataFrame) -> dict:
+    """Índice invertido palavra -> torres (CSR numpy) + centróides por município."""
+    tem = df["lat"].notna() & df["lon"].notna()
+    base = df[tem].reset_index(drop=True)
+    n = len(base)
+
+    vazio = pd.Series("", index=base.index, dtype="string")
+    endereco = base["endereco"].fillna("") if "endereco" in base.columns else vazio
+    nome = base["nome"].fillna("") if "nome" in base.columns else vazio
+    pal = _palavras_gazetteer(endereco + " " + nome)
+    pares = pd.DataFrame({"pal": pal.to_numpy(dtype=object), "doc": pal.index.to_numpy()}).drop_duplicates()
+    codigos, vocab = pd.factorize(pares["pal"], sort=True)
+    ordem = np.lexsort((pares["doc"].to_numpy(), codigos))
+    docs = pares["doc"].to_numpy()[ordem].astype(np.int32)
+    ptr = np.searchsorted(codigos[ordem], np.arange(len(vocab) + 1)).astype(np.int64)
+    idf = np.log1p(n / np.maximum(np.diff(ptr), 1)).astype(np.float32)
+
+    cidade = base["cidade"] if "cidade" in base.columns else pd.Series(pd.NA, index=base.index, dtype="string")
+    centroides = base.groupby(cidade, dropna=True)[["lat", "lon"]].median()
+    return {
+        "n": n, "vocab": {p: i for i, p in enumerate(vocab)}, "ptr": ptr, "docs": docs, "idf": idf,
+        "lat": base["lat"].to_numpy(dtype=float), "lon": base["lon"].to_numpy(dtype=float),
+        "cidade": cidade.to_numpy(dtype=object, na_value=None),
+        "endereco": endereco.to_numpy(dtype=object),
+        "centroides": {c: (float(r.lat), float(r.lon)) for c, r in centroides.iterrows()},
+    }
+
+def geocodificar_gazetteer(gz: dict, address: str):
+    """(result, dbg) no mesmo formato dos provedores online; dbg traz 'confianca' e 'nivel'."""
+    dbg = {"provider": "offline", "status": None, "error_message": None, "confianca": 0.0, "nivel": None}
+    if not isinstance(address, str) or not address.strip():
+        dbg["status"] = "MISSING_ADDRESS"
+        return None, dbg
+
+    cidade = _match_city_base(address)
+    palavras = _palavras_texto(address)
+    if cidade:
+        # a cidade já filtra as torres; suas palavras só inflariam o placar
+        palavras -= _palavras_texto(cidade)
+    ids = [gz["vocab"][p] for p in palavras if p in gz["vocab"]]
+
+    rua = _palavras_logradouro(address) & palavras
+
+    melhor, confianca, nivel = None, 0.0, "rua"
+    if ids and gz["n"]:
+        # palavras desconhecidas também contam no denominador (peso máximo)
+        peso_total = float(gz["idf"][ids].sum()) + (len(palavras) - len(ids)) * float(np.log1p(gz["n"]))
+        placar = np.zeros(gz["n"], dtype=np.float32)
+        for i in ids:
+            placar[gz["docs"][gz["ptr"][i]:gz["ptr"][i + 1]]] += gz["idf"][i]
+        if cidade:
+            placar[gz["cidade"] != cidade] = 0
+        topo = float(placar.max())
+        if topo > 0:
+            melhor = np.flatnonzero(placar >= topo * 0.999)
+            confianca = topo / peso_total
+            # palavras do logradouro presentes na torre escolhida (docs de cada palavra vêm ordenados)
+            casadas = 0
+            for i in (gz["vocab"][p] for p in rua if p in gz["vocab"]):
+                docs = gz["docs"][gz["ptr"][i]:gz["ptr"][i + 1]]
+                j = np.searchsorted(docs, melhor[0])
+                casadas += bool(j < len(docs) and docs[j] == melhor[0])
+            if casadas:
+                confianca = min(confianca, _CONFIANCA_BAIRRO + (1 - _CONFIANCA_BAIRRO) * casadas / len(rua))
+            else:
+                nivel = "bairro"
+                confianca = min(confianca, _CONFIANCA_BAIRRO)
+
+    if melhor is not None:
+        # medianas: robustas a uma ou outra coordenada errada na planilha
+        lat = float(np.median(gz["lat"][melhor]))
+        lon = float(np.median(gz["lon"][melhor]))
+        dispersao = float(np.median(haversine_km(lat, lon, gz["lat"][melhor], gz["lon"][melhor])))
+        confianca *= min(1.0, GAZETTEER_DISPERSAO_KM / max(dispersao, 1e-9))
+
+    if melhor is not None and confianca >= GAZETTEER_MIN_CONFIANCA:
+        ref = gz["endereco"][melhor[0]]
+        formatted = f"≈ {ref}" + (f", {gz['cidade'][melhor[0]]}" if gz["cidade"][melhor[0]] else "")
+        if nivel == "bairro":
+            # sem rua casada, o endereço da torre não é o do cliente
+            formatted = f"≈ {address.strip()} (bairro aproximado)"
+        dbg.update(status="OK", nivel=nivel, confianca=round(confianca, 3), torres=int(len(melhor)),
+                   dispersao_km=round(dispersao, 3))
+        return {"lat": lat, "lon": lon, "formatted": formatted}, dbg
+
+    if cidade and cidade in gz["centroides"]:
+        lat, lon = gz["centroides"][cidade]
+        dbg.update(status="OK", nivel="cidade", confianca=_CONFIANCA_CENTROIDE)
+        return {"lat": lat, "lon": lon, "formatted": f"≈ {cidade} (centro aproximado)"}, dbg
+
+    dbg["status"] = "ZERO_RESULTS"
+    return None, dbg
+
+def carregar_gazetteer(base: BaseSites | None = None):
+    """Gazetteer das torres, construído uma vez por carga de dados."""
+    return (base or carregar_base()).indice("gazetteer", ["lat", "lon", "endereco", "nome", "cidade"],
+                                            construir_gazetteer)
+
+@instrumentar("geocode_offline")
+def geocode_offline(address: str):
+    """Geocodificação aproximada só com a planilha (milissegundos, sem rede)."""
+    try:
+        return geocodificar_gazetteer(carregar_gazetteer(), address)
+    except Exception as e:
+        return None, {"provider": "offline", "status": "EXCEPTION", "error_message": str(e)}
+
+# ------------------------------------------------------------
+# Índice espacial (grade regular lat/lon) — k sites mais próximos
+# ------------------------------------------------------------
+# Os pontos são ordenados pela chave da célula, então cada célula vira um
+# intervalo contíguo dos arrays; a busca percorre anéis de células ao redor
+# da origem e para quando nenhum ponto fora dos anéis já vistos pode ser
+# mais próximo que o k-ésimo candidato.
+R_TERRA_KM = 6371.0088
+K_SITES_PROXIMOS = 3
+
+def construir_indice_espacial(lats, lons, cell_deg: float | None = None):
+    """
+    Monta o índice a partir de arrays de lat/lon (linhas sem coordenada são ignoradas).
+    cell_deg: tamanho da célula em graus; se None, escolhe ~8 pontos por célula.
+    Retorna dict com os pontos ordenados por célula e 'pos' = posição original da linha.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    pos = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+    lat, lon = lats[pos], lons[pos]
+    n = len(pos)
+    if n == 0:
+        return {"n": 0}
+
+    lat0, lon0 = float(lat.min()), float(lon.min())
+    if cell_deg is None:
+        area = max((float(lat.max()) - lat0) * (float(lon.max()) - lon0), 1e-6)
+        cell_deg = float(np.clip(math.sqrt(area * 8.0 / n), 0.002, 1.0))
+    ix = np.floor((lon - lon0) / cell_deg).astype(np.int64)
+    iy = np.floor((lat - lat0) / cell_deg).astype(np.int64)
+    nx, ny = int(ix.max()) + 1, int(iy.max()) + 1
+    keys = iy * nx + ix
+    order = np.argsort(keys, kind="stable")
+    return {
+        "n": n, "cell": cell_deg, "lat0": lat0, "lon0": lon0, "nx": nx, "ny": ny,
+        "keys": keys[order], "lat": lat[order], "lon": lon[order], "pos": pos[order],
+    }
+
+def _celulas_do_anel(cx: int, cy: int, r: int, nx: int, ny: int):
+    """Chaves das células na borda do quadrado de raio r (em células) ao redor de (cx, cy)."""
+    if r == 0:
+        xs, ys = np.array([cx]), np.array([cy])
+    else:
+        lado = np.arange(-r, r + 1)
+        meio = lado[1:-1]
+        xs = np.concatenate([cx + lado, cx + lado, np.full(len(meio), cx - r), np.full(len(meio), cx + r)])
+        ys = np.concatenate([np.full(len(lado), cy - r), np.full(len(lado), cy + r), cy + meio, cy + meio])
+    ok = (xs >= 0) & (xs < nx) & (ys >= 0) & (ys < ny)
+    return ys[ok] * nx + xs[ok]
+
+def knn_indice(idx: dict, lat: float, lon: float, k: int):
+    """
+    k vizinhos mais próximos (Haversine) de (lat, lon).
+    Retorna (pos, dist_km) ordenados pela distância; pos são posições das linhas originais.
+    """
+    k = min(int(k), idx.get("n", 0))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    cell, lat0, lon0, nx, ny = idx["cell"], idx["lat0"], idx["lon0"], idx["nx"], idx["ny"]
+    keys = idx["keys"]
+    cx = int(math.floor((lon - lon0) / cell))
+    cy = int(math.floor((lat - lat0) / cell))
+    # origem fora da grade: começa no primeiro anel que a alcança
+    r = max(0, -cx, cx - (nx - 1), -cy, cy - (ny - 1))
+    r_max = max(abs(cx), abs(nx - 1 - cx), abs(cy), abs(ny - 1 - cy))
+    cos_lat = math.cos(math.radians(lat))
+
+    best_i = np.empty(0, dtype=np.int64)
+    best_d = np.empty(0)
+    while True:
+        cells = _celulas_do_anel(cx, cy, r, nx, ny)
+        if len(cells):
+            lo = np.searchsorted(keys, cells, side="left")
+            hi = np.searchsorted(keys, cells, side="right")
+            faixas = [np.arange(a, b) for a, b in zip(lo, hi) if b > a]
+            if faixas:
+                cand = np.concatenate(faixas)
+                d = haversine_km(lat, lon, idx["lat"][cand], idx["lon"][cand])
+                best_i = np.concatenate([best_i, cand])
+                best_d = np.concatenate([best_d, d])
+                if len(best_d) > k:
+                    keep = np.argpartition(best_d, k - 1)[:k]
+                    best_i, best_d = best_i[keep], best_d[keep]
+
+        if r >= r_max:
+            break
+        if len(best_d) >= k:
+            # menor distância possível até um ponto fora do quadrado já varrido:
+            # bordas norte/sul são paralelos, leste/oeste são meridianos
+            m_lat = min(lat - (lat0 + (cy - r) * cell), lat0 + (cy + r + 1) * cell - lat)
+            m_lon = min(lon - (lon0 + (cx - r) * cell), lon0 + (cx + r + 1) * cell - lon)
+            # pelo outro lado de ±180° o ponto pode estar a 360° − Δlon
+            m_lon = min(m_lon, 360.0 - max(abs(lon - lon0), abs(lon0 + nx * cell - lon)))
+            lim_lat = R_TERRA_KM * math.radians(m_lat)
+            lim_lon = R_TERRA_KM * math.asin(min(1.0, cos_lat * math.sin(math.radians(min(m_lon, 90.0)))))
+            if best_d.max() <= min(lim_lat, lim_lon):
+                break
+        r += 1
+
+    ordem = np.argsort(best_d, kind="stable")
+    return idx["pos"][best_i[ordem]], best_d[ordem]
+
+def raio_indice(idx: dict, lat: float, lon: float, raio_km: float):
+    """
+    Todos os pontos a até raio_km (Haversine) de (lat, lon).
+    Só as células do retângulo que envolve o círculo são lidas (uma faixa
+    contígua de `keys` por linha da grade); o retângulo filtra e o Haversine decide.
+    Um retângulo que passa de ±180° é lido também do outro lado da grade.
+    Retorna (pos, dist_km) ordenados pela distância.
+    """
+    vazio = np.empty(0, dtype=np.int64), np.empty(0)
+    if not idx.get("n") or not raio_km or raio_km <= 0:
+        return vazio
+
+    cell, lat0, lon0, nx, ny = idx["cell"], idx["lat0"], idx["lon0"], idx["nx"], idx["ny"]
+    dlat = math.degrees(raio_km / R_TERRA_KM)
+    la0, la1 = lat - dlat, lat + dlat
+    # meridianos se aproximam: a maior largura em longitude é na borda mais longe do equador
+    cos_min = math.cos(math.radians(min(90.0, max(abs(la0), abs(la1)))))
+    dlon = 180.0 if cos_min < 1e-9 else min(180.0, math.degrees(raio_km / (R_TERRA_KM * cos_min)))
+
+    cy0, cy1 = max(0, math.floor((la0 - lat0) / cell)), min(ny - 1, math.floor((la1 - lat0) / cell))
+    if cy0 > cy1:
+        return vazio
+    linhas = np.arange(cy0, cy1 + 1, dtype=np.int64) * nx
+    faixas = []
+    for volta in (-360.0, 0.0, 360.0):
+        lo0, lo1 = lon - dlon + volta, lon + dlon + volta
+        cx0, cx1 = max(0, math.floor((lo0 - lon0) / cell)), min(nx - 1, math.floor((lo1 - lon0) / cell))
+        if cx0 > cx1:
+            continue
+        ini = np.searchsorted(idx["keys"], linhas + cx0, side="left")
+        fim = np.searchsorted(idx["keys"], linhas + cx1, side="right")
+        faixas += [np.arange(a, b) for a, b in zip(ini, fim) if b > a]
+    if not faixas:
+        return vazio
+    cand = np.unique(np.concatenate(faixas))  # com dlon = 180 as voltas se encostam
+
+    la, lo = idx["lat"][cand], idx["lon"][cand]
+    dentro = (la >= la0) & (la <= la1) & (np.abs((lo - lon + 180.0) % 360.0 - 180.0) <= dlon)
+    cand = cand[dentro]
+    d = haversine_km(lat, lon, la[dentro], lo[dentro])
+    perto = d <= raio_km
+    cand, d = cand[perto], d[perto]
+    ordem = np.argsort(d, kind="stable")
+    return idx["pos"][cand[ordem]], d[ordem]
+
+def carregar_indice_espacial(base: BaseSites | None = None):
+    """Índice espacial dos sites, construído uma vez por carga de dados."""
+    return (base or carregar_base()).indice(
+        "espacial", ["lat", "lon"], lambda df: construir_indice_espacial(df["lat"].to_numpy(), df["lon"].to_numpy()))
+
+@instrumentar("nearest_sites")
+def nearest_sites(lat: float, lon: float, k: int = K_SITES_PROXIMOS) -> pd.DataFrame:
+    """
+    Os k sites com coordenadas mais próximos de (lat, lon), em linha reta.
+    Retorna as linhas da base com a coluna 'dist_km_linear', ordenadas pela distância.
+    """
+    base = carregar_base()
+    pos, dist = knn_indice(carregar_indice_espacial(base), lat, lon, k)
+    out = base.df.iloc[pos].copy()
+    out["dist_km_linear"] = dist
+    return out
+
+def nearest_sites_lote(lats, lons, k: int = K_SITES_PROXIMOS, mem_mb: float | None = None,
+                       base: pd.DataFrame | None = None):
+    """
+    k sites mais próximos para várias origens de uma vez (ver haversine_topk).
+    Retorna (pos, dist) com forma (n, k): posições em `base` (padrão: carregar_dados())
+    e distâncias em km; origens sem coordenada (ou base com menos de k sites) ficam com -1/NaN.
+    """
+    if base is None:
+        base = carregar_dados()
+    lat_s, lon_s = base["lat"].to_numpy(dtype=float), base["lon"].to_numpy(dtype=float)
+    validos = np.flatnonzero(np.isfinite(lat_s) & np.isfinite(lon_s))
+    idx, dist = haversine_topk(lats, lons, lat_s[validos], lon_s[validos], k,
+                               MATRIZ_MEM_MB if mem_mb is None else mem_mb)
+    pos = np.where(idx >= 0, validos[np.maximum(idx, 0)] if len(validos) else -1, -1)
+    return pos, dist.astype(float)
+
+# ------------------------------------------------------------
+# Reordenação por tempo de rota (OSRM em blocos, em paralelo)
+# ------------------------------------------------------------
+# Os N candidatos mais próximos em linha reta são divididos em blocos de até
+# OSRM_BLOCO destinos (nunca acima do limite de coordenadas do servidor) e
+# cada bloco vira uma chamada osrm_table disparada em paralelo no _EXECUTOR.
+# Com o padrão (75 candidatos, blocos de 25) são três Table simultâneas.
+OSRM_MAX_COORDS = int(_config("OSRM_MAX_COORDS", 100))  # --max-table-size do servidor (origem + destinos)
+OSRM_BLOCO = min(int(_config("OSRM_BLOCO", 25)), OSRM_MAX_COORDS - 1)   # destinos por requisição Table
+N_CANDIDATOS_ROTA = int(_config("N_CANDIDATOS_ROTA", 75))  # candidatos em linha reta avaliados por rota
+
+@instrumentar("osrm_table_em_blocos")
+def osrm_table_em_blocos(origin_lat: float, origin_lon: float, dests: List[Tuple[float, float]],
+                         bloco: int = OSRM_BLOCO):
+    """
+    Igual a osrm_table, mas divide os destinos em blocos paralelos de até `bloco` destinos.
+    Blocos que falham voltam com campos None, mantendo o alinhamento com `dests`.
+    Retorna (out, dbg) com dbg['status'] = 'Ok' se todos os blocos responderam.
+    """
+    if not dests:
+        return [], {"status": "NO_DESTS", "error_message": None}
+    tam = max(1, min(bloco, OSRM_MAX_COORDS - 1))
+    blocos = [dests[i:i + tam] for i in range(0, len(dests), tam)]
+    futuros = [_EXECUTOR.submit(osrm_table, origin_lat, origin_lon, list(b)) for b in blocos]
+    vazio = {"distance_m": None, "distance_text": None, "duration_s": None, "duration_text": None}
+
+    out, falhas = [], []
+    for bloco, fut in zip(blocos, futuros):
+        res, dbg = _resultado_futuro(fut)
+        if res and len(res) == len(bloco) and dbg.get("status") in ("Ok", "OK", None):
+            out.extend(res)
+        else:
+            out.extend([dict(vazio) for _ in bloco])
+            falhas.append(dbg)
+    if len(falhas) == len(blocos):
+        return out, falhas[0]
+    return out, {"status": "Ok" if not falhas else "PARTIAL", "error_message": None, "blocos": len(blocos)}
+
+@instrumentar("anexar_rotas")
+def anexar_rotas(lat: float, lon: float, sites: pd.DataFrame, bloco: int = OSRM_BLOCO):
+    """Acrescenta dist_rodov_text/duracao_text/duracao_s (OSRM) às linhas de `sites`."""
+    sites = sites.reset_index(drop=True)
+    dm_out, dm_dbg = rotas_para_sites(
+        lat, lon, sites["sigla"].tolist(), list(zip(sites["lat"].astype(float), sites["lon"].astype(float))), bloco
+    )
+    if dm_out and dm_dbg.get("status") in ("Ok", "OK", "PARTIAL", None):
+        sites["dist_rodov_text"] = [x["distance_text"] for x in dm_out]
+        sites["duracao_text"]    = [x["duration_text"] for x in dm_out]
+        sites["duracao_s"]       = [x["duration_s"] for x in dm_out]
+    else:
+        # Mantém a UI estável mesmo se OSRM falhar
+        sites["dist_rodov_text"] = pd.NA
+        sites["duracao_text"]    = pd.NA
+        sites["duracao_s"]       = pd.NA
+    return sites, dm_dbg
+
+@instrumentar("nearest_sites_por_rota")
+def nearest_sites_por_rota(lat: float, lon: float, k: int = K_SITES_PROXIMOS,
+                           n_candidatos: int = N_CANDIDATOS_ROTA):
+    """
+    Avalia os `n_candidatos` mais próximos em linha reta e retorna os k de menor
+    tempo de rota (duracao_s). Sem resposta do OSRM, mantém a ordem linear.
+    Retorna (sites, dbg).
+    """
+    cand, dbg = anexar_rotas(lat, lon, nearest_sites(lat, lon, max(k, n_candidatos)))
+    cand["duracao_s"] = pd.to_numeric(cand["duracao_s"], errors="coerce")
+    cand = cand.sort_values(["duracao_s", "dist_km_linear"], na_position="last", kind="stable")
+    return cand.head(k).reset_index(drop=True), dbg
+
+# ------------------------------------------------------------
+# Cache persistente de rotas (célula geohash da origem × sigla)
+# ------------------------------------------------------------
+# A origem é reduzida à célula geohash de ROTAS_CACHE_PRECISAO caracteres
+# (7 ≈ 150 m × 150 m): dois geocodes do mesmo prédio, ou clientes vizinhos,
+# reaproveitam a distância/tempo já calculados até cada sigla. Os pares ficam
+# na tabela rota do banco de geocodificação (sobrevivem a restart e ao
+# "Atualizar dados"), com TTL e descarte dos menos acessados acima de
+# ROTAS_CACHE_MAX_ITENS (de vez em quando, como no geocode). Só os pares que faltam vão ao OSRM, numa Table
+# reduzida. A coordenada do site é guardada junto: se a planilha mover uma
+# sigla, o par antigo deixa de valer.
+ROTAS_CACHE_PRECISAO = int(_config("ROTAS_CACHE_PRECISAO", 7))  # 0 = sem cache de rotas
+ROTAS_CACHE_TTL_S = float(_config("ROTAS_CACHE_TTL_S", 7 * 24 * 3600))
+ROTAS_CACHE_MAX_ITENS = int(_config("ROTAS_CACHE_MAX_ITENS", 200_000))
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_ROTAS_TOL_GRAUS = 1e-5   # site "no mesmo lugar" (float32 da base ≈ 2e-6 grau)
+_rotacache_pronto = False
+
+def geohash(lat: float, lon: float, precisao: int = ROTAS_CACHE_PRECISAO) -> str:
+    """Geohash padrão (base32) de `precisao` caracteres."""
+    faixa_lat, faixa_lon = [-90.0, 90.0], [-180.0, 180.0]
+    out, bits, n, lon_vez = [], 0, 0, True
+    while len(out) < precisao:
+        faixa, v = (faixa_lon, lon) if lon_vez else (faixa_lat, lat)
+        meio = (faixa[0] + faixa[1]) / 2
+        bits = bits * 2 + (v >= meio)
+        faixa[0 if v >= meio else 1] = meio
+        lon_vez, n = not lon_vez, n + 1
+        if n == 5:
+            out.append(_GEOHASH_BASE32[bits])
+            bits = n = 0
+    return "".join(out)
+
+def _rotacache_conn():
+    global _rotacache_pronto
+    con = _geocache_conn()
+    if not _rotacache_pronto:
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS rota ("
+            " celula TEXT, sigla TEXT, lat REAL, lon REAL, distancia_m REAL, duracao_s REAL,"
+            " expira REAL, acessado REAL, PRIMARY KEY (celula, sigla))"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS rota_acessado ON rota(acessado)")
+        con.execute("CREATE INDEX IF NOT EXISTS rota_expira ON rota(expira)")
+        _rotacache_pronto = True
+    return con
+
+def _rotacache_get(celula: str, siglas: list) -> dict:
+    """{sigla: (lat, lon, distancia_m, duracao_s)} das entradas válidas da célula."""
+    agora = time.time()
+    con = _rotacache_conn()
+    try:
+        achados = {}
+        for i in range(0, len(siglas), 500):
+            parte = siglas[i:i + 500]
+            achados.update((row[0], row[1:]) for row in con.execute(
+                "SELECT sigla, lat, lon, distancia_m, duracao_s FROM rota"
+                f" WHERE celula = ? AND expira > ? AND sigla IN ({','.join('?' * len(parte))})",
+                (celula, agora, *parte),
+            ))
+        if achados:
+            con.execute("BEGIN")  # uma transação só (autocommit faria um commit por linha)
+            con.executemany("UPDATE rota SET acessado = ? WHERE celula = ? AND sigla = ?",
+                            [(agora, celula, s) for s in achados])
+            con.execute("COMMIT")
+        return achados
+    finally:
+        con.close()
+
+def _rotacache_put(celula: str, linhas: list):
+    """linhas: [(sigla, lat, lon, distancia_m, duracao_s), ...]"""
+    agora = time.time()
+    con = _rotacache_conn()
+    try:
+        con.execute("BEGIN")
+        con.executemany(
+            "INSERT OR REPLACE INTO rota (celula, sigla, lat, lon, distancia_m, duracao_s, expira, acessado)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(celula, *linha, agora + ROTAS_CACHE_TTL_S, agora) for linha in linhas],
+        )
+        _podar_lru(con, "rota", ROTAS_CACHE_MAX_ITENS, len(linhas))
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+@instrumentar("rotas_para_sites")
+def rotas_para_sites(origin_lat: float, origin_lon: float, siglas: list, dests: List[Tuple[float, float]],
+                     bloco: int = OSRM_BLOCO):
+    """
+    osrm_table_em_blocos passando pelo cache persistente de rotas: pares (célula da
+    origem, sigla) já conhecidos voltam direto e só os que faltam vão ao OSRM.
+    siglas: uma por destino (vazia/NA = não usa o cache).
+    Retorna (out, dbg) como osrm_table_em_blocos, com dbg['cache_hits'].
+    """
+    if not dests:
+        return [], {"status": "NO_DESTS", "error_message": None, "cache_hits": 0}
+    celula = geohash(origin_lat, origin_lon) if ROTAS_CACHE_PRECISAO > 0 else None
+    chaves = [str(s) if celula and not pd.isna(s) and str(s) else None for s in siglas]
+
+    achados = {}
+    if any(chaves):
+        try:
+            achados = _rotacache_get(celula, sorted({c for c in chaves if c}))
+        except (sqlite3.Error, OSError):
+            pass
+    out = [None] * len(dests)
+    for i, (chave, (lat, lon)) in enumerate(zip(chaves, dests)):
+        item = achados.get(chave)
+        if item and abs(item[0] - lat) < _ROTAS_TOL_GRAUS and abs(item[1] - lon) < _ROTAS_TOL_GRAUS:
+            out[i] = _rota_item(item[2], item[3])
+    faltam = [i for i, o in enumerate(out) if o is None]
+    hits = len(out) - len(faltam)
+    contar("busca_sites_cache_total", hits, cache="rotas", resultado="hit")
+    contar("busca_sites_cache_total", len(faltam), cache="rotas", resultado="miss")
+    if not faltam:
+        return out, {"status": "Ok", "error_message": None, "cache_hits": hits}
+
+    res, dbg = osrm_table_em_blocos(origin_lat, origin_lon, [dests[i] for i in faltam], bloco)
+    novos = []
+    for i, r in zip(faltam, res):
+        out[i] = r
+        # rota inexistente (null) não é guardada: pode ser falha momentânea do servidor
+        if chaves[i] and r["duration_s"] is not None and r["distance_m"] is not None:
+            novos.append((chaves[i], dests[i][0], dests[i][1], r["distance_m"], r["duration_s"]))
+    if novos:
+        try:
+            _rotacache_put(celula, novos)
+        except (sqlite3.Error, OSError):
+            pass
+    if hits and dbg.get("status") not in ("Ok", "OK", None):
+        dbg = {**dbg, "status": "PARTIAL"}
+    return out, {**dbg, "cache_hits": hits}
+
+# ------------------------------------------------------------
+# Consulta por raio / por tempo de rota
+# ------------------------------------------------------------
+# O raio sai do índice espacial (retângulo + Haversine). Com tempo máximo, o
+# raio é encolhido para o que dá para percorrer a RAIO_VEL_MAX_KMH (nenhum site
+# mais longe que isso em linha reta chega a tempo) e só os RAIO_MAX_ROTAS mais
+# próximos vão ao OSRM, em blocos do tamanho máximo aceito pelo servidor.
+RAIO_VEL_MAX_KMH = float(_config("RAIO_VEL_MAX_KMH", 100))
+RAIO_MAX_ROTAS = int(_config("RAIO_MAX_ROTAS", 2000))
+
+@instrumentar("sites_no_raio")
+def sites_no_raio(lat: float, lon: float, raio_km: float, tempo_max_min: float | None = None,
+                  max_rotas: int = RAIO_MAX_ROTAS):
+    """
+    Sites a até raio_km em linha reta de (lat, lon) e, se tempo_max_min for dado,
+    a até tempo_max_min minutos de carro (OSRM).
+    Retorna (sites, dbg): linhas da base com 'dist_km_linear' (e colunas de rota
+    quando há filtro de tempo), ordenadas pela distância ou pelo tempo.
+    dbg: {'status', 'no_raio', 'avaliados', 'sem_rota', 'nao_avaliados'}.
+    """
+    base = carregar_base()
+    if tempo_max_min:
+        raio_km = min(raio_km, RAIO_VEL_MAX_KMH * tempo_max_min / 60.0)
+    pos, dist = raio_indice(carregar_indice_espacial(base), lat, lon, raio_km)
+    sites = base.df.iloc[pos].assign(dist_km_linear=dist)
+    dbg = {"status": "OK", "no_raio": len(sites), "avaliados": 0, "sem_rota": 0, "nao_avaliados": 0}
+    if not tempo_max_min or sites.empty:
+        return sites.reset_index(drop=True), dbg
+
+    dbg["nao_avaliados"] = max(0, len(sites) - max_rotas)
+    sites, dm_dbg = anexar_rotas(lat, lon, sites.head(max_rotas), bloco=OSRM_MAX_COORDS - 1)
+    dur = pd.to_numeric(sites["duracao_s"], errors="coerce")
+    dbg.update(status=dm_dbg.get("status"), avaliados=len(sites), sem_rota=int(dur.isna().sum()))
+    sites = sites.assign(duracao_s=dur)[dur <= tempo_max_min * 60]
+    return sites.sort_values(["duracao_s", "dist_km_linear"], kind="stable").reset_index(drop=True), dbg
+
+# ------------------------------------------------------------
+# Mapa: marcadores agrupados por zoom (pré-calculados na carga)
+# ------------------------------------------------------------
+# Para cada zoom de MAPA_ZOOM_MIN a MAPA_ZOOM_MAX, os sites são agrupados numa
+# grade de MAPA_CELULA_PX pixels (Web Mercator, tiles de 256 px). Só o zoom
+# mais fino parte dos sites; cada zoom acima agrupa as células do anterior
+# (célula // 2), então montar todos os níveis custa pouco mais que um. O mapa
+# recebe só os grupos da área visível (centróide + quantidade), nunca o
+# inventário inteiro; grupos de um só site trazem sigla/nome.
+MAPA_ZOOM_MIN = 4
+MAPA_ZOOM_MAX = 17
+MAPA_CELULA_PX = 64
+MAPA_MAX_MARCADORES = int(_config("MAPA_MAX_MARCADORES", 1500))
+
+def _pixels_mercator(lats, lons, zoom: float):
+    """Coordenadas em pixels (x, y) do mundo Web Mercator no zoom dado."""
+    escala = 256.0 * 2.0 ** zoom
+    s = np.sin(np.radians(np.clip(lats, -85.05, 85.05)))
+    x = (np.asarray(lons) + 180.0) / 360.0 * escala
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)) * escala
+    return x, y
+
+def construir_clusters(lats, lons, zoom_min: int = MAPA_ZOOM_MIN, zoom_max: int = MAPA_ZOOM_MAX) -> dict:
+    """
+    {zoom: {'lat', 'lon', 'n', 'pos'}}: centróide e quantidade de sites de cada célula
+    ocupada; 'pos' = posição (na base) de um site da célula. Linhas sem coordenada são ignoradas.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    pos = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+    soma_lat, soma_lon, n = lats[pos], lons[pos], np.ones(len(pos), dtype=np.int64)
+    x, y = _pixels_mercator(soma_lat, soma_lon, zoom_max)
+    cx, cy = (x // MAPA_CELULA_PX).astype(np.int64), (y // MAPA_CELULA_PX).astype(np.int64)
+    niveis = {}
+    for z in range(zoom_max, zoom_min - 1, -1):
+        _, primeiro, inv = np.unique((cx << 32) | cy, return_index=True, return_inverse=True)
+        n = np.bincount(inv, weights=n).astype(np.int64)
+        soma_lat = np.bincount(inv, weights=soma_lat)
+        soma_lon = np.bincount(inv, weights=soma_lon)
+        pos, cx, cy = pos[primeiro], cx[primeiro] >> 1, cy[primeiro] >> 1
+        niveis[z] = {"lat": (soma_lat / n).astype(np.float32), "lon": (soma_lon / n).astype(np.float32),
+                     "n": n.astype(np.int32), "pos": pos}
+    return niveis
+
+def carregar_clusters(base: BaseSites | None = None) -> dict:
+    """Grupos de marcadores por zoom, construídos uma vez por carga de dados."""
+    return (base or carregar_base()).indice(
+        "clusters", ["lat", "lon"], lambda df: construir_clusters(df["lat"].to_numpy(), df["lon"].to_numpy()))
+
+def zoom_para_caixa(lat_min: float, lon_min: float, lat_max: float, lon_max: float,
+                    largura_px: int = 900, altura_px: int = 500) -> int:
+    """Maior zoom em que a caixa cabe num mapa de largura_px × altura_px."""
+    for z in range(MAPA_ZOOM_MAX, MAPA_ZOOM_MIN - 1, -1):
+        x, y = _pixels_mercator(np.array([lat_min, lat_max]), np.array([lon_min, lon_max]), z)
+        if abs(x[1] - x[0]) <= largura_px * 0.9 and abs(y[1] - y[0]) <= altura_px * 0.9:
+            return z
+    return MAPA_ZOOM_MIN
+
+def caixa_visivel(lat: float, lon: float, zoom: int, largura_px: int = 900, altura_px: int = 500) -> tuple:
+    """(lat_min, lon_min, lat_max, lon_max) visível num mapa centrado em (lat, lon)."""
+    escala = 256.0 * 2.0 ** zoom
+    x, y = _pixels_mercator(np.array([lat]), np.array([lon]), zoom)
+    ys = np.array([y[0] + altura_px / 2, y[0] - altura_px / 2]) / escala
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * ys))))
+    meia_lon = largura_px / 2 / escala * 360.0
+    return float(lats[0]), lon - meia_lon, float(lats[1]), lon + meia_lon
+
+@instrumentar("clusters_mapa")
+def clusters_mapa(zoom: int, caixa: tuple | None = None, limite: int = MAPA_MAX_MARCADORES) -> pd.DataFrame:
+    """
+    Marcadores do mapa no zoom dado (limitado a MAPA_ZOOM_MIN..MAPA_ZOOM_MAX), dentro de
+    caixa=(lat_min, lon_min, lat_max, lon_max): colunas lat, lon, n e, nos grupos de um
+    só site, sigla/nome. Acima de `limite` grupos, ficam os mais populosos.
+    """
+    base = carregar_base()
+    nivel = carregar_clusters(base).get(int(min(max(zoom, MAPA_ZOOM_MIN), MAPA_ZOOM_MAX)))
+    if not nivel or not len(nivel["n"]):
+        return pd.DataFrame(columns=["lat", "lon", "n", "sigla", "nome"])
+    sel = np.arange(len(nivel["n"]))
+    if caixa is not None:
+        lat_min, lon_min, lat_max, lon_max = caixa
+        sel = np.flatnonzero((nivel["lat"] >= lat_min) & (nivel["lat"] <= lat_max)
+                             & (nivel["lon"] >= lon_min) & (nivel["lon"] <= lon_max))
+    if len(sel) > limite:
+        sel = np.sort(sel[np.argsort(-nivel["n"][sel], kind="stable")[:limite]])
+    n = nivel["n"][sel]
+    pos = nivel["pos"][sel]
+    um = n == 1
+    return pd.DataFrame({
+        "lat": nivel["lat"][sel], "lon": nivel["lon"][sel], "n": n,
+        "sigla": np.where(um, base.df["sigla"].to_numpy(dtype=object)[pos], None),
+        "nome": np.where(um, base.df["nome"].to_numpy(dtype=object)[pos], None),
+    })
+
+# ------------------------------------------------------------
+# Consultas em lote (serviço HTTP e app)
+# ------------------------------------------------------------
+# Cada consulta é {"id"?, "lat", "lon"} ou {"id"?, "endereco"}. Endereços são
+# geocodificados em paralelo (sem hedge: em lote vale mais a vazão), o k-NN
+# de todas as coordenadas sai de uma vez (nearest_sites_lote) e as rotas,
+# quando pedidas, são consultadas em paralelo por origem. O resultado é
+# JSON puro, o mesmo devolvido pelo servico.py.
+LOTE_WORKERS = int(_config("LOTE_WORKERS", 8))
+SERVICO_URL = str(_config("SERVICO_URL", "")).rstrip("/")  # app como cliente do servico.py
+SERVICO_WORKERS = int(_config("SERVICO_WORKERS", os.cpu_count() or 1))
+SERVICO_MAX_CONSULTAS = int(_config("SERVICO_MAX_CONSULTAS", 1000))
+
+def _json_valor(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if v is None or v is pd.NA or (isinstance(v, float) and math.isnan(v)):
+        return None
+    return v
+
+def sites_json(df: pd.DataFrame) -> list:
+    """Linhas de sites como dicts prontos para JSON (NA/NaN viram None)."""
+    # float32 arredondado à precisão que ele tem (-22.910486, não -22.910486068725586)
+    df = df.assign(**{c: df[c].astype(float).round(6) for c in df.columns if df[c].dtype == np.float32})
+    colunas = list(df.columns)
+    return [{c: _json_valor(v) for c, v in zip(colunas, linha)}
+            for linha in df.itertuples(index=False, name=None)]
+
+def _geo_json(geo: dict | None, dbg: dict) -> dict | None:
+    if not geo:
+        return None
+    return {"lat": geo["lat"], "lon": geo["lon"], "formatted": geo.get("formatted"),
+            "provedor": dbg.get("provider"), "confianca": dbg.get("confianca")}
+
+def _coordenada(c: dict):
+    try:
+        lat, lon = float(c["lat"]), float(c["lon"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon)) or abs(lat) > 90 or abs(lon) > 180:
+        return None
+    return lat, lon
+
+@instrumentar("proximos_lote")
+def proximos_lote(consultas: list, k: int = K_SITES_PROXIMOS, rotas: bool = False, por_rota: bool = False,
+                  tecnicos: bool = False, n_candidatos: int = N_CANDIDATOS_ROTA) -> list:
+    """
+    Sites mais próximos para cada consulta ({"lat", "lon"} ou {"endereco"}, com "id" opcional).
+    rotas=True acrescenta distância/tempo OSRM; por_rota=True reordena pelo tempo de rota
+    (avaliando n_candidatos candidatos). tecnicos=True inclui os técnicos de cada sigla.
+    Retorna, na ordem das consultas: {'id', 'status', 'geo', 'sites', 'rotas'}.
+    """
+    base = carregar_dados()  # uma referência para o k-NN e para as linhas (ver BaseSites)
+    n = len(consultas)
+    geos = [None] * n
+    status = ["OK"] * n
+    with ThreadPoolExecutor(max_workers=max(1, min(LOTE_WORKERS, n)), thread_name_prefix="lote") as pool:
+        pendentes = {}
+        for i, c in enumerate(consultas):
+            coord = _coordenada(c)
+            if coord is not None:
+                geos[i] = {"lat": coord[0], "lon": coord[1], "formatted": None, "provedor": None, "confianca": None}
+            elif isinstance(c.get("endereco"), str) and c["endereco"].strip():
+                # consulta única (tela do app) mantém o hedge entre provedores
+                pendentes[i] = pool.submit(geocode_address, c["endereco"], concorrente=None if n == 1 else False)
+            else:
+                status[i] = "CONSULTA_INVALIDA"
+        for i, fut in pendentes.items():
+            geo, dbg = _resultado_futuro(fut)
+            geos[i] = _geo_json(geo, dbg)
+            if not geo:
+                status[i] = dbg.get("status") or "ZERO_RESULTS"
+
+        validos = [i for i in range(n) if geos[i]]
+        sites = [[] for _ in range(n)]
+        dbg_rotas = [None] * n
+        if por_rota:
+            futuros = {i: pool.submit(nearest_sites_por_rota, geos[i]["lat"], geos[i]["lon"], k, n_candidatos)
+                       for i in validos}
+            for i, fut in futuros.items():
+                df, dbg_rotas[i] = fut.result()
+                sites[i] = sites_json(df)
+        elif validos:
+            pos, dist = nearest_sites_lote([geos[i]["lat"] for i in validos], [geos[i]["lon"] for i in validos], k,
+                                           base=base)
+            ok = pos >= 0
+            # todas as linhas de uma vez (um iloc e uma conversão), depois fatiadas por consulta
+            todas = base.iloc[pos[ok]].assign(dist_km_linear=dist[ok])
+            if rotas:
+                fim = np.cumsum(ok.sum(axis=1))
+                futuros = {i: pool.submit(anexar_rotas, geos[i]["lat"], geos[i]["lon"], todas.iloc[f - c:f])
+                           for i, f, c in zip(validos, fim, ok.sum(axis=1)) if c}
+                for i, fut in futuros.items():
+                    df, dbg_rotas[i] = fut.result()
+                    sites[i] = sites_json(df)
+            else:
+                linhas = iter(sites_json(todas))
+                for i, c in zip(validos, ok.sum(axis=1)):
+                    sites[i] = [next(linhas) for _ in range(c)]
+
+    saida = []
+    for i, c in enumerate(consultas):
+        lista = sites[i]
+        if tecnicos:
+            for s in lista:
+                s["tecnicos"] = list(tecnicos_por_sigla(s.get("sigla")))
+        saida.append({"id": c.get("id", i), "status": status[i], "geo": geos[i], "sites": lista,
+                      "rotas": dbg_rotas[i].get("status") if dbg_rotas[i] else None})
+    return saida
+
+# Clientes do servico.py (app com SERVICO_URL): mesmas respostas das funções
+# locais, com as linhas de sites de volta em DataFrame.
+def _servico(metodo: str, rota: str, url: str | None = None, **kwargs) -> dict:
+    r = requests.request(metodo, f"{url or SERVICO_URL}{rota}", timeout=(3.05, 60), **kwargs)
+    r.raise_for_status()
+    return r.json()
+
+def proximos_via_servico(consultas: list, k: int = K_SITES_PROXIMOS, rotas: bool = False,
+                         por_rota: bool = False, tecnicos: bool = False, n_candidatos: int = N_CANDIDATOS_ROTA,
+                         url: str | None = None) -> list:
+    """Mesma resposta de proximos_lote, consultando o servico.py em SERVICO_URL."""
+    return _servico("POST", "/v1/proximos", url, json={
+        "consultas": consultas, "k": k, "rotas": rotas, "por_rota": por_rota, "tecnicos": tecnicos,
+        "n_candidatos": n_candidatos,
+    })["resultados"]
+
+def buscar_siglas_via_servico(siglas, url: str | None = None) -> tuple[pd.DataFrame, list[str]]:
+    """Como buscar_siglas (mais a coluna 'tecnicos' de cada sigla), consultando o servico.py."""
+    resp = _servico("POST", "/v1/siglas", url, json={"siglas": [str(s) for s in siglas]})
+    return pd.DataFrame(resp["sites"]), resp["faltando"]
+
+def buscar_sites_texto_via_servico(consulta: str, limite: int = BUSCA_LIMITE, url: str | None = None) -> pd.DataFrame:
+    """Como buscar_sites_texto, consultando o servico.py."""
+    return pd.DataFrame(_servico("GET", "/v1/busca", url, params={"q": consulta, "limite": limite})["sites"])
+
+def sites_no_raio_via_servico(lat: float, lon: float, raio_km: float, tempo_max_min: float | None = None,
+                              url: str | None = None):
+    """Como sites_no_raio, consultando o servico.py."""
+    resp = _servico("POST", "/v1/raio", url, json={"lat": lat, "lon": lon, "raio_km": raio_km,
+                                                   "tempo_max_min": tempo_max_min})
+    return pd.DataFrame(resp["sites"]), resp["dbg"]
+
+def clusters_mapa_via_servico(zoom: int, caixa: tuple | None = None, limite: int = MAPA_MAX_MARCADORES,
+                              url: str | None = None) -> pd.DataFrame:
+    """Como clusters_mapa, consultando o servico.py."""
+    params = {"zoom": zoom, "limite": limite}
+    if caixa is not None:
+        params["caixa"] = ",".join(f"{float(v):.6f}" for v in caixa)
+    return pd.DataFrame(_servico("GET", "/v1/mapa", url, params=params)["grupos"])
+
+# ------------------------------------------------------------
+# Matriz muitos-para-muitos (N clientes × M sites)
+# ------------------------------------------------------------
+# Haversine em float32, em blocos de origens × destinos dimensionados por
+# MATRIZ_MEM_MB: cada bloco só guarda o top-k parcial de cada origem, então a
+# matriz N×M nunca existe inteira na memória. A ordenação usa o termo 'a' da
+# fórmula (monótono na distância) e só os k escolhidos viram km.
+# No OSRM, a matriz é dividida em ladrilhos fontes × destinos que cabem em
+# OSRM_MAX_COORDS, pedidos em paralelo e costurados numa matriz N×M.
+MATRIZ_MEM_MB = 64
+
+def _haversine_a_f32(p1, l1, c1, p2, l2, c2):
+    """Termo 'a' da Haversine (radianos; c = cos(lat) pré-calculado), com só dois temporários."""
+    a = np.subtract(p2, p1)
+    a *= np.float32(0.5)
+    np.sin(a, out=a)
+    a *= a
+    b = np.subtract(l2, l1)
+    b *= np.float32(0.5)
+    np.sin(b, out=b)
+    b *= b
+    b *= c1
+    b *= c2
+    a += b
+    return a
+
+def haversine_topk(lat_o, lon_o, lat_d, lon_d, k: int, mem_mb: float = MATRIZ_MEM_MB):
+    """
+    Para cada origem, os k destinos mais próximos.
+    Retorna (idx, dist_km) com forma (N, k): idx são posições em lat_d/lon_d
+    (-1 quando não há destino) e dist_km em float32 (NaN correspondente).
+    """
+    lat_o = np.asarray(lat_o, dtype=float)
+    lon_o = np.asarray(lon_o, dtype=float)
+    lat_d = np.asarray(lat_d, dtype=float)
+    lon_d = np.asarray(lon_d, dtype=float)
+    n = len(lat_o)
+    dest_ok = np.flatnonzero(np.isfinite(lat_d) & np.isfinite(lon_d))
+    orig_ok = np.flatnonzero(np.isfinite(lat_o) & np.isfinite(lon_o))
+    m, k = len(dest_ok), int(k)
+    out_i = np.full((n, max(k, 0)), -1, dtype=np.int64)
+    out_d = np.full((n, max(k, 0)), np.nan, dtype=np.float32)
+    kk = min(k, m)
+    if kk <= 0 or not len(orig_ok):
+        return out_i, out_d
+
+    f32 = np.float32
+    po = np.radians(lat_o[orig_ok]).astype(f32)
+    lo = np.radians(lon_o[orig_ok]).astype(f32)
+    pd_ = np.radians(lat_d[dest_ok]).astype(f32)
+    ld = np.radians(lon_d[dest_ok]).astype(f32)
+    co, cd = np.cos(po), np.cos(pd_)
+
+    # 'a', o temporário da longitude e a concatenação com o top-k: ~3 float32 por célula
+    celulas = max(1, int(mem_mb * 2**20) // 12)
+    ncols = min(m, max(kk, celulas))
+    nlin = max(1, celulas // ncols)
+
+    for r0 in range(0, len(orig_ok), nlin):
+        r = slice(r0, r0 + nlin)
+        best_a = best_i = None
+        for c0 in range(0, m, ncols):
+            c = slice(c0, c0 + ncols)
+            a = _haversine_a_f32(po[r, None], lo[r, None], co[r, None], pd_[None, c], ld[None, c], cd[None, c])
+            kprev = 0
+            if best_a is not None:
+                kprev = best_a.shape[1]
+                a = np.concatenate([best_a, a], axis=1)
+            ksel = min(kk, a.shape[1])
+            part = np.argpartition(a, ksel - 1, axis=1)[:, :ksel]
+            novo_i = c0 + part - kprev
+            if best_i is not None:
+                novo_i = np.where(part < kprev, np.take_along_axis(best_i, np.minimum(part, kprev - 1), axis=1), novo_i)
+            best_a = np.take_along_axis(a, part, axis=1)
+            best_i = novo_i
+        ordem = np.argsort(best_a, axis=1)
+        linhas = orig_ok[r]
+        out_i[linhas, :kk] = dest_ok[np.take_along_axis(best_i, ordem, axis=1)]
+        a_ord = np.take_along_axis(best_a, ordem, axis=1)
+        out_d[linhas, :kk] = f32(2 * R_TERRA_KM) * np.arcsin(np.sqrt(np.minimum(a_ord, f32(1))))
+    return out_i, out_d
+
+@cache_ttl(15*60, guardar=lambda ret: ret[0] is not None)
+@instrumentar("osrm_matriz", externo=True)
+def _osrm_ladrilho(origens: Tuple[Tuple[float, float], ...], destinos: Tuple[Tuple[float, float], ...]):
+    """Uma requisição Table com `origens` como sources e `destinos` como destinations."""
+    dbg = {"status": None, "error_message": None}
+    if not provedor_disponivel("osrm"):
+        dbg["status"] = "CIRCUIT_OPEN"
+        return None, None, dbg
+    coords = ";".join(f"{lon},{lat}" for (lat, lon) in origens + destinos)
+    params = {
+        "annotations": "duration,distance",
+        "sources": ";".join(str(i) for i in range(len(origens))),
+        "destinations": ";".join(str(len(origens) + j) for j in range(len(destinos))),
+    }
+    try:
+        r = http_get("osrm", f"{OSRM_URL}/table/v1/driving/{coords}", params=params)
+        dbg["retries"] = _retries_da_resposta(r)
+        r.raise_for_status()
+        data = r.json()
+        dbg["status"] = data.get("code", "OK")
+        if data.get("code") != "Ok":
+            dbg["error_message"] = data.get("message")
+            return None, None, dbg
+        return data.get("durations"), data.get("distances"), dbg
+    except requests.exceptions.Timeout:
+        dbg["status"] = "TIMEOUT"
+        return None, None, dbg
+    except Exception as e:
+        dbg["status"] = "EXCEPTION"
+        dbg["error_message"] = str(e)
+        return None, None, dbg
+
+def osrm_matriz(origens: List[Tuple[float, float]], destinos: List[Tuple[float, float]],
+                fontes_por_ladrilho: int | None = None):
+    """
+    Matriz de rotas N origens × M destinos ([(lat, lon), ...]) via vários Table em paralelo.
+    Retorna (dur_s, dist_m, dbg): arrays float (N, M) com NaN onde não houve resposta;
+    dbg['status'] = 'Ok' | 'PARTIAL' | status do primeiro ladrilho com falha.
+    """
+    n, m = len(origens), len(destinos)
+    dur = np.full((n, m), np.nan)
+    dist = np.full((n, m), np.nan)
+    if not n or not m:
+        return dur, dist, {"status": "NO_DESTS", "error_message": None}
+
+    s = fontes_por_ladrilho or max(1, OSRM_MAX_COORDS // 2)
+    s = max(1, min(s, OSRM_MAX_COORDS - 1, n))
+    d = max(1, OSRM_MAX_COORDS - s)
+    ladrilhos = [(i, j) for i in range(0, n, s) for j in range(0, m, d)]
+    futuros = [
+        _EXECUTOR.submit(_osrm_ladrilho, tuple(map(tuple, origens[i:i + s])), tuple(map(tuple, destinos[j:j + d])))
+        for i, j in ladrilhos
+    ]
+
+    falhas = []
+    for (i, j), fut in zip(ladrilhos, futuros):
+        try:
+            t_dur, t_dist, t_dbg = fut.result()
+        except Exception as e:
+            t_dur, t_dist, t_dbg = None, None, {"status": "EXCEPTION", "error_message": str(e)}
+        if not t_dur:
+            falhas.append(t_dbg)
+            continue
+        bloco_dur = np.array(t_dur, dtype=float)      # None -> nan
+        dur[i:i + bloco_dur.shape[0], j:j + bloco_dur.shape[1]] = bloco_dur
+        if t_dist:
+            bloco_dist = np.array(t_dist, dtype=float)
+            dist[i:i + bloco_dist.shape[0], j:j + bloco_dist.shape[1]] = bloco_dist
+
+    if len(falhas) == len(ladrilhos):
+        return dur, dist, {**falhas[0], "ladrilhos": len(ladrilhos)}
+    status = "Ok" if not falhas else "PARTIAL"
+    return dur, dist, {"status": status, "error_message": None, "ladrilhos": len(ladrilhos), "falhas": len(falhas)}
+
+def _invalidar_base():
+    """Descarta a base de sites e tudo que é derivado dela (recarregados na próxima chamada)."""
+    # índices vivem dentro do BaseSites; consultas em andamento seguem com o antigo
+    carregar_base.cache_clear()
+
+def limpar_caches():
+    """Descarta a base carregada, os índices e os caches em memória (os caches em disco de geocodificação e de rotas são mantidos)."""
+    _invalidar_base()
+    carregar_acessos_ok.cache_clear()
+    carregar_tecnicos_por_sigla.cache_clear()
+    with _DERIVADOS_LOCK:
+        _DERIVADOS.clear()
+    _TECNICOS.update(pares=None, mapa={})
+    _ABAS_CARREGADAS.clear()
+    for fn in _CACHES_TTL:
+        fn.cache_clear()
+
+# ------------------------------------------------------------
+# Recarga incremental da planilha
+# ------------------------------------------------------------
+# Sem mudança de mtime/tamanho do xlsx não faz nada. Senão compara a
+# assinatura de cada aba com a da carga em memória e relê só as abas que
+# mudaram (o sidecar das outras continua válido). Índices derivados são
+# reaproveitados quando as colunas de que dependem não mudaram (_derivado) e o
+# mapa de técnicos é reagrupado só nas siglas alteradas. Os caches de APIs
+# externas (geocodificação, OSRM) são mantidos, evitando a avalanche de
+# chamadas lentas logo depois de cada atualização da planilha.
+_RECARGA_LOCK = threading.Lock()
+_recarga_marca = {"arquivo": None}
+
+def _diff_por_sigla(antigo, novo) -> dict:
+    """Contagem de siglas novas, removidas e com alguma linha alterada."""
+    def por_sigla(df):
+        if df is None or df.empty:
+            return pd.Series(dtype="uint64")
+        linhas = pd.util.hash_pandas_object(df, index=False)
+        return linhas.groupby(df["sigla"].astype("string").str.upper().to_numpy()).sum()
+    a, b = por_sigla(antigo), por_sigla(novo)
+    comuns = a.index.intersection(b.index)
+    return {
+        "novas": int(len(b.index.difference(a.index))),
+        "removidas": int(len(a.index.difference(b.index))),
+        "alteradas": int((a[comuns] != b[comuns]).sum()),
+    }
+
+def _invalidar_acessos():
+    carregar_acessos_ok.cache_clear()
+    carregar_tecnicos_por_sigla.cache_clear()
+
+@instrumentar("recarregar_dados")
+def recarregar_dados(forcar: bool = False) -> dict:
+    """
+    Relê só as abas da PLANILHA que mudaram desde a carga em memória.
+    Retorna {aba: {'novas', 'removidas', 'alteradas'}} das abas relidas ({} se nada mudou).
+    forcar=True compara as assinaturas mesmo sem mudança de mtime/tamanho do arquivo.
+    """
+    abas = {"enderecos": (carregar_dados, _invalidar_base), "acessos": (carregar_acessos_ok, _invalidar_acessos)}
+    with _RECARGA_LOCK:
+        st = os.stat(PLANILHA)
+        marca = (st.st_mtime_ns, st.st_size)
+        if not forcar and marca == _recarga_marca["arquivo"]:
+            return {}
+        _recarga_marca["arquivo"] = marca
+
+        resumo = {}
+        for aba, (carregar, invalidar) in abas.items():
+            carregada = _ABAS_CARREGADAS.get(aba)
+            # ainda não carregada (será lida já atualizada) ou sem mudança
+            if carregada is None or _assinatura_aba(aba) == carregada:
+                continue
+            antigo = carregar()
+            invalidar()
+            resumo[aba] = _diff_por_sigla(antigo, carregar())
+        return resumo
+
@@ -0,0 +1,207 @@
+# ============================================================
+# 🧪 Servidor falso de OSRM/Nominatim/Geoapify (testes e carga offline)
+# - OSRM Table:   GET /table/v1/driving/{lon,lat;lon,lat...}?sources=&destinations=
+# - Nominatim:    GET /search?q=...&format=json[&viewbox=...&bounded=1]
+# - Geoapify:     GET /v1/geocode/search?text=...
+# - Respostas determinísticas (mesma entrada -> mesma saída)
+# - Latência e taxa de erro (503) injetáveis
+#
+# Uso:
+#   python fake_osm_server.py --port 8765 --latencia-ms 80 --jitter-ms 40 --taxa-erro 0.02
+#   OSRM_URL=http://127.0.0.1:8765 NOMINATIM_URL=http://127.0.0.1:8765 \
+#   GEOAPIFY_URL=http://127.0.0.1:8765 streamlit run app.py
+# ============================================================
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+R_TERRA_KM = 6371.0088
+FATOR_DESVIO = 1.3          # distância por rua ≈ 1,3 × linha reta
+VELOCIDADE_KMH = 30.0       # velocidade média urbana
+RJ_BBOX = (-44.9, -23.4, -40.9, -20.7)  # (lon_min, lat_min, lon_max, lat_max) do estado
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * R_TERRA_KM * 1000 * math.asin(math.sqrt(a))
+
+def _ponto_do_texto(texto: str, bbox):
+    """Coordenada determinística dentro de bbox a partir do hash do texto."""
+    h = hashlib.sha1(texto.strip().lower().encode("utf-8")).digest()
+    fx = int.from_bytes(h[:4], "big") / 2**32
+    fy = int.from_bytes(h[4:8], "big") / 2**32
+    fz = int.from_bytes(h[8:12], "big") / 2**32
+    lon = bbox[0] + fx * (bbox[2] - bbox[0])
+    lat = bbox[1] + fy * (bbox[3] - bbox[1])
+    return lat, lon, fz
+
+def _indices(valor, n):
+    if not valor or valor == "all":
+        return list(range(n))
+    return [int(i) for i in valor.split(";")]
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOSM/1.0"
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def _responder(self, status: int, corpo, headers=None):
+        b = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(b)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(b)
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.requisicoes += 1
+            atraso = srv.latencia_ms + srv.rng.uniform(0, srv.jitter_ms)
+            falha = srv.rng.random() < srv.taxa_erro
+        if atraso > 0:
+            time.sleep(atraso / 1000.0)
+        if falha:
+            return self._responder(503, {"code": "ServiceUnavailable"}, {"Retry-After": "1"})
+
+        u = urlsplit(self.path)  # urlsplit: ';' das coordenadas não vira "params"
+        q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+        if u.path.startswith("/table/v1/"):
+            return self._table(u.path.rsplit("/", 1)[-1], q)
+        if u.path == "/search":
+            return self._search(q)
+        if u.path == "/v1/geocode/search":
+            return self._geoapify(q)
+        if u.path in ("/", "/status"):
+            return self._responder(200, {"status": "ok", "requisicoes": srv.requisicoes})
+        return self._responder(404, {"code": "NotFound"})
+
+    # ---------------- OSRM Table ----------------
+    def _table(self, coords: str, q: dict):
+        try:
+            pts = [tuple(map(float, p.split(","))) for p in coords.split(";")]  # (lon, lat)
+            srcs = _indices(q.get("sources"), len(pts))
+            dsts = _indices(q.get("destinations"), len(pts))
+        except ValueError:
+            return self._responder(400, {"code": "InvalidQuery", "message": "Query string malformed"})
+        if len(pts) > self.server.max_table_size:
+            return self._responder(400, {"code": "TooBig", "message": "Too many table coordinates"})
+
+        distances, durations = [], []
+        for i in srcs:
+            lon1, lat1 = pts[i]
+            linha_d, linha_t = [], []
+            for j in dsts:
+                lon2, lat2 = pts[j]
+                d = _haversine_m(lat1, lon1, lat2, lon2) * FATOR_DESVIO
+                linha_d.append(round(d, 1))
+                linha_t.append(round(d / (VELOCIDADE_KMH / 3.6), 1))
+            distances.append(linha_d)
+            durations.append(linha_t)
+
+        corpo = {"code": "Ok"}
+        anot = q.get("annotations", "duration")
+        if "duration" in anot:
+            corpo["durations"] = durations
+        if "distance" in anot:
+            corpo["distances"] = distances
+        return self._responder(200, corpo)
+
+    # ---------------- Geocoding ----------------
+    def _geocode(self, texto: str, bbox):
+        """(lat, lon) ou None; textos com 'inexistente' nunca são encontrados."""
+        if not texto or "inexistente" in texto.lower():
+            return None
+        lat, lon, sorteio = _ponto_do_texto(texto, bbox)
+        if sorteio < self.server.taxa_zero:
+            return None
+        return lat, lon
+
+    def _search(self, q: dict):
+        bbox = RJ_BBOX
+        if q.get("viewbox") and q.get("bounded") == "1":
+            bbox = tuple(float(x) for x in q["viewbox"].split(","))
+        achado = self._geocode(q.get("q", ""), bbox)
+        if achado is None:
+            return self._responder(200, [])
+        lat, lon = achado
+        return self._responder(200, [{
+            "lat": f"{lat:.7f}", "lon": f"{lon:.7f}",
+            "display_name": f"{q.get('q', '')} (fake)",
+        }])
+
+    def _geoapify(self, q: dict):
+        achado = self._geocode(q.get("text", ""), RJ_BBOX)
+        if achado is None:
+            return self._responder(200, {"type": "FeatureCollection", "features": []})
+        lat, lon = achado
+        return self._responder(200, {"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "properties": {"lat": lat, "lon": lon, "formatted": f"{q.get('text', '')} (fake)"},
+        }]})
+
+def criar_servidor(host: str = "127.0.0.1", port: int = 0, latencia_ms: float = 0.0,
+                   jitter_ms: float = 0.0, taxa_erro: float = 0.0, taxa_zero: float = 0.0,
+                   max_table_size: int = 100, seed: int = 0, verbose: bool = False):
+    """
+    Cria o servidor (port=0 escolhe uma porta livre; ver srv.server_port).
+    Para rodar em segundo plano: iniciar_em_thread(srv).
+    """
+    srv = ThreadingHTTPServer((host, port), FakeHandler)
+    srv.daemon_threads = True
+    srv.latencia_ms = float(latencia_ms)
+    srv.jitter_ms = float(jitter_ms)
+    srv.taxa_erro = float(taxa_erro)
+    srv.taxa_zero = float(taxa_zero)
+    srv.max_table_size = int(max_table_size)
+    srv.rng = random.Random(seed)
+    srv.lock = threading.Lock()
+    srv.requisicoes = 0
+    srv.verbose = verbose
+    return srv
+
+def iniciar_em_thread(srv) -> str:
+    """Serve em uma thread daemon e retorna a URL base."""
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    host, port = srv.server_address[:2]
+    return f"http://{host}:{port}"
+
+def main():
+    ap = argparse.ArgumentParser(description="Servidor falso de OSRM Table / Nominatim / Geoapify")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    # mesmos nomes do benchmark.py; --max-table-size é o do próprio osrm-routed
+    ap.add_argument("--latencia-ms", type=float, default=0.0, help="latência fixa por requisição")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="latência extra aleatória (0..jitter)")
+    ap.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 503")
+    ap.add_argument("--taxa-zero", type=float, default=0.0, help="fração de endereços sem resultado")
+    ap.add_argument("--max-table-size", type=int, default=100, help="coordenadas por requisição Table (como no OSRM)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+
+    srv = criar_servidor(args.host, args.port, args.latencia_ms, args.jitter_ms, args.taxa_erro,
+                         args.taxa_zero, args.max_table_size, args.seed, args.verbose)
+    print(f"Fake OSM em http://{args.host}:{srv.server_port} (Ctrl+C para sair)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+if __name__ == "__main__":
+    main()
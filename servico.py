@@ -0,0 +1,292 @@
+# ============================================================
+# 🌐 Serviço HTTP/JSON dos sites mais próximos (sem Streamlit)
+# - Mesmo núcleo do app (engine.py): base, índices, geocoding, OSRM, técnicos
+# - Consultas em lote: várias coordenadas/endereços por requisição
+# - Vários workers (processos) aceitando na mesma porta; a base e os índices
+#   são carregados antes do fork (páginas compartilhadas entre os workers)
+# - Planilha alterada em disco: cada worker relê só as abas que mudaram
+#
+# Endpoints:
+#   POST /v1/proximos  {"consultas": [{"id": 1, "endereco": "..."}, {"lat": .., "lon": ..}],
+#                       "k": 3, "rotas": false, "por_rota": false, "tecnicos": false,
+#                       "n_candidatos": 75}                  (candidatos avaliados com por_rota)
+#   POST /v1/siglas    {"siglas": ["SB1", "SB2"]}            (ou GET /v1/siglas?siglas=SB1,SB2)
+#   POST /v1/raio      {"lat": .., "lon": .., "raio_km": 5, "tempo_max_min": 15}
+#   GET  /v1/busca?q=sambodromo&limite=20
+#   GET  /v1/mapa?zoom=12&caixa=lat_min,lon_min,lat_max,lon_max   (sites agrupados por zoom)
+#   GET  /saude, /metrics (Prometheus, por worker), /metrics.json
+#
+# Uso:
+#   python servico.py --port 8080 --workers 4
+#   SERVICO_URL=http://127.0.0.1:8080 streamlit run app.py
+# ============================================================
+
+import argparse
+import json
+import math
+import os
+import signal
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from engine import (
+    K_SITES_PROXIMOS, N_CANDIDATOS_ROTA, BUSCA_LIMITE, SERVICO_WORKERS, SERVICO_MAX_CONSULTAS, MAPA_ZOOM_MIN, MAPA_ZOOM_MAX,
+    MAPA_MAX_MARCADORES, carregar_dados, carregar_indice_espacial, carregar_indice_sigla, carregar_indice_texto,
+    carregar_clusters, clusters_mapa, carregar_gazetteer,
+    carregar_tecnicos_por_sigla, recarregar_dados,
+    proximos_lote, sites_json, buscar_siglas, separar_siglas, tecnicos_por_sigla,
+    buscar_sites_texto, sites_no_raio, metricas_prometheus, resumo_metricas, saude_provedores,
+)
+
+SERVICO_MAX_K = 50
+SERVICO_MAX_CANDIDATOS = 500
+SERVICO_MAX_RAIO_KM = 500.0
+SERVICO_MAX_CORPO = 8 * 2**20
+
+class _ErroRequisicao(ValueError):
+    def __init__(self, mensagem: str, status: int = 400):
+        super().__init__(mensagem)
+        self.status = status
+
+# ------------------------------------------------------------
+# Validação dos parâmetros
+# ------------------------------------------------------------
+def _inteiro(valor, nome: str, minimo: int, maximo: int) -> int:
+    try:
+        v = int(valor)
+    except (TypeError, ValueError):
+        raise _ErroRequisicao(f"'{nome}' deve ser inteiro")
+    if not minimo <= v <= maximo:
+        raise _ErroRequisicao(f"'{nome}' deve estar entre {minimo} e {maximo}")
+    return v
+
+def _numero(valor, nome: str) -> float:
+    try:
+        v = float(valor)
+    except (TypeError, ValueError):
+        raise _ErroRequisicao(f"'{nome}' deve ser numérico")
+    if not math.isfinite(v):
+        raise _ErroRequisicao(f"'{nome}' deve ser um número finito")
+    return v
+
+def _coordenadas(lat, lon) -> tuple[float, float]:
+    lat, lon = _numero(lat, "lat"), _numero(lon, "lon")
+    if not -90 <= lat <= 90:
+        raise _ErroRequisicao("'lat' deve estar entre -90 e 90")
+    if not -180 <= lon <= 180:
+        raise _ErroRequisicao("'lon' deve estar entre -180 e 180")
+    return lat, lon
+
+# ------------------------------------------------------------
+# Rotas
+# ------------------------------------------------------------
+def _proximos(corpo: dict) -> dict:
+    consultas = corpo.get("consultas")
+    if not isinstance(consultas, list) or not all(isinstance(c, dict) for c in consultas):
+        raise _ErroRequisicao("'consultas' deve ser uma lista de objetos {lat, lon} ou {endereco}")
+    if len(consultas) > SERVICO_MAX_CONSULTAS:
+        raise _ErroRequisicao(f"no máximo {SERVICO_MAX_CONSULTAS} consultas por requisição", 413)
+    k = _inteiro(corpo.get("k", K_SITES_PROXIMOS), "k", 1, SERVICO_MAX_K)
+    n = _inteiro(corpo.get("n_candidatos", N_CANDIDATOS_ROTA), "n_candidatos", 1, SERVICO_MAX_CANDIDATOS)
+    return {"resultados": proximos_lote(consultas, k, bool(corpo.get("rotas")), bool(corpo.get("por_rota")),
+                                        bool(corpo.get("tecnicos")), n)}
+
+def _siglas(siglas) -> dict:
+    if isinstance(siglas, str):
+        siglas = separar_siglas(siglas)
+    if not isinstance(siglas, list):
+        raise _ErroRequisicao("'siglas' deve ser uma lista ou um texto separado por vírgulas")
+    if len(siglas) > SERVICO_MAX_CONSULTAS:
+        raise _ErroRequisicao(f"no máximo {SERVICO_MAX_CONSULTAS} siglas por requisição", 413)
+    df, faltando = buscar_siglas([str(s) for s in siglas])
+    sites = sites_json(df)
+    for s in sites:
+        s["tecnicos"] = list(tecnicos_por_sigla(s.get("sigla")))
+    return {"sites": sites, "faltando": faltando}
+
+def _raio(corpo: dict) -> dict:
+    lat, lon = _coordenadas(corpo.get("lat"), corpo.get("lon"))
+    raio_km = _numero(corpo.get("raio_km"), "raio_km")
+    if not 0 < raio_km <= SERVICO_MAX_RAIO_KM:
+        raise _ErroRequisicao(f"'raio_km' deve estar entre 0 e {SERVICO_MAX_RAIO_KM:g}")
+    tempo = corpo.get("tempo_max_min")
+    sites, dbg = sites_no_raio(lat, lon, raio_km, _numero(tempo, "tempo_max_min") if tempo else None)
+    return {"sites": sites_json(sites), "dbg": dbg}
+
+def _mapa(q: dict) -> dict:
+    zoom = _inteiro(q.get("zoom", MAPA_ZOOM_MIN), "zoom", MAPA_ZOOM_MIN, MAPA_ZOOM_MAX)
+    caixa = None
+    if q.get("caixa"):
+        caixa = [_numero(v, "caixa") for v in q["caixa"].split(",")]
+        if len(caixa) != 4:
+            raise _ErroRequisicao("'caixa' deve ser lat_min,lon_min,lat_max,lon_max")
+    limite = _inteiro(q.get("limite", MAPA_MAX_MARCADORES), "limite", 1, MAPA_MAX_MARCADORES)
+    return {"zoom": zoom, "grupos": sites_json(clusters_mapa(zoom, caixa, limite))}
+
+def _busca(q: dict) -> dict:
+    limite = _inteiro(q.get("limite", BUSCA_LIMITE), "limite", 1, 200)
+    return {"sites": sites_json(buscar_sites_texto(q.get("q", ""), limite))}
+
+class ServicoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "BuscaSites/1.0"
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def _responder(self, status: int, corpo, tipo: str = "application/json; charset=utf-8"):
+        b = corpo if isinstance(corpo, bytes) else json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def _ler_json(self) -> dict:
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        if tamanho > SERVICO_MAX_CORPO:
+            raise _ErroRequisicao("corpo da requisição grande demais", 413)
+        try:
+            corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+        except ValueError:
+            raise _ErroRequisicao("JSON inválido")
+        if not isinstance(corpo, dict):
+            raise _ErroRequisicao("o corpo deve ser um objeto JSON")
+        return corpo
+
+    def _tratar(self, rota):
+        try:
+            # planilha alterada em disco: relê só as abas que mudaram (stat barato quando nada mudou)
+            recarregar_dados()
+            self._responder(200, rota())
+        except _ErroRequisicao as e:
+            self._responder(e.status, {"erro": str(e)})
+        except Exception as e:
+            self._responder(500, {"erro": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        u = urlsplit(self.path)
+        q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+        if u.path == "/saude":
+            return self._responder(200, {"status": "ok", "pid": os.getpid(), "sites": len(carregar_dados()),
+                                         "provedores": saude_provedores()})
+        if u.path == "/metrics":
+            return self._responder(200, metricas_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+        if u.path == "/metrics.json":
+            return self._responder(200, resumo_metricas())
+        if u.path == "/v1/busca":
+            return self._tratar(lambda: _busca(q))
+        if u.path == "/v1/siglas":
+            return self._tratar(lambda: _siglas(q.get("siglas", "")))
+        if u.path == "/v1/mapa":
+            return self._tratar(lambda: _mapa(q))
+        return self._responder(404, {"erro": "rota não encontrada"})
+
+    def do_POST(self):
+        rotas = {
+            "/v1/proximos": lambda: _proximos(self._ler_json()),
+            "/v1/siglas": lambda: _siglas(self._ler_json().get("siglas")),
+            "/v1/raio": lambda: _raio(self._ler_json()),
+        }
+        rota = rotas.get(urlsplit(self.path).path)
+        if rota is None:
+            return self._responder(404, {"erro": "rota não encontrada"})
+        return self._tratar(rota)
+
+# ------------------------------------------------------------
+# Servidor e workers
+# ------------------------------------------------------------
+def criar_servidor(host: str = "127.0.0.1", port: int = 8080, verbose: bool = False):
+    """Cria o servidor (port=0 escolhe uma porta livre; ver srv.server_port)."""
+    srv = ThreadingHTTPServer((host, port), ServicoHandler)
+    srv.daemon_threads = True
+    srv.verbose = verbose
+    return srv
+
+def aquecer():
+    """Carrega base e índices uma vez (antes do fork, para os workers já nascerem prontos)."""
+    carregar_dados()
+    carregar_indice_espacial()
+    carregar_indice_sigla()
+    carregar_tecnicos_por_sigla()
+    carregar_indice_texto()
+    carregar_gazetteer()
+    carregar_clusters()
+
+def servir(srv, workers: int = 1):
+    """
+    workers=1: serve neste processo. workers>1 (POSIX): faz fork de `workers`
+    processos que aceitam conexões no mesmo socket; o processo pai só
+    substitui workers que morrerem e encerra todos no SIGTERM/SIGINT.
+    """
+    if workers <= 1 or not hasattr(os, "fork"):
+        try:
+            srv.serve_forever()
+        finally:
+            srv.server_close()
+        return
+
+    filhos = set()
+    parando = False
+
+    def novo_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            codigo = 0
+            try:
+                srv.serve_forever()
+            except BaseException:
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        filhos.add(pid)
+
+    def parar(*_):
+        nonlocal parando
+        parando = True
+        for pid in list(filhos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, parar)
+    signal.signal(signal.SIGINT, parar)
+    for _ in range(workers):
+        novo_worker()
+    while filhos:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        filhos.discard(pid)
+        if not parando:
+            novo_worker()
+    srv.server_close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Serviço HTTP/JSON de busca de sites mais próximos.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--workers", type=int, default=SERVICO_WORKERS,
+                    help="processos aceitando conexões (padrão: número de CPUs)")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    srv = criar_servidor(args.host, args.port, args.verbose)
+    aquecer()
+    print(f"Serviço em http://{args.host}:{srv.server_port} ({args.workers} worker(s); Ctrl+C para sair)",
+          file=sys.stderr)
+    try:
+        servir(srv, args.workers)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
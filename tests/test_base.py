@@ -0,0 +1,64 @@
+# Consultas usam uma única carga da base (frame + índices do mesmo BaseSites)
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+from engine import BaseSites
+
+
+def _base(ordem):
+    df = pd.DataFrame({
+        "sigla": ["AAA", "BBB", "CCC", "DDD"],
+        "nome": ["SITE A", "SITE B", "SITE C", "SITE D"],
+        "endereco": ["Rua A", "Rua B", "Rua C", "Rua D"],
+        "lat": np.array([-22.90, -22.95, -23.00, -22.70], dtype=np.float32),
+        "lon": np.array([-43.20, -43.25, -43.30, -43.00], dtype=np.float32),
+    }).iloc[ordem].reset_index(drop=True)
+    for c in ["sigla", "nome", "endereco"]:
+        df[c] = df[c].astype("string")
+    return BaseSites(df)
+
+
+@pytest.fixture
+def recarga_a_cada_chamada(monkeypatch):
+    """Cada chamada a carregar_base() devolve outra carga, com as linhas em outra ordem."""
+    cargas = itertools.cycle([_base([0, 1, 2, 3]), _base([3, 2, 1, 0])])
+    monkeypatch.setattr(engine, "carregar_base", lambda: next(cargas))
+
+
+def test_buscar_siglas(recarga_a_cada_chamada):
+    for _ in range(2):
+        df, faltando = engine.buscar_siglas(["BBB", "XXX"])
+        assert df["sigla"].tolist() == ["BBB"] and faltando == ["XXX"]
+
+
+def test_nearest_sites(recarga_a_cada_chamada):
+    for _ in range(2):
+        assert engine.nearest_sites(-22.95, -43.25, 1)["sigla"].tolist() == ["BBB"]
+
+
+def test_sites_no_raio(recarga_a_cada_chamada):
+    for _ in range(2):
+        sites, _ = engine.sites_no_raio(-22.90, -43.20, 1.0)
+        assert sites["sigla"].tolist() == ["AAA"]
+
+
+def test_clusters_mapa(recarga_a_cada_chamada):
+    for _ in range(2):
+        grupos = engine.clusters_mapa(engine.MAPA_ZOOM_MAX)
+        assert dict(zip(grupos["sigla"], grupos["lat"].astype(float).round(2))) == {
+            "AAA": -22.90, "BBB": -22.95, "CCC": -23.00, "DDD": -22.70}
+
+
+def test_indices_ficam_com_a_propria_carga():
+    a, b = _base([0, 1, 2, 3]), _base([3, 2, 1, 0])
+    assert a.df.iloc[engine.carregar_indice_sigla(a)["AAA"]]["sigla"].tolist() == ["AAA"]
+    assert b.df.iloc[engine.carregar_indice_sigla(b)["AAA"]]["sigla"].tolist() == ["AAA"]
+    assert engine.carregar_indice_sigla(a) is engine.carregar_indice_sigla(a)
@@ -0,0 +1,76 @@
+# Regressões do batch.py (leitura de CSV em blocos)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pytest
+
+from batch import (_gravar_progresso, _impressao_entrada, _ler_progresso, contar_linhas, ler_blocos,
+                   processar_lote, separador_csv)
+
+
+def _csv(tmp_path, texto: str) -> str:
+    caminho = tmp_path / "clientes.csv"
+    caminho.write_text(texto, encoding="utf-8")
+    return str(caminho)
+
+
+def test_csv_de_uma_coluna_nao_e_quebrado(tmp_path):
+    caminho = _csv(tmp_path, "endereco\nAvenida Brasil 500 Penha\nRua do Catete 100\n")
+    assert separador_csv(caminho) == ","
+    blocos = list(ler_blocos(caminho, tamanho=10))
+    assert list(blocos[0].columns) == ["endereco"]
+    assert blocos[0]["endereco"].tolist() == ["Avenida Brasil 500 Penha", "Rua do Catete 100"]
+
+
+def test_csv_ponto_e_virgula_com_virgula_no_endereco(tmp_path):
+    caminho = _csv(tmp_path, "id;endereco\n1;Rua A, 10, Centro\n2;Rua B, 20, Icaraí\n")
+    assert separador_csv(caminho) == ";"
+    df = pd.concat(ler_blocos(caminho, tamanho=1))
+    assert df["endereco"].tolist() == ["Rua A, 10, Centro", "Rua B, 20, Icaraí"]
+
+
+def test_csv_retomada_pula_linhas(tmp_path):
+    caminho = _csv(tmp_path, "endereco\nA\nB\nC\n")
+    df = pd.concat(ler_blocos(caminho, tamanho=10, pular=2))
+    assert df["endereco"].tolist() == ["C"]
+
+
+def test_contar_linhas_igual_aos_blocos(tmp_path):
+    # endereço entre aspas com quebra de linha conta como uma linha só
+    caminho = _csv(tmp_path, 'id;endereco\n1;"Rua A, 10\nCentro"\n2;Rua B\n3;Rua C\n')
+    assert contar_linhas(caminho) == 3 == len(pd.concat(ler_blocos(caminho, tamanho=2)))
+    with open(caminho, "rb") as f:
+        assert contar_linhas(f) == 3
+        assert f.tell() == 0   # o arquivo volta ao início para o processamento
+
+
+def test_progresso_nao_retoma_entrada_diferente_com_mesmo_nome(tmp_path):
+    caminho = _csv(tmp_path, "endereco\nA\nB\n")
+    saida = str(tmp_path / "saida.csv")
+    impressao = _impressao_entrada(caminho)
+    _gravar_progresso(saida, {"entrada": "clientes.csv", "impressao": impressao, "linhas": 1})
+    assert _ler_progresso(saida, "clientes.csv", impressao)["linhas"] == 1
+
+    _csv(tmp_path, "endereco\nX\nY\nZ\n")
+    assert _ler_progresso(saida, "clientes.csv", _impressao_entrada(caminho)) == {}
+
+
+def test_impressao_igual_para_caminho_e_arquivo_aberto(tmp_path):
+    caminho = _csv(tmp_path, "endereco\nA\n")
+    with open(caminho, "rb") as f:
+        f.readline()
+        assert _impressao_entrada(f) == _impressao_entrada(caminho)
+        assert f.tell() == len("endereco\n")
+
+
+def test_parquet_sem_pyarrow_falha_antes_de_processar(tmp_path, monkeypatch):
+    import importlib.util
+    caminho = _csv(tmp_path, "endereco\nA\n")
+    saida = tmp_path / "saida.parquet"
+    monkeypatch.setattr(importlib.util, "find_spec", lambda nome: None)
+    with pytest.raises(ValueError, match="pyarrow"):
+        processar_lote(caminho, str(saida))
+    assert not saida.exists()
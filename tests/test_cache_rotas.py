@@ -0,0 +1,54 @@
+# Cache persistente de rotas: descarte LRU acima do limite
+import itertools
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import engine
+
+LIMITE = 20
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    db = str(tmp_path / "geocode.sqlite")
+    monkeypatch.setattr(engine, "GEOCODE_DB", db)
+    monkeypatch.setattr(engine, "_geocache_pronto", False)
+    monkeypatch.setattr(engine, "_rotacache_pronto", False)
+    monkeypatch.setattr(engine, "_lru_inseridos", {})
+    monkeypatch.setattr(engine, "ROTAS_CACHE_MAX_ITENS", LIMITE)
+    relogio = itertools.count(1_700_000_000)   # acessos sempre em ordem, sem empate
+    monkeypatch.setattr(engine.time, "time", lambda: float(next(relogio)))
+    return db
+
+
+def _linhas(db):
+    with sqlite3.connect(db) as con:
+        return {c for (c,) in con.execute("SELECT celula FROM rota")}
+
+
+def test_lru_descarta_menos_acessados_acima_do_limite(banco):
+    engine._rotacache_put("quente", [("S1", -22.9, -43.2, 1000.0, 120.0)])
+    for i in range(60):
+        engine._rotacache_put(f"c{i:02d}", [("S1", -22.9, -43.2, 1000.0, 120.0)])
+        assert engine._rotacache_get("quente", ["S1"])  # sempre o acesso mais recente
+        # o descarte roda de vez em quando: a tabela nunca passa do limite + folga
+        assert len(_linhas(banco)) <= LIMITE * (1 + engine.LRU_FOLGA) + 1
+
+    restantes = _linhas(banco)
+    assert "quente" in restantes
+    assert "c00" not in restantes and "c30" not in restantes
+    assert {"c58", "c59"} <= restantes
+
+
+def test_descarte_so_depois_da_folga(banco, monkeypatch):
+    monkeypatch.setattr(engine, "ROTAS_CACHE_MAX_ITENS", 1000)   # poda a cada 100 linhas
+    for i in range(40):
+        engine._rotacache_put(f"c{i:02d}", [("S1", -22.9, -43.2, 1000.0, 120.0)])
+    assert engine._lru_inseridos["rota"] == 40
+    engine._rotacache_put("lote", [(f"S{j}", -22.9, -43.2, 1000.0, 120.0) for j in range(60)])
+    assert engine._lru_inseridos["rota"] == 0
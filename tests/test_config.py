@@ -0,0 +1,30 @@
+# Leitura de configuração: secrets.toml primeiro, variável de ambiente depois
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import engine
+
+
+@pytest.mark.parametrize("secret", ["", "   ", "\t\n"])
+def test_secret_vazio_deixa_a_variavel_de_ambiente_valer(monkeypatch, secret):
+    monkeypatch.setitem(engine._SECRETS, "GEOAPIFY_KEY", secret)
+    monkeypatch.setenv("GEOAPIFY_KEY", "chave-do-ambiente")
+    assert engine._config("GEOAPIFY_KEY", "") == "chave-do-ambiente"
+
+
+def test_secret_preenchido_prevalece(monkeypatch):
+    monkeypatch.setitem(engine._SECRETS, "GEOAPIFY_KEY", "chave-do-secrets")
+    monkeypatch.setenv("GEOAPIFY_KEY", "chave-do-ambiente")
+    assert engine._config("GEOAPIFY_KEY", "") == "chave-do-secrets"
+
+
+def test_vazio_nos_dois_usa_o_padrao(monkeypatch):
+    monkeypatch.setitem(engine._SECRETS, "OSRM_BLOCO", " ")
+    monkeypatch.setenv("OSRM_BLOCO", "")
+    assert engine._config("OSRM_BLOCO", 25) == 25
+    monkeypatch.setitem(engine._SECRETS, "OSRM_BLOCO", 0)   # número 0 não é "vazio"
+    assert engine._config("OSRM_BLOCO", 25) == 0
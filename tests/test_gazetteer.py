@@ -0,0 +1,45 @@
+# Geocodificação offline pelo gazetteer das torres
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine import construir_gazetteer, geocodificar_gazetteer
+
+
+@pytest.fixture(scope="module")
+def gz():
+    df = pd.DataFrame({
+        "lat": [-22.984, -22.985, -22.545, -22.546],
+        "lon": [-43.205, -43.206, -44.171, -44.172],
+        "endereco": ["Rua Visconde de Pirajá 300", "Rua Visconde de Pirajá 500",
+                     "Rua Rubens Barcellos 195, Centro", "Avenida Joaquim Leite 10, Centro"],
+        "nome": ["IPANEMA", "IPANEMA", "BARRA MANSA - CENTRO", "BARRA MANSA - CENTRO"],
+        "cidade": ["Rio de Janeiro", "Rio de Janeiro", "Barra Mansa", "Barra Mansa"],
+    })
+    df["endereco"] = df["endereco"].astype("string")
+    return construir_gazetteer(df)
+
+
+def test_so_bairro_nao_vira_rua(gz):
+    res, dbg = geocodificar_gazetteer(gz, "Centro, Barra Mansa")
+    assert res is not None
+    assert dbg["nivel"] == "bairro"
+    assert dbg["confianca"] <= 0.5
+
+
+def test_rua_casada_tem_confianca_alta(gz):
+    res, dbg = geocodificar_gazetteer(gz, "Rua Visconde de Pirajá 400, Ipanema, Rio de Janeiro")
+    assert dbg["nivel"] == "rua"
+    assert dbg["confianca"] > 0.9
+    assert np.isclose(res["lat"], -22.9845, atol=1e-3)
+
+
+def test_rua_desconhecida_limita_confianca(gz):
+    _, dbg = geocodificar_gazetteer(gz, "Rua Inventada 12, Ipanema, Rio de Janeiro")
+    assert dbg["nivel"] == "bairro"
+    assert dbg["confianca"] <= 0.5
@@ -0,0 +1,73 @@
+# Geocodificação concorrente (hedge entre provedores) contra dois servidores falsos
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import engine
+import fake_osm_server
+
+ENDERECO = "Rua Visconde de Pirajá 300, Ipanema, Rio de Janeiro"
+
+
+@pytest.fixture
+def provedores(tmp_path, monkeypatch):
+    """iniciar(geoapify={...}, nominatim={...}) sobe um servidor falso para cada provedor."""
+    servidores = []
+    monkeypatch.setattr(engine, "GEOCODE_DB", str(tmp_path / "geocode.sqlite"))
+    monkeypatch.setattr(engine, "_geocache_pronto", False)
+    monkeypatch.setattr(engine, "limitar", lambda provedor: 0.0)
+    monkeypatch.setattr(engine, "GEOAPIFY_KEY", "teste")
+    monkeypatch.setattr(engine, "GEOCODE_GRACA_S", 0.2)
+    for nome in ("geoapify", "nominatim"):
+        monkeypatch.setitem(engine.SAUDE, nome, engine.SaudeProvedor(nome, engine.SAUDE[nome].timeout_base))
+
+    def iniciar(geoapify: dict, nominatim: dict):
+        geo = fake_osm_server.criar_servidor(**geoapify)
+        nom = fake_osm_server.criar_servidor(**nominatim)
+        servidores.extend([geo, nom])
+        monkeypatch.setattr(engine, "GEOAPIFY_URL", fake_osm_server.iniciar_em_thread(geo))
+        monkeypatch.setattr(engine, "NOMINATIM_URL", fake_osm_server.iniciar_em_thread(nom))
+        return geo, nom
+
+    yield iniciar
+    for srv in servidores:
+        srv.shutdown()
+
+
+def _geocodificar():
+    t = time.perf_counter()
+    res, dbg = engine.geocode_address(ENDERECO, concorrente=True, offline="nao")
+    return res, dbg, time.perf_counter() - t
+
+
+def test_provedor_lento_e_ignorado(provedores, monkeypatch):
+    monkeypatch.setattr(engine, "GEOCODE_HEDGE_S", 0.1)
+    geo, nom = provedores(geoapify={"latencia_ms": 1500}, nominatim={})
+    res, dbg, decorrido = _geocodificar()
+    # o Nominatim sai 0,1 s depois e responde; o Geoapify ainda não voltou
+    assert res is not None and dbg["provider"] == "nominatim"
+    assert decorrido < 1.0
+    assert geo.requisicoes == 1 and nom.requisicoes == 1
+
+
+def test_primeiro_provedor_bom_vence_e_o_resto_nao_sai(provedores, monkeypatch):
+    monkeypatch.setattr(engine, "GEOCODE_HEDGE_S", 0.5)
+    geo, nom = provedores(geoapify={"latencia_ms": 100}, nominatim={})
+    res, dbg, decorrido = _geocodificar()
+    assert res is not None and dbg["provider"] == "geoapify"
+    assert decorrido < 0.5
+    time.sleep(0.6)     # o hedge do Nominatim teria saído aqui: foi cancelado
+    assert geo.requisicoes == 1 and nom.requisicoes == 0
+
+
+def test_falha_rapida_dispara_o_proximo_sem_esperar(provedores, monkeypatch):
+    monkeypatch.setattr(engine, "GEOCODE_HEDGE_S", 2.0)
+    geo, nom = provedores(geoapify={"taxa_erro": 1.0}, nominatim={})
+    res, dbg, decorrido = _geocodificar()
+    assert res is not None and dbg["provider"] == "nominatim"
+    assert decorrido < 1.0
+    assert geo.requisicoes == 1 and nom.requisicoes == 1
@@ -0,0 +1,118 @@
+# Índice espacial em grade: k-NN comparado com a varredura completa (Haversine)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from engine import construir_indice_espacial, haversine_km, knn_indice, raio_indice
+
+
+def _knn_forca_bruta(lats, lons, lat, lon, k):
+    d = haversine_km(lat, lon, lats, lons)
+    ok = np.flatnonzero(np.isfinite(d))
+    return np.sort(d[ok])[:k]
+
+
+def _raio_forca_bruta(lats, lons, lat, lon, raio_km):
+    d = haversine_km(lat, lon, lats, lons)
+    return np.sort(np.flatnonzero(d <= raio_km))
+
+
+def _pontos(seed, n, lat=(-23.4, -20.7), lon=(-44.9, -40.9)):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(*lat, n), rng.uniform(*lon, n)
+
+
+@pytest.mark.parametrize("cell_deg", [None, 0.01, 0.3])
+def test_knn_igual_forca_bruta(cell_deg):
+    lats, lons = _pontos(1, 2000)
+    lats[::97] = np.nan  # linhas sem coordenada ficam fora do índice
+    idx = construir_indice_espacial(lats, lons, cell_deg)
+    for lat, lon in zip(*_pontos(2, 50, lat=(-24.0, -20.0), lon=(-46.0, -40.0))):
+        for k in (1, 3, 25):
+            pos, dist = knn_indice(idx, lat, lon, k)
+            assert np.allclose(dist, _knn_forca_bruta(lats, lons, lat, lon, k))
+            assert np.allclose(haversine_km(lat, lon, lats[pos], lons[pos]), dist)
+
+
+def test_knn_k_maior_que_n():
+    lats, lons = _pontos(3, 7)
+    idx = construir_indice_espacial(lats, lons)
+    pos, dist = knn_indice(idx, -22.9, -43.2, 50)
+    assert sorted(pos.tolist()) == list(range(7))
+    assert np.allclose(dist, _knn_forca_bruta(lats, lons, -22.9, -43.2, 50))
+    assert len(knn_indice(construir_indice_espacial([], []), -22.9, -43.2, 3)[0]) == 0
+
+
+def test_knn_origem_longe_da_grade():
+    lats, lons = _pontos(4, 500)
+    idx = construir_indice_espacial(lats, lons)
+    for lat, lon in [(-30.0, -50.0), (10.0, -43.0), (-22.0, 20.0)]:
+        _, dist = knn_indice(idx, lat, lon, 5)
+        assert np.allclose(dist, _knn_forca_bruta(lats, lons, lat, lon, 5))
+
+
+def test_knn_antimeridiano():
+    # pontos dos dois lados de ±180°: o vizinho mais perto está "do outro lado" da grade
+    lats, lons = _pontos(5, 400, lat=(-20.0, -10.0), lon=(170.0, 180.0))
+    lats2, lons2 = _pontos(6, 400, lat=(-20.0, -10.0), lon=(-180.0, -170.0))
+    lats, lons = np.concatenate([lats, lats2]), np.concatenate([lons, lons2])
+    idx = construir_indice_espacial(lats, lons)
+    for lat, lon in [(-15.0, 179.99), (-15.0, -179.99), (-12.0, 175.0)]:
+        for k in (1, 10):
+            _, dist = knn_indice(idx, lat, lon, k)
+            assert np.allclose(dist, _knn_forca_bruta(lats, lons, lat, lon, k))
+
+
+def test_knn_polo():
+    # perto do polo, longitudes distantes ficam a poucos km
+    lats, lons = _pontos(7, 600, lat=(85.0, 90.0), lon=(-180.0, 180.0))
+    idx = construir_indice_espacial(lats, lons)
+    for lat, lon in [(89.99, 0.0), (89.5, 179.0), (86.0, -90.0), (90.0, 0.0)]:
+        for k in (1, 10):
+            _, dist = knn_indice(idx, lat, lon, k)
+            assert np.allclose(dist, _knn_forca_bruta(lats, lons, lat, lon, k))
+
+
+@pytest.mark.parametrize("cell_deg", [None, 0.01, 0.3])
+def test_raio_igual_forca_bruta(cell_deg):
+    lats, lons = _pontos(8, 2000)
+    lats[::89] = np.nan
+    idx = construir_indice_espacial(lats, lons, cell_deg)
+    for lat, lon in zip(*_pontos(9, 50, lat=(-24.0, -20.0), lon=(-46.0, -40.0))):
+        for raio in (0.5, 5.0, 40.0, 500.0):
+            pos, dist = raio_indice(idx, lat, lon, raio)
+            assert np.array_equal(np.sort(pos), _raio_forca_bruta(lats, lons, lat, lon, raio))
+            assert np.all(np.diff(dist) >= 0)
+            assert np.allclose(haversine_km(lat, lon, lats[pos], lons[pos]), dist)
+
+
+def test_raio_vazio():
+    lats, lons = _pontos(10, 50)
+    idx = construir_indice_espacial(lats, lons)
+    assert len(raio_indice(idx, -22.9, -43.2, 0)[0]) == 0
+    assert len(raio_indice(idx, 10.0, 10.0, 5.0)[0]) == 0
+    assert len(raio_indice(construir_indice_espacial([], []), -22.9, -43.2, 5.0)[0]) == 0
+
+
+def test_raio_antimeridiano():
+    lats, lons = _pontos(11, 400, lat=(-20.0, -10.0), lon=(170.0, 180.0))
+    lats2, lons2 = _pontos(12, 400, lat=(-20.0, -10.0), lon=(-180.0, -170.0))
+    lats, lons = np.concatenate([lats, lats2]), np.concatenate([lons, lons2])
+    idx = construir_indice_espacial(lats, lons)
+    for lat, lon in [(-15.0, 179.99), (-15.0, -179.99), (-12.0, 175.0)]:
+        for raio in (20.0, 150.0, 800.0):
+            pos, _ = raio_indice(idx, lat, lon, raio)
+            assert np.array_equal(np.sort(pos), _raio_forca_bruta(lats, lons, lat, lon, raio))
+
+
+def test_raio_polo():
+    lats, lons = _pontos(13, 600, lat=(85.0, 90.0), lon=(-180.0, 180.0))
+    idx = construir_indice_espacial(lats, lons)
+    for lat, lon in [(89.99, 0.0), (89.5, 179.0), (86.0, -90.0), (90.0, 0.0)]:
+        for raio in (30.0, 100.0, 400.0):
+            pos, _ = raio_indice(idx, lat, lon, raio)
+            assert np.array_equal(np.sort(pos), _raio_forca_bruta(lats, lons, lat, lon, raio))
@@ -0,0 +1,105 @@
+# Matriz muitos-para-muitos: top-k em blocos e ladrilhos OSRM contra a força bruta
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+import engine
+import fake_osm_server
+from engine import haversine_km, haversine_topk
+
+
+def _pontos(seed, n):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-23.4, -20.7, n), rng.uniform(-44.9, -40.9, n)
+
+
+@pytest.mark.parametrize("mem_mb", [0.0005, 0.01, 0.2, 64])
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_topk_igual_forca_bruta(mem_mb, k):
+    lat_o, lon_o = _pontos(1, 300)
+    lat_d, lon_d = _pontos(2, 700)
+    lat_o[::50] = np.nan
+    lat_d[::70] = np.nan
+    idx, dist = haversine_topk(lat_o, lon_o, lat_d, lon_d, k, mem_mb=mem_mb)
+    assert idx.shape == dist.shape == (300, k)
+    for i in range(300):
+        if not np.isfinite(lat_o[i]):
+            assert (idx[i] == -1).all() and np.isnan(dist[i]).all()
+            continue
+        d = haversine_km(lat_o[i], lon_o[i], lat_d, lon_d)
+        esperado = np.sort(d[np.isfinite(d)])[:k]
+        # float32: compara as distâncias e confere que cada índice aponta para a sua
+        assert np.allclose(dist[i], esperado, rtol=1e-4, atol=1e-3)
+        assert np.allclose(d[idx[i]], dist[i], rtol=1e-4, atol=1e-3)
+        assert len(set(idx[i].tolist())) == k
+
+
+def test_topk_k_maior_que_destinos():
+    lat_o, lon_o = _pontos(3, 10)
+    lat_d, lon_d = _pontos(4, 4)
+    idx, dist = haversine_topk(lat_o, lon_o, lat_d, lon_d, 6, mem_mb=0.0001)
+    assert (idx[:, 4:] == -1).all() and np.isnan(dist[:, 4:]).all()
+    assert (np.sort(idx[:, :4], axis=1) == np.arange(4)).all()
+
+
+@pytest.fixture
+def osrm_falso(monkeypatch):
+    servidores = []
+
+    def iniciar(**kw):
+        srv = fake_osm_server.criar_servidor(**kw)
+        servidores.append(srv)
+        monkeypatch.setattr(engine, "OSRM_URL", fake_osm_server.iniciar_em_thread(srv))
+        return srv
+
+    # circuito próprio do teste, sem herdar falhas de outros testes
+    monkeypatch.setitem(engine.SAUDE, "osrm", engine.SaudeProvedor("osrm", engine.SAUDE["osrm"].timeout_base))
+    monkeypatch.setattr(engine, "OSRM_MAX_COORDS", 12)
+    engine._osrm_ladrilho.cache_clear()
+    yield iniciar
+    engine._osrm_ladrilho.cache_clear()
+    for srv in servidores:
+        srv.shutdown()
+
+
+def _esperado(origens, destinos):
+    d = np.array([[fake_osm_server._haversine_m(a, b, c, e) * fake_osm_server.FATOR_DESVIO
+                   for c, e in destinos] for a, b in origens])
+    return np.round(d / (fake_osm_server.VELOCIDADE_KMH / 3.6), 1), np.round(d, 1)
+
+
+def test_matriz_ladrilhada_igual_forca_bruta(osrm_falso):
+    srv = osrm_falso(max_table_size=12)
+    origens = list(zip(*_pontos(5, 7)))
+    destinos = list(zip(*_pontos(6, 23)))
+    dur, dist, dbg = engine.osrm_matriz(origens, destinos, fontes_por_ladrilho=3)
+    # 3 fontes + 9 destinos por ladrilho: 3 × 3 ladrilhos, todos dentro do limite do servidor
+    assert dbg["status"] == "Ok" and dbg["ladrilhos"] == 9 and srv.requisicoes == 9
+    t, m = _esperado(origens, destinos)
+    assert np.allclose(dur, t) and np.allclose(dist, m)
+
+
+def test_matriz_parcial_mantem_ladrilhos_bons(osrm_falso, monkeypatch):
+    monkeypatch.setattr(engine, "CIRCUITO_FALHAS", 10**6)       # o circuito não abre no meio do teste
+    monkeypatch.setattr(engine, "CIRCUITO_TAXA_ERRO", 2.0)
+    osrm_falso(max_table_size=12, taxa_erro=0.5, seed=3)
+    origens = list(zip(*_pontos(7, 8)))
+    destinos = list(zip(*_pontos(8, 30)))
+    dur, dist, dbg = engine.osrm_matriz(origens, destinos, fontes_por_ladrilho=4)
+    assert dbg["status"] == "PARTIAL" and 0 < dbg["falhas"] < dbg["ladrilhos"]
+
+    t, m = _esperado(origens, destinos)
+    vazios = 0
+    for i in range(0, 8, 4):
+        for j in range(0, 30, 8):
+            bloco = dur[i:i + 4, j:j + 8]
+            if np.isnan(bloco).all():
+                vazios += 1     # ladrilho que falhou fica NaN, sem deslocar os outros
+            else:
+                assert np.allclose(bloco, t[i:i + 4, j:j + 8])
+                assert np.allclose(dist[i:i + 4, j:j + 8], m[i:i + 4, j:j + 8])
+    assert vazios == dbg["falhas"]
@@ -0,0 +1,15 @@
+# Exposição das métricas no formato texto do Prometheus
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine
+
+
+def test_valor_de_rotulo_escapado(monkeypatch):
+    monkeypatch.setattr(engine, "_CONTADORES", {})
+    engine.contar("busca_sites_requisicoes_total", provedor='C:\\geo "x"\nfim', status="OK")
+    linhas = [l for l in engine.metricas_prometheus().splitlines()
+              if l.startswith("busca_sites_requisicoes_total{")]
+    assert linhas == ['busca_sites_requisicoes_total{provedor="C:\\\\geo \\"x\\"\\nfim",status="OK"} 1']
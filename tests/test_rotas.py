@@ -0,0 +1,74 @@
+# Reordenação por tempo de rota: N candidatos em vários blocos OSRM paralelos
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import engine
+import fake_osm_server
+
+LATENCIA_MS = 200
+
+
+@pytest.fixture
+def osrm_falso(monkeypatch):
+    srv = fake_osm_server.criar_servidor(latencia_ms=LATENCIA_MS)
+    monkeypatch.setattr(engine, "OSRM_URL", fake_osm_server.iniciar_em_thread(srv))
+    monkeypatch.setattr(engine, "ROTAS_CACHE_PRECISAO", 0)  # toda rota vai ao servidor
+    engine.osrm_table.cache_clear()
+    yield srv
+    srv.shutdown()
+
+
+@pytest.fixture
+def base(monkeypatch):
+    rng = np.random.default_rng(7)
+    n = 300
+    df = pd.DataFrame({
+        "sigla": pd.array([f"S{i:03d}" for i in range(n)], dtype="string"),
+        "nome": pd.array([f"SITE {i}" for i in range(n)], dtype="string"),
+        "lat": rng.uniform(-23.0, -22.8, n).astype(np.float32),
+        "lon": rng.uniform(-43.4, -43.1, n).astype(np.float32),
+    })
+    b = engine.BaseSites(df)
+    monkeypatch.setattr(engine, "carregar_base", lambda: b)
+    return df
+
+
+def _duracao_esperada(lat, lon, df):
+    d = np.array([fake_osm_server._haversine_m(lat, lon, float(a), float(o)) for a, o in zip(df["lat"], df["lon"])])
+    return np.round(d * fake_osm_server.FATOR_DESVIO / (fake_osm_server.VELOCIDADE_KMH / 3.6), 1)
+
+
+def test_candidatos_acima_do_bloco_viram_blocos_paralelos(osrm_falso, base):
+    lat, lon, k, n = -22.9, -43.25, 5, 70
+    bloco = engine.OSRM_BLOCO
+    antes = osrm_falso.requisicoes
+    t = time.perf_counter()
+    sites, dbg = engine.nearest_sites_por_rota(lat, lon, k, n)
+    decorrido = time.perf_counter() - t
+
+    assert osrm_falso.requisicoes - antes == math.ceil(n / bloco)
+    assert dbg["status"] == "Ok" and dbg["blocos"] == math.ceil(n / bloco) > 1
+    # três blocos em paralelo: bem menos que três latências em sequência
+    assert decorrido < 2.5 * LATENCIA_MS / 1000
+
+    # ranking final = os k de menor tempo entre os n mais próximos em linha reta
+    candidatos = engine.nearest_sites(lat, lon, n)
+    esperado = candidatos.assign(t=_duracao_esperada(lat, lon, candidatos))
+    esperado = esperado.sort_values(["t", "dist_km_linear"], kind="stable").head(k)
+    assert sites["sigla"].tolist() == esperado["sigla"].tolist()
+    assert np.allclose(sites["duracao_s"].astype(float), esperado["t"])
+
+
+def test_n_candidatos_chega_ao_osrm_pelo_lote(osrm_falso, base):
+    antes = osrm_falso.requisicoes
+    res = engine.proximos_lote([{"lat": -22.95, "lon": -43.3}], k=3, por_rota=True, n_candidatos=100)
+    assert res[0]["status"] == "OK" and len(res[0]["sites"]) == 3
+    assert osrm_falso.requisicoes - antes == math.ceil(100 / engine.OSRM_BLOCO)
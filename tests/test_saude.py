@@ -0,0 +1,65 @@
+# Circuit breaker dos provedores, exercitado com o modo 503 do servidor falso
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import engine
+import fake_osm_server
+
+ESPERA_S = 0.3
+DESTINOS = [(-22.91, -43.21), (-22.95, -43.18)]
+
+
+@pytest.fixture
+def osrm_falso(monkeypatch):
+    srv = fake_osm_server.criar_servidor(taxa_erro=1.0)
+    monkeypatch.setattr(engine, "OSRM_URL", fake_osm_server.iniciar_em_thread(srv))
+    monkeypatch.setitem(engine.SAUDE, "osrm", engine.SaudeProvedor("osrm", engine.SAUDE["osrm"].timeout_base))
+    monkeypatch.setattr(engine, "CIRCUITO_ESPERA_S", ESPERA_S)
+    engine.osrm_table.cache_clear()
+    yield srv
+    engine.osrm_table.cache_clear()
+    srv.shutdown()
+
+
+def _chamar():
+    return engine.osrm_table(-22.9, -43.2, DESTINOS)[1]["status"]
+
+
+def test_abre_apos_falhas_seguidas_e_fecha_com_a_sonda(osrm_falso):
+    saude = engine.SAUDE["osrm"]
+    for _ in range(engine.CIRCUITO_FALHAS):
+        assert _chamar() == "EXCEPTION"     # 503
+    assert saude.estado == "aberto"
+
+    # aberto: nem chega ao servidor
+    antes = osrm_falso.requisicoes
+    assert _chamar() == "CIRCUIT_OPEN"
+    assert osrm_falso.requisicoes == antes
+
+    # passada a espera, uma sonda; o servidor voltou, o circuito fecha
+    time.sleep(ESPERA_S + 0.05)
+    osrm_falso.taxa_erro = 0.0
+    assert _chamar() == "Ok"
+    assert saude.estado == "fechado"
+    assert osrm_falso.requisicoes == antes + 1
+    assert _chamar() == "Ok"
+
+
+def test_sonda_que_falha_reabre(osrm_falso):
+    saude = engine.SAUDE["osrm"]
+    for _ in range(engine.CIRCUITO_FALHAS):
+        _chamar()
+    assert saude.estado == "aberto"
+
+    # a sonda cai no 503: volta a abrir sem deixar passar a próxima chamada
+    time.sleep(ESPERA_S + 0.05)
+    antes = osrm_falso.requisicoes
+    assert _chamar() == "EXCEPTION"
+    assert osrm_falso.requisicoes == antes + 1
+    assert saude.estado == "aberto"
+    assert _chamar() == "CIRCUIT_OPEN"
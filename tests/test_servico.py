@@ -0,0 +1,31 @@
+# Validação de parâmetros do servico.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from servico import _ErroRequisicao, _coordenadas, _mapa, _numero
+
+
+@pytest.mark.parametrize("valor", ["nan", "inf", "-inf", float("nan"), float("inf")])
+def test_numero_recusa_nao_finitos(valor):
+    with pytest.raises(_ErroRequisicao) as erro:
+        _numero(valor, "lat")
+    assert erro.value.status == 400
+
+
+@pytest.mark.parametrize("lat, lon", [(91, 0), (-90.5, 0), (0, 180.1), (0, -181)])
+def test_coordenadas_fora_da_faixa(lat, lon):
+    with pytest.raises(_ErroRequisicao):
+        _coordenadas(lat, lon)
+
+
+def test_coordenadas_validas():
+    assert _coordenadas("-22.9", -43.2) == (-22.9, -43.2)
+
+
+def test_caixa_do_mapa_recusa_nan():
+    with pytest.raises(_ErroRequisicao):
+        _mapa({"zoom": "12", "caixa": "nan,0,1,1"})